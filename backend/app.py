@@ -4,7 +4,7 @@ CounselorHub Backend API Server
 Flask REST API server for the CounselorHub student counseling system
 """
 
-from flask import Flask, request, jsonify, send_from_directory, render_template_string
+from flask import Flask, request, jsonify, send_from_directory, render_template_string, has_request_context
 from flask_cors import CORS
 import mysql.connector
 from mysql.connector import Error
@@ -14,13 +14,51 @@ from datetime import datetime, date
 import json
 import logging
 from image_service import image_service
+from db_pool import ConnectionPool, pool_settings_from_env
+import db_session
+from pagination import Keyset, KeyColumn, InvalidCursorError, fetch_page
+from list_query import ListQuery
+from projection import Field, FieldSet, InvalidFieldsError, isoformat, split_list
+from count_engine import count_engine, parse_count_args, count_pages
+from reference_cache import reference_cache
+from invalidation_bus import bus_from_env
+from conditional import tables_etag, payload_etag, request_variant, bump_table_versions
+import compact
+from compact import UnsupportedFormatError
+from export_stream import ExportBusyError, streamer_from_env, ndjson_chunks, csv_chunks, NDJSON_MIMETYPE, CSV_MIMETYPE
+from json_provider import provider_for
+from compression import compressor_from_env
+from static_assets import site_from_env
+from sync_feed import SyncEntity, sync_horizon, fetch_changes, record_deletions, encode_watermark, decode_watermark
 from werkzeug.exceptions import RequestEntityTooLarge
-from flask import send_file, abort
+from flask import send_file, abort, redirect, Response, Request, make_response
+from functools import wraps
+from werkzeug.wsgi import wrap_file
+import mimetypes
 import os
 import time
 
+# Request body limits per endpoint (bytes); other endpoints use MAX_CONTENT_LENGTH.
+# Werkzeug rejects a larger Content-Length before reading the body, and stops
+# reading bodies sent without one as soon as they pass the limit.
+REQUEST_SIZE_LIMITS = {
+    'upload_image': image_service.max_size_bytes + 64 * 1024,  # multipart overhead
+    'create_students_batch': int(os.environ.get('MAX_BATCH_REQUEST_MB', 64)) * 1024 * 1024
+}
+
+class SizeLimitedRequest(Request):
+    @property
+    def max_content_length(self):
+        limit = REQUEST_SIZE_LIMITS.get(self.endpoint)
+        return limit if limit is not None else super().max_content_length
+
 # Configure Flask to serve static files from dist folder
 app = Flask(__name__, static_folder='../dist', static_url_path='')
+app.request_class = SizeLimitedRequest
+# jsonify() and request.get_json() go through orjson when it is installed
+app.json = provider_for(app)
+# Enough for a JSON body carrying one base64 photo
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_REQUEST_MB', 16)) * 1024 * 1024
 
 # Configure CORS with more permissive settings for development
 CORS(app, 
@@ -43,15 +81,131 @@ DB_CONFIG = {
     'charset': 'utf8mb4'
 }
 
+# Shared connection pool (sized via DB_POOL_* environment variables)
+db_pool = ConnectionPool(DB_CONFIG, **pool_settings_from_env())
+
+# Release each request's connection in the teardown hook
+db_session.init_app(app)
+
+# Exports stream on connections of their own (EXPORT_* environment variables)
+export_streamer = streamer_from_env(db_pool)
+
+# Cache invalidations reach the other workers through the bus (CACHE_BUS)
+invalidation_bus = bus_from_env(db_pool)
+reference_cache.attach(invalidation_bus)
+
+@app.before_request
+def start_invalidation_bus():
+    invalidation_bus.ensure_started()
+
 def get_db_connection():
-    """Get database connection"""
+    """
+    Get the database connection for the current request.
+    The connection is checked out from the pool on first use and returned
+    automatically when the request ends; outside a request a plain pooled
+    connection is returned and the caller must close() it.
+    """
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
+        if has_request_context():
+            return db_session.get_db(db_pool)
+        connection = db_pool.acquire()
         return connection
     except Error as e:
         logger.error(f"Error connecting to database: {e}")
         return None
 
+def store_photo(value):
+    """
+    Move an inline base64 photo (data URL) into image storage so that only
+    its /api/images URL is kept in users.photo. Other values are kept as is.
+    Returns (photo, error).
+    """
+    if not image_service.is_data_url(value):
+        return value, None
+    
+    result = image_service.save_data_url(value)
+    if 'error' in result:
+        return None, result['error']
+    return result['file_info']['url'], None
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def list_response(payload, items_key=None):
+    """
+    Response for a list payload: JSON, or the columnar/MessagePack encoding
+    the client negotiated (see compact.py). items_key names the list inside
+    the payload; None when the payload is the list itself. Other payloads
+    (single records) are always JSON.
+    """
+    response_format = compact.negotiate(request)
+    if response_format == 'json' or (items_key is None and not isinstance(payload, list)):
+        response = jsonify(payload)
+    else:
+        body, mimetype = compact.encode(payload, items_key, response_format)
+        response = Response(body, mimetype=mimetype)
+    response.vary.add('Accept')
+    return response
+
+def json_with_etag(payload, etag, items_key=None):
+    """List response for a payload with a known ETag, or 304 if the client has it"""
+    response_format = compact.negotiate(request)
+    if response_format != 'json':
+        etag = f"{etag}-{response_format}"
+    if request.if_none_match.contains_weak(etag):
+        return not_modified(etag)
+    response = list_response(payload, items_key)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+def cached_json(namespace, key, load, items_key=None):
+    """
+    Serve a reference-cache entry with an ETag computed once when it is
+    loaded, so revalidations cost neither a query nor serialization.
+    Returns None when load() found nothing.
+    """
+    def load_with_etag():
+        payload = load()
+        return payload, payload_etag(payload) if payload is not None else None
+    
+    payload, etag = reference_cache.get_or_load(namespace, key, load_with_etag)
+    if payload is None:
+        return None
+    return json_with_etag(payload, etag, items_key)
+
+def conditional_get(*tables):
+    """
+    Answer If-None-Match with 304 from the change stamps of the tables a view
+    reads, before the view runs its queries; 200 responses carry the ETag.
+    The stamps are read on the request's connection, in the same snapshot as
+    the view's own queries.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = None
+            connection = get_db_connection()
+            if connection:
+                try:
+                    etag = tables_etag(connection.cursor(), tables, *request_variant(request), compact.negotiate(request))
+                except Error as e:
+                    logger.warning(f"Could not compute ETag for {request.path}: {e}")
+            
+            if etag and request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+            
+            response = make_response(view(*args, **kwargs))
+            if etag and response.status_code == 200:
+                response.set_etag(etag)
+                response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
 def dict_factory(cursor, row):
     """Convert MySQL row to dictionary"""
     columns = [col[0] for col in cursor.description]
@@ -68,6 +222,13 @@ def handle_preflight():
         response.headers.add("Access-Control-Allow-Credentials", "true")
         return response
 
+# Compress responses for the clients that accept it (COMPRESS_* environment variables)
+response_compressor = compressor_from_env()
+
+@app.after_request
+def compress_response(response):
+    return response_compressor.compress(request, response)
+
 # Error handlers
 @app.errorhandler(400)
 def bad_request(error):
@@ -81,11 +242,30 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return jsonify({'error': 'Request too large'}), 413
+
+@app.errorhandler(InvalidCursorError)
+def invalid_cursor(error):
+    return jsonify({'error': 'Invalid cursor'}), 400
+
+@app.errorhandler(UnsupportedFormatError)
+def unsupported_format(error):
+    return jsonify({'error': str(error), 'formats': compact.available_formats()}), 406
+
+@app.errorhandler(InvalidFieldsError)
+def invalid_fields(error):
+    return jsonify({'error': str(error), 'fields': error.allowed}), 400
+
 # Serve the React app
+# The build is scanned once; index.html is served from memory (STATIC_* environment variables)
+static_site = site_from_env(app.static_folder)
+
 @app.route('/')
 def serve_index():
     """Serve the main React application"""
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_site.index(request)
 
 @app.route('/<path:path>')
 def serve_static_files(path):
@@ -94,12 +274,13 @@ def serve_static_files(path):
     if path.startswith('api/'):
         return jsonify({'error': 'API endpoint not found'}), 404
     
-    # Try to serve the requested file
-    try:
-        return send_from_directory(app.static_folder, path)
-    except FileNotFoundError:
-        # If file not found, serve index.html (for React Router)
-        return send_from_directory(app.static_folder, 'index.html')
+    # Files of the build come from the manifest, any other path gets index.html (for React Router)
+    return static_site.serve(path, request)
+
+# Flask's own static route (static_url_path='') matches the same URLs first
+@app.endpoint('static')
+def serve_static(filename):
+    return serve_static_files(filename)
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -131,6 +312,7 @@ def api_health_check():
             'status': 'healthy',
             'api': 'operational',
             'database': 'connected',
+            'pool': db_pool.stats(),
             'timestamp': datetime.now().isoformat()
         })
     else:
@@ -141,6 +323,37 @@ def api_health_check():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+# Connection pool metrics endpoint
+@app.route('/api/admin/db-pool', methods=['GET'])
+def get_db_pool_stats():
+    """Get connection pool counters (checkouts, wait time, exhausted events)"""
+    return jsonify(db_pool.stats())
+
+@app.route('/api/admin/compression', methods=['GET'])
+def get_compression_stats():
+    """Get response compression counters (compressed, streamed, bytes in/out)"""
+    return jsonify(response_compressor.stats())
+
+@app.route('/api/admin/static', methods=['GET'])
+def get_static_stats():
+    """Get React build manifest counters (assets, scans, index and asset hits)"""
+    return jsonify(static_site.stats())
+
+@app.route('/api/admin/count-cache', methods=['GET'])
+def get_count_cache_stats():
+    """Get paginated-total cache counters (hits, misses, estimates)"""
+    return jsonify(count_engine.stats())
+
+@app.route('/api/admin/exports', methods=['GET'])
+def get_export_stats():
+    """Get streaming export counters (started, completed, aborted, rejected, rows)"""
+    return jsonify(export_streamer.stats())
+
+@app.route('/api/admin/reference-cache', methods=['GET'])
+def get_reference_cache_stats():
+    """Get class/counselor cache counters (hits, misses, evictions, invalidations)"""
+    return jsonify(reference_cache.stats())
+
 # API root endpoint
 @app.route('/api', methods=['GET'])
 def api_root():
@@ -155,7 +368,8 @@ def api_root():
             'users': '/api/users',
             'students': '/api/students',
             'classes': '/api/classes',
-            'counselors': '/api/counselors'
+            'counselors': '/api/counselors',
+            'sync': '/api/sync'
         },
         'timestamp': datetime.now().isoformat()
     })
@@ -186,12 +400,19 @@ def debug_users():
     except Error as e:
         logger.error(f"Error fetching debug users: {e}")
         return jsonify({'error': 'Failed to fetch users'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # User Management Endpoints
+# User list fields in frontend format (?fields= picks a subset)
+USER_FIELDS = FieldSet(
+    Field('userId', 'user_id'),
+    Field('username', 'username'),
+    Field('email', 'email'),
+    Field('name', 'name'),
+    Field('role', 'role'),
+    Field('photo', 'photo', image_service.thumbnail_url),
+    Field('id', 'user_id')  # For compatibility
+)
+
 @app.route('/api/users', methods=['GET'])
 def get_users():
     """Get all users"""
@@ -200,38 +421,23 @@ def get_users():
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT user_id, username, email, name, role, photo, is_active, created_at
+        mapper = USER_FIELDS.compile(USER_FIELDS.parse(request.args))
+        cursor = connection.cursor()
+        cursor.execute(f"""
+            SELECT {mapper.select}
             FROM users 
             WHERE is_active = TRUE
             ORDER BY role, name
         """)
         
-        users = cursor.fetchall()
-        
         # Convert to frontend format
-        result = []
-        for user in users:
-            result.append({
-                'userId': user['user_id'],
-                'username': user['username'],
-                'email': user['email'],
-                'name': user['name'],
-                'role': user['role'],
-                'photo': user['photo'],
-                'id': user['user_id']  # For compatibility
-            })
+        result = list(map(mapper, cursor.fetchall()))
         
-        return jsonify(result)
+        return list_response(result)
         
     except Error as e:
         logger.error(f"Error fetching users: {e}")
         return jsonify({'error': 'Failed to fetch users'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/users/<user_id>', methods=['GET'])
 def get_user(user_id):
@@ -267,10 +473,6 @@ def get_user(user_id):
     except Error as e:
         logger.error(f"Error fetching user {user_id}: {e}")
         return jsonify({'error': 'Failed to fetch user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/users', methods=['POST'])
 def create_user():
@@ -347,6 +549,11 @@ def create_user():
         password = data.get('password', 'password123')
         password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
         
+        # Store uploaded photo in image storage, keep only its URL
+        photo, photo_error = store_photo(data.get('photo'))
+        if photo_error:
+            return jsonify({'error': photo_error}), 400
+        
         # Insert new user
         cursor.execute("""
             INSERT INTO users (user_id, username, email, password_hash, name, role, photo)
@@ -358,10 +565,11 @@ def create_user():
             password_hash,
             data['name'], 
             data['role'], 
-            data.get('photo')
+            photo
         ))
         
         connection.commit()
+        reference_cache.invalidate('counselors')
         
         # Return the created user
         result = {
@@ -370,7 +578,7 @@ def create_user():
             'email': data['email'],
             'name': data['name'],
             'role': data['role'],
-            'photo': data.get('photo'),
+            'photo': photo,
             'id': user_id  # For compatibility
         }
         
@@ -379,10 +587,6 @@ def create_user():
     except Error as e:
         logger.error(f"Error creating user: {e}")
         return jsonify({'error': 'Failed to create user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/users/<user_id>', methods=['PUT'])
 def update_user(user_id):
@@ -432,8 +636,11 @@ def update_user(user_id):
             update_values.append(data['role'])
         
         if 'photo' in data:
+            photo, photo_error = store_photo(data['photo'])
+            if photo_error:
+                return jsonify({'error': photo_error}), 400
             update_fields.append('photo = %s')
-            update_values.append(data['photo'])
+            update_values.append(photo)
         
         if 'password' in data and data['password']:
             password_hash = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -450,7 +657,12 @@ def update_user(user_id):
         # Execute update
         query = f"UPDATE users SET {', '.join(update_fields)} WHERE user_id = %s"
         cursor.execute(query, update_values)
+        if any(field in data for field in STUDENT_USER_FIELDS):
+            touch_students(cursor, 'user_id = %s', (user_id,))
+        if 'name' in data:
+            touch_user_items(cursor, user_id)
         connection.commit()
+        reference_cache.invalidate('counselors')
         
         # Return updated user
         cursor.execute("""
@@ -475,10 +687,6 @@ def update_user(user_id):
     except Error as e:
         logger.error(f"Error updating user {user_id}: {e}")
         return jsonify({'error': 'Failed to update user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/users/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
@@ -507,16 +715,13 @@ def delete_user(user_id):
         # Soft delete the user
         cursor.execute("UPDATE users SET is_active = FALSE WHERE user_id = %s", (user_id,))
         connection.commit()
+        reference_cache.invalidate('counselors')
         
         return jsonify({'message': 'User deleted successfully'})
         
     except Error as e:
         logger.error(f"Error deleting user {user_id}: {e}")
         return jsonify({'error': 'Failed to delete user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Authentication endpoint
 @app.route('/api/users/auth/login', methods=['POST', 'OPTIONS'])
@@ -584,144 +789,136 @@ def login():
     except Error as e:
         logger.error(f"Error during authentication: {e}")
         return jsonify({'error': 'Authentication failed'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
-            cursor.close()
-            connection.close()
 
 # Counselors Endpoint
+# Counselor list fields in frontend format (?fields= picks a subset)
+COUNSELOR_FIELDS = FieldSet(
+    Field('id', 'user_id'),
+    Field('name', 'name'),
+    Field('email', 'email'),
+    Field('photo', 'photo', image_service.thumbnail_url)
+)
+
+# Active counselors by name; {select} is filled from COUNSELOR_FIELDS
+COUNSELOR_QUERY = "SELECT {select} FROM users WHERE role = 'counselor' AND is_active = TRUE ORDER BY name"
+
 @app.route('/api/counselors', methods=['GET'])
 def get_counselors():
-    """Get all active counselors"""
-    connection = get_db_connection()
-    if not connection:
-        return jsonify({'error': 'Database connection failed'}), 500
+    """Get all active counselors (from the reference cache)"""
+    fields = COUNSELOR_FIELDS.parse(request.args)
     
-    try:
-        cursor = connection.cursor(dictionary=True)
-        cursor.execute("""
-            SELECT user_id, name, email, photo
-            FROM users 
-            WHERE role = 'counselor' AND is_active = TRUE
-            ORDER BY name
-        """)
+    def load():
+        connection = get_db_connection()
+        if not connection:
+            raise Error(msg='Database connection failed')
         
-        counselors = cursor.fetchall()
+        mapper = COUNSELOR_FIELDS.compile(fields)
+        cursor = connection.cursor()
+        cursor.execute(COUNSELOR_QUERY.format(select=mapper.select))
         
         # Convert to frontend format
-        result = []
-        for counselor in counselors:
-            result.append({
-                'id': counselor['user_id'],
-                'name': counselor['name'],
-                'email': counselor['email'],
-                'photo': counselor['photo']
-            })
-        
-        return jsonify(result)
+        return list(map(mapper, cursor.fetchall()))
+    
+    try:
+        return cached_json('counselors', tuple(fields), load)
         
     except Error as e:
         logger.error(f"Error fetching counselors: {e}")
         return jsonify({'error': 'Failed to fetch counselors'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Classes Management Endpoints
+# Class list fields in frontend format (?fields= picks a subset)
+CLASS_FIELDS = FieldSet(
+    Field('id', 'class_id'),  # Use class_id as the primary identifier
+    Field('classId', 'class_id'),  # Frontend expects classId
+    Field('schoolId', 'class_id'),  # For backward compatibility
+    Field('name', 'name'),
+    Field('gradeLevel', 'grade_level'),
+    Field('studentCount', 'student_count'),
+    Field('academicYear', 'academic_year'),
+    Field('teacherName', 'teacher_name')
+)
+
+CLASS_ORDER = 'grade_level, name'
+
+def class_listing(args, select):
+    """Active classes matching the list filters in args"""
+    listing = ListQuery(select, 'classes')
+    listing.where('is_active = TRUE')
+    
+    if args.get('searchQuery'):
+        listing.where('name LIKE %s', f"%{args['searchQuery']}%")
+    
+    if args.get('grade'):
+        listing.where('grade_level = %s', args['grade'])
+    
+    if args.get('academicYear'):
+        listing.where('academic_year = %s', args['academicYear'])
+    
+    return listing
+
 @app.route('/api/classes', methods=['GET'])
 def get_classes():
-    """Get all classes with optional filtering"""
-    connection = get_db_connection()
-    if not connection:
-        return jsonify({'error': 'Database connection failed'}), 500
+    """Get all classes with optional filtering (pages are kept in the reference cache)"""
+    # Get query parameters for filtering
+    search_query = request.args.get('searchQuery', '')
+    grade = request.args.get('grade', '')
+    academic_year = request.args.get('academicYear', '')
+    page = int(request.args.get('page', 1))
+    limit = int(request.args.get('limit', 12))
+    count_mode, count_max_age = parse_count_args(request.args)
+    fields = CLASS_FIELDS.parse(request.args)
     
-    try:
-        cursor = connection.cursor(dictionary=True)
-        
-        # Get query parameters for filtering
-        search_query = request.args.get('searchQuery', '')
-        grade = request.args.get('grade', '')
-        academic_year = request.args.get('academicYear', '')
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 12))
-        
-        # Build WHERE clause
-        where_conditions = ['is_active = TRUE']
-        params = []
-        
-        if search_query:
-            where_conditions.append('name LIKE %s')
-            params.append(f'%{search_query}%')
-        
-        if grade:
-            where_conditions.append('grade_level = %s')
-            params.append(grade)
+    def load():
+        connection = get_db_connection()
+        if not connection:
+            raise Error(msg='Database connection failed')
         
-        if academic_year:
-            where_conditions.append('academic_year = %s')
-            params.append(academic_year)
+        cursor = connection.cursor(dictionary=True)
+        mapper = CLASS_FIELDS.compile(fields)
         
-        where_clause = ' AND '.join(where_conditions)
+        # Build query
+        listing = class_listing(request.args, mapper.select)
         
-        # Count total records
-        count_query = f"SELECT COUNT(*) as total FROM classes WHERE {where_clause}"
-        cursor.execute(count_query, params)
-        total_records = cursor.fetchone()['total']
+        # Count total records (exact, cached, estimated or skipped)
+        total_records, count_mode_used = count_engine.count(cursor, listing, count_mode, count_max_age)
         
         # Calculate pagination
         offset = (page - 1) * limit
-        total_pages = (total_records + limit - 1) // limit
+        total_pages = count_pages(total_records, limit)
         # Get classes with pagination
-        query = f"""
-            SELECT class_id, name, grade_level, student_count, academic_year, 
-                   teacher_name, created_at
-            FROM classes 
-            WHERE {where_clause}
-            ORDER BY grade_level, name
-            LIMIT %s OFFSET %s
-        """
-        cursor.execute(query, params + [limit, offset])
-        classes = cursor.fetchall()
-          # Convert to frontend format
-        result = []
-        for class_item in classes:
-            result.append({
-                'id': class_item['class_id'],  # Use class_id as the primary identifier
-                'classId': class_item['class_id'],  # Frontend expects classId
-                'schoolId': class_item['class_id'],  # For backward compatibility
-                'name': class_item['name'],
-                'gradeLevel': class_item['grade_level'],
-                'studentCount': class_item['student_count'],
-                'academicYear': class_item['academic_year'],
-                'teacherName': class_item['teacher_name']
-            })
+        rows = connection.cursor()
+        rows.execute(
+            f"{listing.sql()} ORDER BY {CLASS_ORDER} LIMIT %s OFFSET %s",
+            listing.params + [limit, offset]
+        )
+        # Convert to frontend format
+        result = list(map(mapper, rows.fetchall()))
         
-        return jsonify({
+        return {
             'data': result,
             'totalPages': total_pages,
             'currentPage': page,
-            'totalRecords': total_records
-        })
+            'totalRecords': total_records,
+            'countMode': count_mode_used
+        }
+    
+    try:
+        cache_key = (search_query, grade, academic_year, page, limit, count_mode, count_max_age, tuple(fields))
+        return cached_json('classes', cache_key, load, 'data')
         
     except Error as e:
         logger.error(f"Error fetching classes: {e}")
         return jsonify({'error': 'Failed to fetch classes'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/classes/<class_id>', methods=['GET'])
 def get_class(class_id):
-    """Get a specific class by ID"""
-    connection = get_db_connection()
-    if not connection:
-        return jsonify({'error': 'Database connection failed'}), 500
-    
-    try:
+    """Get a specific class by ID (from the reference cache)"""
+    def load():
+        connection = get_db_connection()
+        if not connection:
+            raise Error(msg='Database connection failed')
+        
         cursor = connection.cursor(dictionary=True)
         cursor.execute("""
             SELECT class_id, name, grade_level, student_count, academic_year, 
@@ -732,9 +929,9 @@ def get_class(class_id):
         
         class_item = cursor.fetchone()
         if not class_item:
-            return jsonify({'error': 'Class not found'}), 404
+            return None  # also cached; creating or restoring a class invalidates it
         
-        result = {
+        return {
             'id': class_item['class_id'],
             'schoolId': class_item['class_id'],  # For backward compatibility
             'name': class_item['name'],
@@ -743,16 +940,17 @@ def get_class(class_id):
             'academicYear': class_item['academic_year'],
             'teacherName': class_item['teacher_name']
         }
+    
+    try:
+        response = cached_json('classes', ('class', class_id), load)
+        if response is None:
+            return jsonify({'error': 'Class not found'}), 404
         
-        return jsonify(result)
+        return response
         
     except Error as e:
         logger.error(f"Error fetching class {class_id}: {e}")
         return jsonify({'error': 'Failed to fetch class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/classes', methods=['POST'])
 def create_class():
@@ -801,6 +999,7 @@ def create_class():
         ))
         
         connection.commit()
+        reference_cache.invalidate('classes')
         
         # Return the created class
         result = {
@@ -818,10 +1017,6 @@ def create_class():
     except Error as e:
         logger.error(f"Error creating class: {e}")
         return jsonify({'error': 'Failed to create class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/classes/<class_id>', methods=['PUT'])
 def update_class(class_id):
@@ -877,7 +1072,10 @@ def update_class(class_id):
         # Execute update
         query = f"UPDATE classes SET {', '.join(update_fields)} WHERE class_id = %s"
         cursor.execute(query, update_values)
+        if any(field in data for field in STUDENT_CLASS_FIELDS):
+            touch_students(cursor, 'class_id = %s', (class_id,))
         connection.commit()
+        reference_cache.invalidate('classes')
         
         # Return updated class
         cursor.execute("""
@@ -903,10 +1101,6 @@ def update_class(class_id):
     except Error as e:
         logger.error(f"Error updating class {class_id}: {e}")
         return jsonify({'error': 'Failed to update class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/classes/<class_id>', methods=['DELETE'])
 def delete_class(class_id):
@@ -932,16 +1126,13 @@ def delete_class(class_id):
         # Soft delete the class
         cursor.execute("UPDATE classes SET is_active = FALSE WHERE class_id = %s", (class_id,))
         connection.commit()
+        reference_cache.invalidate('classes')
         
         return jsonify({'message': 'Class deleted successfully'})
         
     except Error as e:
         logger.error(f"Error deleting class {class_id}: {e}")
         return jsonify({'error': 'Failed to delete class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/classes/deleted', methods=['GET'])
 def get_deleted_classes():
@@ -985,10 +1176,6 @@ def get_deleted_classes():
     except Error as e:
         logger.error(f"Error getting deleted classes: {e}")
         return jsonify({'error': 'Failed to get deleted classes'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/classes/<class_id>/restore', methods=['PUT'])
 def restore_class(class_id):
@@ -1023,6 +1210,7 @@ def restore_class(class_id):
         """, (class_id,))
         
         connection.commit()
+        reference_cache.invalidate('classes')
         
         # Get updated class info
         cursor.execute("""
@@ -1050,10 +1238,6 @@ def restore_class(class_id):
     except Error as e:
         logger.error(f"Error restoring class {class_id}: {e}")
         return jsonify({'error': 'Failed to restore class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/classes/<class_id>/hard-delete', methods=['DELETE'])
 def hard_delete_class(class_id):
@@ -1084,9 +1268,12 @@ def hard_delete_class(class_id):
             return jsonify({'error': f'Cannot permanently delete class with {student_count} student records. Remove all student records first.'}), 400
         
         # Permanently delete the class
+        record_deletions(cursor, 'classes', 'classes', 'class_id', 'class_id = %s', (class_id,))
         cursor.execute("DELETE FROM classes WHERE class_id = %s", (class_id,))
+        bump_table_versions(cursor, 'classes')
         
         connection.commit()
+        reference_cache.invalidate('classes')
         
         return jsonify({
             'message': f'Class {class_item["name"] if class_item["name"] else "Unknown"} permanently deleted from database',
@@ -1096,10 +1283,40 @@ def hard_delete_class(class_id):
     except Error as e:
         logger.error(f"Error hard deleting class {class_id}: {e}")
         return jsonify({'error': 'Failed to permanently delete class'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+
+# Class roster fields in frontend format (?fields= picks a subset)
+CLASS_STUDENT_FIELDS = FieldSet(
+    Field('id', 's.student_id'),
+    Field('studentId', 's.student_id'),
+    Field('name', ('s.student_id', 'u.name'), lambda student_id, name: name if name else f'Student {student_id}'),
+    Field('email', 'u.email', lambda email: email if email else ''),
+    Field('username', 'u.username', lambda username: username if username else ''),
+    Field('tingkat', 'c.grade_level as tingkat'),
+    Field('kelas', 'c.name as kelas'),
+    Field('grade', 'c.grade_level as tingkat'),
+    Field('class', 'c.name as kelas'),
+    Field('academicStatus', 's.academic_status'),
+    Field('program', 's.program'),
+    Field('mentalHealthScore', 's.mental_health_score'),
+    Field('photo', 'u.photo', image_service.thumbnail_url),
+    Field('avatar', 'u.photo', image_service.thumbnail_url),
+    Field('isActive', 's.is_active', bool),
+    Field('createdAt', 's.created_at', isoformat),
+    Field('updatedAt', 's.updated_at', isoformat),
+    Field('userId', 'u.user_id')
+)
+
+CLASS_STUDENT_ORDER = 'u.name'
+
+def class_student_listing(class_id, select):
+    """Active students of a class, joining only what select and the order need"""
+    listing = ListQuery(select, 'students s')
+    listing.join('u', 'LEFT JOIN users u ON s.user_id = u.user_id')
+    listing.join('c', 'LEFT JOIN classes c ON s.class_id = c.class_id')
+    listing.where('s.class_id = %s', class_id)
+    listing.where('s.is_active = 1')
+    listing.prune_joins(CLASS_STUDENT_ORDER)
+    return listing
 
 @app.route('/api/classes/<class_id>/students', methods=['GET'])
 def get_class_students(class_id):
@@ -1109,59 +1326,79 @@ def get_class_students(class_id):
         return jsonify({'error': 'Database connection failed'}), 500
     
     try:
-        cursor = connection.cursor(dictionary=True)        # Get students in the class with their user information
-        cursor.execute("""
-            SELECT s.student_id, s.academic_status, s.program,
-                   s.mental_health_score, s.is_active, s.created_at, s.updated_at,
-                   u.user_id, u.username, u.email, u.name, u.photo,
-                   c.grade_level as tingkat, c.name as kelas            FROM students s
-            LEFT JOIN users u ON s.user_id = u.user_id
-            LEFT JOIN classes c ON s.class_id = c.class_id
-            WHERE s.class_id = %s AND s.is_active = 1
-            ORDER BY u.name
-        """, (class_id,))
-        
-        students = cursor.fetchall()
+        mapper = CLASS_STUDENT_FIELDS.compile(CLASS_STUDENT_FIELDS.parse(request.args))
+        cursor = connection.cursor()        # Get students in the class with their user information
+        listing = class_student_listing(class_id, mapper.select)
+        cursor.execute(f"{listing.sql()} ORDER BY {CLASS_STUDENT_ORDER}", listing.params)
         
         # Convert to frontend format
-        result = []
-        for student in students:
-            result.append({
-                'id': student['student_id'],
-                'studentId': student['student_id'],
-                'name': student['name'] if student['name'] else f'Student {student["student_id"]}',
-                'email': student['email'] if student['email'] else '',
-                'username': student['username'] if student['username'] else '',
-                'tingkat': student['tingkat'],
-                'kelas': student['kelas'],
-                'grade': student['tingkat'],
-                'class': student['kelas'],
-                'academicStatus': student['academic_status'],
-                'program': student['program'],
-                'mentalHealthScore': student['mental_health_score'],
-                'photo': student['photo'],
-                'avatar': student['photo'],
-                'isActive': bool(student['is_active']),
-                'createdAt': student['created_at'].isoformat() if student['created_at'] else None,
-                'updatedAt': student['updated_at'].isoformat() if student['updated_at'] else None,
-                'userId': student['user_id']
-            })
+        result = list(map(mapper, cursor.fetchall()))
         
-        return jsonify({
+        return list_response({
             'students': result,
             'count': len(result)
-        })
+        }, 'students')
         
     except Error as e:
         logger.error(f"Error getting students for class {class_id}: {e}")
         return jsonify({'error': 'Failed to get class students'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Students Management Endpoints
+# Cursor pagination order for students (class, then name)
+STUDENT_KEYSET = Keyset(
+    KeyColumn('c.grade_level', 'tingkat', nullable=True),
+    KeyColumn('c.name', 'kelas', nullable=True),
+    KeyColumn('u.name', 'name'),
+    KeyColumn('s.student_id', 'student_id')
+)
+
+# Student list fields in frontend format (?fields= picks a subset)
+STUDENT_FIELDS = FieldSet(
+    Field('id', 's.student_id'),  # Use student_id as primary key
+    Field('studentId', 's.student_id'),
+    Field('name', 'u.name'),
+    Field('email', 'u.email'),
+    Field('tingkat', 'c.grade_level as tingkat'),
+    Field('kelas', 'c.name as kelas'),
+    Field('academicStatus', 's.academic_status'),
+    Field('avatar', 'u.photo as avatar', image_service.thumbnail_url),
+    Field('grade', 'c.grade_level as tingkat'),  # For compatibility
+    Field('class', 'c.name as kelas'),    # For compatibility
+    Field('photo', 'u.photo as avatar', image_service.thumbnail_url),   # For compatibility
+    Field('program', 's.program'),
+    Field('mentalHealthScore', 's.mental_health_score'),
+    Field('lastCounseling', 's.last_counseling', isoformat),
+    keys=('c.grade_level as tingkat', 'c.name as kelas', 'u.name', 's.student_id')
+)
+
+def student_listing(args, select):
+    """Active students matching the list filters in args"""
+    listing = ListQuery(select, 'students s')
+    listing.join('u', 'JOIN users u ON s.user_id = u.user_id')
+    listing.join('c', 'LEFT JOIN classes c ON s.class_id = c.class_id')
+    listing.where('s.is_active = TRUE')
+    
+    search_query = args.get('searchQuery')
+    if search_query:
+        listing.where(
+            '(u.name LIKE %s OR u.email LIKE %s OR s.student_id LIKE %s)',
+            f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'
+        )
+    
+    # tingkat and kelas are the grade level and name of the class
+    if args.get('tingkat'):
+        listing.where('c.grade_level = %s', args['tingkat'])
+    
+    if args.get('kelas'):
+        listing.where('c.name LIKE %s', f"%{args['kelas']}%")
+    
+    if args.get('academicStatus'):
+        listing.where('s.academic_status = %s', args['academicStatus'])
+    
+    return listing
+
 @app.route('/api/students', methods=['GET'])
+@conditional_get('students', 'users', 'classes')
 def get_students():
     """Get all students with optional filtering"""
     connection = get_db_connection()
@@ -1170,99 +1407,41 @@ def get_students():
     
     try:
         cursor = connection.cursor(dictionary=True)        # Get query parameters for filtering
-        search_query = request.args.get('searchQuery', '')
-        grade_level = request.args.get('tingkat', '')  # renamed from tingkat to match classes table
-        class_name = request.args.get('kelas', '')     # renamed from kelas to match classes table
-        academic_status = request.args.get('academicStatus', '')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 50))  # Changed default from 12 to 50 for better performance
+        mapper = STUDENT_FIELDS.compile(STUDENT_FIELDS.parse(request.args))
         
-        # Build WHERE clause
-        where_conditions = ['s.is_active = TRUE']
-        params = []
-        
-        if search_query:
-            where_conditions.append('(u.name LIKE %s OR u.email LIKE %s OR s.student_id LIKE %s)')
-            params.extend([f'%{search_query}%', f'%{search_query}%', f'%{search_query}%'])
-        
-        if grade_level:
-            where_conditions.append('c.grade_level = %s')
-            params.append(grade_level)
+        # Build query
+        listing = student_listing(request.args, mapper.select)
         
-        if class_name:
-            where_conditions.append('c.name LIKE %s')
-            params.append(f'%{class_name}%')
-            
-        if academic_status:
-            where_conditions.append('s.academic_status = %s')
-            params.append(academic_status)
-        
-        where_clause = ' AND '.join(where_conditions)
-        # Count total records
-        count_query = f"""
-            SELECT COUNT(*) as total            FROM students s
-            JOIN users u ON s.user_id = u.user_id 
-            LEFT JOIN classes c ON s.class_id = c.class_id
-            WHERE {where_clause}
-        """
-        cursor.execute(count_query, params)
-        total_records = cursor.fetchone()['total']
+        # Count total records (only joins the filters need)
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_records, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
         # Calculate pagination
         offset = (page - 1) * limit
-        total_pages = (total_records + limit - 1) // limit
+        total_pages = count_pages(total_records, limit)
         # Get students with pagination using JOIN
-        query = f"""
-            SELECT 
-                s.student_id, s.academic_status, s.class_id,
-                s.program, s.mental_health_score, s.last_counseling, s.created_at,
-                u.name, u.email, u.photo as avatar,
-                c.grade_level as tingkat, c.name as kelas
-            FROM students s            JOIN users u ON s.user_id = u.user_id
-            LEFT JOIN classes c ON s.class_id = c.class_id
-            WHERE {where_clause}
-            ORDER BY c.grade_level, c.name, u.name
-            LIMIT %s OFFSET %s
-        """
-        cursor.execute(query, params + [limit, offset])
-        students = cursor.fetchall()
-        # Convert to frontend format
-        result = []
-        for student in students:
-            result.append({
-                'id': student['student_id'],  # Use student_id as primary key
-                'studentId': student['student_id'],
-                'name': student['name'],
-                'email': student['email'],
-                'tingkat': student['tingkat'],
-                'kelas': student['kelas'],
-                'academicStatus': student['academic_status'],
-                'avatar': student['avatar'],
-                'grade': student['tingkat'],  # For compatibility
-                'class': student['kelas'],    # For compatibility
-                'photo': student['avatar'],   # For compatibility
-                'program': student['program'],
-                'mentalHealthScore': student['mental_health_score'],
-                'lastCounseling': student['last_counseling'].isoformat() if student['last_counseling'] else None
-            })
+        listing.prune_joins(STUDENT_KEYSET.order_by())
+        # Rows come back as tuples and are converted to frontend format as they are read
+        result, page_info = fetch_page(connection.cursor(), listing.sql(), listing.params, STUDENT_KEYSET, request.args, limit, offset, mapper)
         
-        return jsonify({
+        return list_response({
             'data': result,
             'totalPages': total_pages,
             'currentPage': page,
             'totalRecords': total_records,
-            'count': len(result)
-        })
+            'count': len(result),
+            'countMode': count_mode,
+            **page_info
+        }, 'data')
         
     except Error as e:
         logger.error(f"Error fetching students: {e}")
         return jsonify({'error': 'Failed to fetch students'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/<student_id>', methods=['GET'])
+@conditional_get('students', 'users', 'classes')
 def get_student(student_id):
     """Get a specific student by ID"""
     connection = get_db_connection()
@@ -1308,10 +1487,6 @@ def get_student(student_id):
     except Error as e:
         logger.error(f"Error fetching student {student_id}: {e}")
         return jsonify({'error': 'Failed to fetch student'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/by-user/<user_id>', methods=['GET'])
 def get_student_by_user_id(user_id):
@@ -1363,10 +1538,6 @@ def get_student_by_user_id(user_id):
     except Error as e:
         logger.error(f"Error fetching student for user {user_id}: {e}")
         return jsonify({'error': 'Failed to fetch student'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students', methods=['POST'])
 def create_student():
@@ -1444,6 +1615,11 @@ def create_student():
               # Hash default password
             password_hash = bcrypt.hashpw('password123'.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
             
+            # Store uploaded photo in image storage, keep only its URL
+            avatar, photo_error = store_photo(data.get('avatar', ''))
+            if photo_error:
+                return jsonify({'error': photo_error}), 400
+            
             # Insert new user
             cursor.execute("""
                 INSERT INTO users (user_id, username, email, password_hash, name, role, photo)
@@ -1455,7 +1631,7 @@ def create_student():
                 password_hash,
                 data['name'],
                 'student',
-                data.get('avatar', '')
+                avatar
             ))
             
             user_id = user_id_str  # Use the user_id string we just inserted
@@ -1506,10 +1682,6 @@ def create_student():
     except Error as e:
         logger.error(f"Error creating student: {e}")
         return jsonify({'error': 'Failed to create student'}), 500    
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/batch', methods=['POST'])
 def create_students_batch():
@@ -1639,10 +1811,6 @@ def create_students_batch():
     except Error as e:
         logger.error(f"Error in batch student creation: {e}")
         return jsonify({'error': 'Failed to create students in batch'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/<student_id>', methods=['PUT'])
 def update_student(student_id):
@@ -1695,8 +1863,11 @@ def update_student(student_id):
             user_update_values.append(data['email'])
         
         if 'avatar' in data:
+            avatar, photo_error = store_photo(data['avatar'])
+            if photo_error:
+                return jsonify({'error': photo_error}), 400
             user_update_fields.append('photo = %s')
-            user_update_values.append(data['avatar'])
+            user_update_values.append(avatar)
         # Handle student-specific data updates
         if 'academicStatus' in data:
             student_update_fields.append('academic_status = %s')
@@ -1720,9 +1891,11 @@ def update_student(student_id):
             
             user_query = f"UPDATE users SET {', '.join(user_update_fields)} WHERE user_id = %s"
             cursor.execute(user_query, user_update_values)
+            if 'name' in data:
+                touch_user_items(cursor, student['user_table_id'])
         
-        # Update students table if needed
-        if student_update_fields:
+        # Update students table if needed (a user change moves the student's sync stamp too)
+        if student_update_fields or user_update_fields:
             student_update_fields.append('updated_at = CURRENT_TIMESTAMP')
             student_update_values.append(student['student_id'])
             
@@ -1765,10 +1938,6 @@ def update_student(student_id):
     except Error as e:
         logger.error(f"Error updating student {student_id}: {e}")
         return jsonify({'error': 'Failed to update student'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/<student_id>', methods=['DELETE'])
 def delete_student(student_id):
@@ -1805,10 +1974,6 @@ def delete_student(student_id):
     except Error as e:
         logger.error(f"Error deleting student {student_id}: {e}")
         return jsonify({'error': 'Failed to delete student'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # ===== ADMIN STUDENT ENDPOINTS =====
 
@@ -1846,7 +2011,7 @@ def get_deleted_students():
                 'academicStatus': student['academic_status'],
                 'program': student['program'],
                 'mentalHealthScore': student['mental_health_score'],
-                'photo': student['photo'],
+                'photo': image_service.thumbnail_url(student['photo']),
                 'isActive': bool(student['is_active']),
                 'createdAt': student['created_at'].isoformat() if student['created_at'] else None,
                 'deletedAt': student['updated_at'].isoformat() if student['updated_at'] else None,
@@ -1859,10 +2024,6 @@ def get_deleted_students():
     except Error as e:
         logger.error(f"Error getting deleted students: {e}")
         return jsonify({'error': 'Failed to get deleted students'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/students/<student_id>/restore', methods=['PUT'])
 def restore_student(student_id):
@@ -1932,10 +2093,6 @@ def restore_student(student_id):
     except Error as e:
         logger.error(f"Error restoring student {student_id}: {e}")
         return jsonify({'error': 'Failed to restore student'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/students/<student_id>/hard-delete', methods=['DELETE'])
 def hard_delete_student(student_id):
@@ -1978,16 +2135,19 @@ def hard_delete_student(student_id):
         
         # 1. Delete counseling sessions
         if counseling_count > 0:
+            record_deletions(cursor, 'counselingSessions', 'counseling_sessions', 'session_id', 'student_id = %s', (student_id,))
             cursor.execute("DELETE FROM counseling_sessions WHERE student_id = %s", (student_id,))
             logger.info(f"Deleted {counseling_count} counseling sessions for student {student_id}")
         
         # 2. Delete mental health assessments
         if assessment_count > 0:
+            record_deletions(cursor, 'assessments', 'mental_health_assessments', 'assessment_id', 'student_id = %s', (student_id,))
             cursor.execute("DELETE FROM mental_health_assessments WHERE student_id = %s", (student_id,))
             logger.info(f"Deleted {assessment_count} mental health assessments for student {student_id}")
         
         # 3. Delete behavior records
         if behavior_count > 0:
+            record_deletions(cursor, 'behaviorRecords', 'behavior_records', 'record_id', 'student_id = %s', (student_id,))
             cursor.execute("DELETE FROM behavior_records WHERE student_id = %s", (student_id,))
             logger.info(f"Deleted {behavior_count} behavior records for student {student_id}")
         
@@ -2000,7 +2160,9 @@ def hard_delete_student(student_id):
         if student['user_id']:
             cursor.execute("DELETE FROM notifications WHERE user_id = %s", (student['user_id'],))
           # 6. Delete the student record (this will also remove the foreign key reference)
+        record_deletions(cursor, 'students', 'students', 'student_id', 'student_id = %s', (student_id,))
         cursor.execute("DELETE FROM students WHERE student_id = %s", (student_id,))
+        bump_table_versions(cursor, 'counseling_sessions', 'mental_health_assessments', 'behavior_records', 'students')
         logger.info(f"Deleted student record {student_id}")
         
         # Note: User record is preserved (not deleted) to maintain user account integrity
@@ -2029,10 +2191,6 @@ def hard_delete_student(student_id):
         logger.error(f"Error hard deleting student {student_id}: {e}")
         connection.rollback()
         return jsonify({'error': f'Failed to permanently delete student: {str(e)}'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/students/bulk-hard-delete', methods=['DELETE'])
 def bulk_hard_delete_students():
@@ -2085,6 +2243,7 @@ def bulk_hard_delete_students():
             cursor.execute("SELECT COUNT(*) as count FROM counseling_sessions WHERE student_id = %s", (student_id,))
             counseling_count = cursor.fetchone()['count']
             if counseling_count > 0:
+                record_deletions(cursor, 'counselingSessions', 'counseling_sessions', 'session_id', 'student_id = %s', (student_id,))
                 cursor.execute("DELETE FROM counseling_sessions WHERE student_id = %s", (student_id,))
                 total_records_deleted['counseling_sessions'] += counseling_count
             
@@ -2092,6 +2251,7 @@ def bulk_hard_delete_students():
             cursor.execute("SELECT COUNT(*) as count FROM mental_health_assessments WHERE student_id = %s", (student_id,))
             assessment_count = cursor.fetchone()['count']
             if assessment_count > 0:
+                record_deletions(cursor, 'assessments', 'mental_health_assessments', 'assessment_id', 'student_id = %s', (student_id,))
                 cursor.execute("DELETE FROM mental_health_assessments WHERE student_id = %s", (student_id,))
                 total_records_deleted['mental_health_assessments'] += assessment_count
             
@@ -2099,6 +2259,7 @@ def bulk_hard_delete_students():
             cursor.execute("SELECT COUNT(*) as count FROM behavior_records WHERE student_id = %s", (student_id,))
             behavior_count = cursor.fetchone()['count']
             if behavior_count > 0:
+                record_deletions(cursor, 'behaviorRecords', 'behavior_records', 'record_id', 'student_id = %s', (student_id,))
                 cursor.execute("DELETE FROM behavior_records WHERE student_id = %s", (student_id,))
                 total_records_deleted['behavior_records'] += behavior_count
             
@@ -2118,6 +2279,7 @@ def bulk_hard_delete_students():
                     total_records_deleted['notifications'] += notification_count
             
             # 6. Delete the student record
+            record_deletions(cursor, 'students', 'students', 'student_id', 'student_id = %s', (student_id,))
             cursor.execute("DELETE FROM students WHERE student_id = %s", (student_id,))
             
             # Track successful deletion
@@ -2135,6 +2297,8 @@ def bulk_hard_delete_students():
             
             logger.info(f"Hard deleted student {student_id} with all associated data")
         
+        if deleted_students:
+            bump_table_versions(cursor, 'counseling_sessions', 'mental_health_assessments', 'behavior_records', 'students')
         connection.commit()
         
         # Prepare response
@@ -2164,10 +2328,6 @@ def bulk_hard_delete_students():
         logger.error(f"Unexpected error in bulk hard delete: {e}")
         connection.rollback()
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Additional admin endpoints for user management
 @app.route('/api/admin/users/deleted', methods=['GET'])
@@ -2197,7 +2357,7 @@ def get_deleted_users():
                 'email': user['email'],
                 'name': user['name'],
                 'role': user['role'],
-                'photo': user['photo'],
+                'photo': image_service.thumbnail_url(user['photo']),
                 'isActive': user['is_active'],
                 'createdAt': user['created_at'].isoformat() if user['created_at'] else None,
                 'deletedAt': user['updated_at'].isoformat() if user['updated_at'] else None,
@@ -2209,10 +2369,6 @@ def get_deleted_users():
     except Error as e:
         logger.error(f"Error getting deleted users: {e}")
         return jsonify({'error': 'Failed to get deleted users'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/users/<user_id>/restore', methods=['PUT'])
 def restore_user(user_id):
@@ -2237,6 +2393,7 @@ def restore_user(user_id):
         # Restore the user
         cursor.execute("UPDATE users SET is_active = TRUE, updated_at = CURRENT_TIMESTAMP WHERE user_id = %s", (user_id,))
         connection.commit()
+        reference_cache.invalidate('counselors')
         
         # Return restored user data
         cursor.execute("""
@@ -2264,10 +2421,22 @@ def restore_user(user_id):
     except Error as e:
         logger.error(f"Error restoring user {user_id}: {e}")
         return jsonify({'error': 'Failed to restore user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+
+# Synced rows a user delete removes through ON DELETE CASCADE, as (entity,
+# table, key, conditions on the user id); tests/test_sync_cascades.py checks
+# them against the foreign keys of the schema
+USER_DELETE_CASCADES = (
+    ('counselingSessions', 'counseling_sessions', 'session_id', (
+        'counselor_id = %s', 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)'
+    )),
+    ('assessments', 'mental_health_assessments', 'assessment_id', (
+        'assessor_id = %s', 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)'
+    )),
+    ('behaviorRecords', 'behavior_records', 'record_id', (
+        'reporter_id = %s', 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)'
+    )),
+    ('students', 'students', 'student_id', ('user_id = %s',)),
+)
 
 @app.route('/api/admin/users/<user_id>/hard-delete', methods=['DELETE'])
 def hard_delete_user(user_id):
@@ -2290,9 +2459,15 @@ def hard_delete_user(user_id):
         if user['role'] == 'admin':
             return jsonify({'error': 'Cannot permanently delete admin users for security reasons'}), 403
         
+        # Tombstones for every synced row the cascades are about to remove
+        for entity, table, key, conditions in USER_DELETE_CASCADES:
+            record_deletions(cursor, entity, table, key, ' OR '.join(conditions), (user_id,) * len(conditions))
+        
         # Permanently delete the user
         cursor.execute("DELETE FROM users WHERE user_id = %s", (user_id,))
+        bump_table_versions(cursor, *(table for _, table, _, _ in USER_DELETE_CASCADES), 'users')
         connection.commit()
+        reference_cache.invalidate('counselors')
         
         return jsonify({
             'message': f'User {user["name"]} permanently deleted from database',
@@ -2302,10 +2477,6 @@ def hard_delete_user(user_id):
     except Error as e:
         logger.error(f"Error hard deleting user {user_id}: {e}")
         return jsonify({'error': 'Failed to permanently delete user'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/students/bulk-delete', methods=['POST'])
 def bulk_delete_students():
@@ -2369,13 +2540,44 @@ def bulk_delete_students():
     except Error as e:
         logger.error(f"Error bulk deleting students: {e}")
         return jsonify({'error': 'Failed to delete students'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Mental Health Assessment Endpoints
 
+# Cursor pagination order for mental health assessments (newest first)
+MENTAL_HEALTH_KEYSET = Keyset(
+    KeyColumn('mha.date', 'date', descending=True),
+    KeyColumn('mha.assessment_id', 'assessment_id', descending=True)
+)
+
+# Mental health assessment list fields in frontend format (?fields= picks a subset)
+ASSESSMENT_FIELDS = FieldSet(
+    Field('id', 'mha.assessment_id', str),
+    Field('studentId', 'mha.student_id'),
+    Field('type', 'mha.assessment_type'),
+    Field('score', 'mha.score'),
+    Field('risk', 'mha.risk_level'),
+    Field('notes', 'mha.notes', lambda notes: notes or ''),
+    Field('date', 'mha.date', lambda value: value.strftime('%Y-%m-%d') if value else ''),
+    Field('category', 'mha.category', lambda category: category or 'general'),
+    Field('assessor', ('mha.assessor_id', 'u.name as assessor_name'), lambda assessor_id, assessor_name: {
+        'id': assessor_id or 'system',
+        'name': assessor_name or 'System'
+    }),
+    keys=('mha.date', 'mha.assessment_id')
+)
+
+def assessment_listing(args, select):
+    """Mental health assessments matching the list filters in args"""
+    listing = ListQuery(select, 'mental_health_assessments mha')
+    listing.join('u', 'LEFT JOIN users u ON mha.assessor_id = u.user_id')
+    listing.join('st', 'LEFT JOIN students st ON mha.student_id = st.student_id')
+    listing.join('s', 'LEFT JOIN users s ON st.user_id = s.user_id', depends_on=('st',))
+    
+    if args.get('studentId'):
+        listing.where('mha.student_id = %s', args['studentId'])
+    
+    return listing
+
 @app.route('/api/mental-health/assessments', methods=['GET'])
 def get_mental_health_assessments():
     """Get mental health assessments with optional filtering"""
@@ -2387,81 +2589,35 @@ def get_mental_health_assessments():
         cursor = connection.cursor(dictionary=True)
         
         # Get query parameters
-        student_id = request.args.get('studentId')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 20))
         offset = (page - 1) * limit
+        mapper = ASSESSMENT_FIELDS.compile(ASSESSMENT_FIELDS.parse(request.args))
         
         # Build query based on parameters
-        base_query = """
-            SELECT mha.*, u.name as assessor_name, s.name as student_name
-            FROM mental_health_assessments mha
-            LEFT JOIN users u ON mha.assessor_id = u.user_id
-            LEFT JOIN students st ON mha.student_id = st.student_id
-            LEFT JOIN users s ON st.user_id = s.user_id
-            WHERE 1=1
-        """
-        
-        params = []
-        if student_id:
-            base_query += " AND mha.student_id = %s"
-            params.append(student_id)
-        
-        base_query += " ORDER BY mha.date DESC"
+        listing = assessment_listing(request.args, mapper.select)
         
         # Get total count
-        count_query = base_query.replace(
-            "SELECT mha.*, u.name as assessor_name, s.name as student_name", 
-            "SELECT COUNT(*) as total"
-        )
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get paginated results
-        paginated_query = base_query + " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(paginated_query, params)
-        
-        assessments = cursor.fetchall()
-          # Transform to frontend format
-        formatted_assessments = []
-        for assessment in assessments:
-            formatted_assessment = {
-                'id': str(assessment['assessment_id']),
-                'studentId': assessment['student_id'],
-                'type': assessment['assessment_type'],
-                'score': assessment['score'],
-                'risk': assessment['risk_level'],
-                'notes': assessment['notes'] or '',
-                'date': assessment['date'].strftime('%Y-%m-%d') if assessment['date'] else '',
-                'category': assessment['category'] or 'general',
-                'assessor': {
-                    'id': assessment['assessor_id'] or 'system',
-                    'name': assessment['assessor_name'] or 'System'
-                }
-            }
-            formatted_assessments.append(formatted_assessment)
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_count, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
-        # Get total count
-        count_query = "SELECT COUNT(*) as total FROM mental_health_assessments"
-        count_params = []
-        if student_id:
-            count_query += " WHERE student_id = %s"
-            count_params.append(student_id)
-        
-        cursor.execute(count_query, count_params)
-        total_count = cursor.fetchone()['total']
-        
-        cursor.close()
-        connection.close()
+        # Get paginated results (offset or cursor mode)
+        listing.prune_joins(MENTAL_HEALTH_KEYSET.order_by())
+        formatted_assessments, page_info = fetch_page(
+            connection.cursor(), listing.sql(), listing.params, MENTAL_HEALTH_KEYSET, request.args, limit, offset, mapper
+        )
         
-        return jsonify({
+        return list_response({
             'data': formatted_assessments,
             'count': len(formatted_assessments),
-            'totalPages': (total_count + limit - 1) // limit,
-            'currentPage': page
-        })
+            'totalPages': count_pages(total_count, limit),
+            'currentPage': page,
+            'countMode': count_mode,
+            **page_info
+        }, 'data')
         
+    except (InvalidCursorError, InvalidFieldsError, UnsupportedFormatError):
+        raise
     except Exception as e:
         print(f"Error fetching assessments: {e}")
         return jsonify({'error': str(e)}), 500
@@ -2539,9 +2695,6 @@ def create_mental_health_assessment():
         cursor.execute(insert_query, values)
         connection.commit()
         
-        cursor.close()
-        connection.close()
-        
         return jsonify({
             'id': assessment_id,
             'studentId': student_id,
@@ -2652,11 +2805,6 @@ def update_mental_health_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error updating mental health assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to update mental health assessment'}), 500
-    finally:
-        if connection and connection.is_connected():
-            if 'cursor' in locals():
-                cursor.close()
-            connection.close()
 
 @app.route('/api/mental-health/assessments/<assessment_id>', methods=['DELETE'])
 def delete_mental_health_assessment(assessment_id):
@@ -2674,7 +2822,9 @@ def delete_mental_health_assessment(assessment_id):
             return jsonify({'error': 'Assessment not found'}), 404
         
         # Delete the assessment
+        record_deletions(cursor, 'assessments', 'mental_health_assessments', 'assessment_id', 'assessment_id = %s', (assessment_id,))
         cursor.execute("DELETE FROM mental_health_assessments WHERE assessment_id = %s", (assessment_id,))
+        bump_table_versions(cursor, 'mental_health_assessments')
         connection.commit()
         
         return jsonify({'message': 'Assessment deleted successfully'})
@@ -2682,10 +2832,11 @@ def delete_mental_health_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error deleting mental health assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to delete mental health assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+
+TREND_QUERY = (
+    "SELECT date, score, assessment_type FROM mental_health_assessments "
+    "WHERE student_id = %s ORDER BY date ASC"
+)
 
 @app.route('/api/mental-health/trends', methods=['GET'])
 def get_mental_health_trends():
@@ -2694,7 +2845,6 @@ def get_mental_health_trends():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         student_id = request.args.get('student_id')
         if not student_id:
@@ -2703,12 +2853,7 @@ def get_mental_health_trends():
         cursor = connection.cursor(dictionary=True)
         
         # Get assessments for trend analysis
-        cursor.execute("""
-            SELECT date, score, assessment_type
-            FROM mental_health_assessments
-            WHERE student_id = %s
-            ORDER BY date ASC
-        """, (student_id,))
+        cursor.execute(TREND_QUERY, (student_id,))
         
         assessments = cursor.fetchall()
         
@@ -2728,13 +2873,45 @@ def get_mental_health_trends():
     except Error as e:
         logger.error(f"Error fetching mental health trends: {e}")
         return jsonify({'error': 'Failed to fetch mental health trends'}), 500
-    finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 # Career Assessment Endpoints
+# Cursor pagination order for career assessments (newest first)
+CAREER_ASSESSMENT_KEYSET = Keyset(
+    KeyColumn('ca.date', 'date', descending=True),
+    KeyColumn('ca.assessment_id', 'assessment_id', descending=True)
+)
+
+# Career assessment list fields in frontend format (?fields= picks a subset)
+CAREER_ASSESSMENT_FIELDS = FieldSet(
+    Field('id', 'ca.assessment_id'),
+    Field('studentId', 'ca.student_id'),
+    Field('studentName', 'u.name as student_name'),
+    Field('studentEmail', 'u.email as student_email'),
+    Field('date', 'ca.date', isoformat),
+    Field('type', 'ca.assessment_type'),
+    Field('interests', 'ca.interests', split_list),
+    Field('skills', 'ca.skills', split_list),
+    Field('values', 'ca.values_data', split_list),
+    Field('recommendedPaths', 'ca.recommended_paths', split_list),
+    Field('notes', 'ca.notes'),
+    Field('results', 'ca.results', lambda results: json.loads(results) if results else {}),
+    Field('createdAt', 'ca.created_at', isoformat),
+    Field('updatedAt', 'ca.updated_at', isoformat),
+    keys=('ca.date', 'ca.assessment_id')
+)
+
+def career_assessment_listing(args, select):
+    """Active career assessments matching the list filters in args"""
+    listing = ListQuery(select, 'career_assessments ca')
+    listing.join('s', 'LEFT JOIN students s ON ca.student_id = s.student_id')
+    listing.join('u', 'LEFT JOIN users u ON s.user_id = u.user_id', depends_on=('s',))
+    listing.where('ca.is_active = TRUE')
+    
+    if args.get('student'):
+        listing.where('ca.student_id = %s', args['student'])
+    
+    return listing
+
 @app.route('/api/career-assessments', methods=['GET'])
 def get_career_assessments():
     """Get career assessments with optional student filter"""
@@ -2746,79 +2923,39 @@ def get_career_assessments():
         cursor = connection.cursor(dictionary=True)
         
         # Get query parameters
-        student_id = request.args.get('student')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 20))
         offset = (page - 1) * limit
+        mapper = CAREER_ASSESSMENT_FIELDS.compile(CAREER_ASSESSMENT_FIELDS.parse(request.args))
         
         # Build query based on parameters
-        base_query = """
-            SELECT ca.*, u.name as student_name, u.email as student_email
-            FROM career_assessments ca
-            LEFT JOIN students s ON ca.student_id = s.student_id
-            LEFT JOIN users u ON s.user_id = u.user_id
-            WHERE ca.is_active = TRUE
-        """
-        
-        params = []
-        if student_id:
-            base_query += " AND ca.student_id = %s"
-            params.append(student_id)
-        
-        base_query += " ORDER BY ca.date DESC"
+        listing = career_assessment_listing(request.args, mapper.select)
         
         # Get total count
-        count_query = base_query.replace(
-            "SELECT ca.*, u.name as student_name, u.email as student_email", 
-            "SELECT COUNT(*) as total"
-        )
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get paginated results
-        paginated_query = base_query + " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(paginated_query, params)
-        
-        assessments = cursor.fetchall()
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_count, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
-        # Format response
-        result = []
-        for assessment in assessments:
-            result.append({
-                'id': assessment['assessment_id'],
-                'studentId': assessment['student_id'],
-                'studentName': assessment['student_name'],
-                'studentEmail': assessment['student_email'],
-                'date': assessment['date'].isoformat() if assessment['date'] else None,
-                'type': assessment['assessment_type'],
-                'interests': assessment['interests'].split(',') if assessment['interests'] else [],
-                'skills': assessment['skills'].split(',') if assessment['skills'] else [],
-                'values': assessment['values_data'].split(',') if assessment['values_data'] else [],
-                'recommendedPaths': assessment['recommended_paths'].split(',') if assessment['recommended_paths'] else [],
-                'notes': assessment['notes'],
-                'results': json.loads(assessment['results']) if assessment['results'] else {},
-                'createdAt': assessment['created_at'].isoformat() if assessment['created_at'] else None,
-                'updatedAt': assessment['updated_at'].isoformat() if assessment['updated_at'] else None
-            })
+        # Get paginated results (offset or cursor mode)
+        listing.prune_joins(CAREER_ASSESSMENT_KEYSET.order_by())
+        result, page_info = fetch_page(
+            connection.cursor(), listing.sql(), listing.params, CAREER_ASSESSMENT_KEYSET, request.args, limit, offset, mapper
+        )
         
-        total_pages = (total_count + limit - 1) // limit
+        total_pages = count_pages(total_count, limit)
         
-        return jsonify({
+        return list_response({
             'data': result,
             'count': len(result),
             'totalPages': total_pages,
             'currentPage': page,
-            'totalCount': total_count
-        })
+            'totalCount': total_count,
+            'countMode': count_mode,
+            **page_info
+        }, 'data')
         
     except Error as e:
         logger.error(f"Error fetching career assessments: {e}")
         return jsonify({'error': 'Failed to fetch career assessments'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-assessments', methods=['POST'])
 def create_career_assessment():
@@ -2827,7 +2964,6 @@ def create_career_assessment():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         data = request.get_json()
         
@@ -2905,10 +3041,6 @@ def create_career_assessment():
     except Error as e:
         logger.error(f"Error creating career assessment: {e}")
         return jsonify({'error': 'Failed to create career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-assessments/<assessment_id>', methods=['GET'])
 def get_career_assessment(assessment_id):
@@ -2955,11 +3087,7 @@ def get_career_assessment(assessment_id):
         
     except Error as e:
         logger.error(f"Error fetching career assessment {assessment_id}: {e}")
-        return jsonify({'error': 'Failed to fetch career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
+        return jsonify({'error': 'Failed to fetch career assessment'}), 500
 
 @app.route('/api/career-assessments/<assessment_id>', methods=['PUT'])
 def update_career_assessment(assessment_id):
@@ -3065,10 +3193,6 @@ def update_career_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error updating career assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to update career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-assessments/<assessment_id>', methods=['DELETE'])
 def delete_career_assessment(assessment_id):
@@ -3103,10 +3227,6 @@ def delete_career_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error deleting career assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to delete career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Admin endpoints for career assessments
 @app.route('/api/admin/career-assessments/deleted', methods=['GET'])
@@ -3155,10 +3275,6 @@ def get_deleted_career_assessments():
     except Error as e:
         logger.error(f"Error fetching deleted career assessments: {e}")
         return jsonify({'error': 'Failed to fetch deleted career assessments'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/career-assessments/<assessment_id>/restore', methods=['PUT'])
 def restore_career_assessment(assessment_id):
@@ -3228,10 +3344,6 @@ def restore_career_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error restoring career assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to restore career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/admin/career-assessments/<assessment_id>/hard-delete', methods=['DELETE'])
 def hard_delete_career_assessment(assessment_id):
@@ -3268,12 +3380,42 @@ def hard_delete_career_assessment(assessment_id):
     except Error as e:
         logger.error(f"Error hard deleting career assessment {assessment_id}: {e}")
         return jsonify({'error': 'Failed to permanently delete career assessment'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 # Career Resources Endpoints
+# Cursor pagination order for career resources (newest first, unpublished last)
+CAREER_RESOURCE_KEYSET = Keyset(
+    KeyColumn('date_published', 'date_published', descending=True, nullable=True),
+    KeyColumn('resource_id', 'resource_id', descending=True)
+)
+
+# Career resource list fields in frontend format (?fields= picks a subset)
+CAREER_RESOURCE_FIELDS = FieldSet(
+    Field('id', 'resource_id'),
+    Field('title', 'title'),
+    Field('description', 'description'),
+    Field('type', 'resource_type'),
+    Field('url', 'url'),
+    Field('tags', 'tags', lambda tags: json.loads(tags) if tags else []),
+    Field('datePublished', 'date_published', isoformat),
+    Field('author', 'author'),
+    Field('createdAt', 'created_at', isoformat),
+    Field('updatedAt', 'updated_at', isoformat),
+    keys=('date_published', 'resource_id')
+)
+
+def career_resource_listing(args, select):
+    """Active career resources matching the list filters in args"""
+    listing = ListQuery(select, 'career_resources')
+    listing.where('is_active = TRUE')
+    
+    if args.get('type'):
+        listing.where('resource_type = %s', args['type'])
+    
+    if args.get('tags'):
+        listing.where('tags LIKE %s', f"%{args['tags']}%")
+    
+    return listing
+
 @app.route('/api/career-resources', methods=['GET'])
 def get_career_resources():
     """Get career resources with optional filtering"""
@@ -3288,71 +3430,35 @@ def get_career_resources():
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 20))
         offset = (page - 1) * limit
-        resource_type = request.args.get('type')
-        tags = request.args.get('tags')
+        mapper = CAREER_RESOURCE_FIELDS.compile(CAREER_RESOURCE_FIELDS.parse(request.args))
         
         # Build query based on parameters
-        base_query = """
-            SELECT * FROM career_resources
-            WHERE is_active = TRUE
-        """
-        
-        params = []
-        if resource_type:
-            base_query += " AND resource_type = %s"
-            params.append(resource_type)
-        
-        if tags:
-            base_query += " AND tags LIKE %s"
-            params.append(f"%{tags}%")
-        
-        base_query += " ORDER BY date_published DESC"
+        listing = career_resource_listing(request.args, mapper.select)
         
         # Get total count
-        count_query = base_query.replace("SELECT *", "SELECT COUNT(*) as total")
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get paginated results
-        paginated_query = base_query + " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(paginated_query, params)
-        
-        resources = cursor.fetchall()
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_count, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
-        # Format response
-        result = []
-        for resource in resources:
-            result.append({
-                'id': resource['resource_id'],
-                'title': resource['title'],
-                'description': resource['description'],
-                'type': resource['resource_type'],
-                'url': resource['url'],
-                'tags': json.loads(resource['tags']) if resource['tags'] else [],
-                'datePublished': resource['date_published'].isoformat() if resource['date_published'] else None,
-                'author': resource['author'],
-                'createdAt': resource['created_at'].isoformat() if resource['created_at'] else None,
-                'updatedAt': resource['updated_at'].isoformat() if resource['updated_at'] else None
-            })
+        # Get paginated results (offset or cursor mode)
+        result, page_info = fetch_page(
+            connection.cursor(), listing.sql(), listing.params, CAREER_RESOURCE_KEYSET, request.args, limit, offset, mapper
+        )
         
-        total_pages = (total_count + limit - 1) // limit
+        total_pages = count_pages(total_count, limit)
         
-        return jsonify({
+        return list_response({
             'results': result,
             'count': len(result),
             'totalPages': total_pages,
             'currentPage': page,
-            'totalCount': total_count
-        })
+            'totalCount': total_count,
+            'countMode': count_mode,
+            **page_info
+        }, 'results')
         
     except Error as e:
         logger.error(f"Error fetching career resources: {e}")
         return jsonify({'error': 'Failed to fetch career resources'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-resources', methods=['POST'])
 def create_career_resource():
@@ -3361,7 +3467,6 @@ def create_career_resource():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         data = request.get_json()
         
@@ -3423,10 +3528,6 @@ def create_career_resource():
     except Error as e:
         logger.error(f"Error creating career resource: {e}")
         return jsonify({'error': 'Failed to create career resource'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-resources/<resource_id>', methods=['GET'])
 def get_career_resource(resource_id):
@@ -3467,10 +3568,6 @@ def get_career_resource(resource_id):
     except Error as e:
         logger.error(f"Error fetching career resource {resource_id}: {e}")
         return jsonify({'error': 'Failed to fetch career resource'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-resources/<resource_id>', methods=['PUT'])
 def update_career_resource(resource_id):
@@ -3565,10 +3662,6 @@ def update_career_resource(resource_id):
     except Error as e:
         logger.error(f"Error updating career resource {resource_id}: {e}")
         return jsonify({'error': 'Failed to update career resource'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/career-resources/<resource_id>', methods=['DELETE'])
 def delete_career_resource(resource_id):
@@ -3603,13 +3696,63 @@ def delete_career_resource(resource_id):
     except Error as e:
         logger.error(f"Error deleting career resource {resource_id}: {e}")
         return jsonify({'error': 'Failed to delete career resource'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
         
 # Behavior Records Endpoints
+# Cursor pagination order for behavior records (newest first)
+BEHAVIOR_KEYSET = Keyset(
+    KeyColumn('br.date', 'date', descending=True),
+    KeyColumn('br.record_id', 'record_id', descending=True)
+)
+
+# Behavior record list fields in frontend format (?fields= picks a subset)
+BEHAVIOR_FIELDS = FieldSet(
+    Field('id', 'br.record_id'),
+    Field('studentId', 'br.student_id'),
+    Field('student', ('br.student_id', 's.name as student_name'), lambda student_id, student_name: {
+        'id': student_id,
+        'name': student_name or 'Unknown Student'
+    }),
+    Field('date', 'br.date', isoformat),
+    Field('type', 'br.behavior_type'),
+    Field('category', 'br.category'),
+    Field('description', 'br.description'),
+    Field('severity', 'br.severity'),
+    Field('actionTaken', 'br.action_taken'),
+    Field('reporter', ('br.reporter_id', 'u.name as recorder_name'), lambda reporter_id, recorder_name: {
+        'id': reporter_id,
+        'name': recorder_name or 'System'
+    }),
+    Field('followUpRequired', 'br.follow_up_required', bool),
+    keys=('br.date', 'br.record_id')
+)
+
+def behavior_listing(args, select):
+    """Active behavior records matching the list filters in args"""
+    listing = ListQuery(select, 'behavior_records br')
+    listing.join('st', 'LEFT JOIN students st ON br.student_id = st.student_id')
+    listing.join('s', 'LEFT JOIN users s ON st.user_id = s.user_id', depends_on=('st',))
+    listing.join('u', 'LEFT JOIN users u ON br.reporter_id = u.user_id')
+    listing.where('br.is_active = TRUE')
+    
+    if args.get('student'):
+        listing.where('br.student_id = %s', args['student'])
+    
+    if args.get('type'):
+        listing.where('br.behavior_type = %s', args['type'])
+    
+    if args.get('category'):
+        listing.where('br.category = %s', args['category'])
+    
+    if args.get('startDate'):
+        listing.where('br.date >= %s', args['startDate'])
+    
+    if args.get('endDate'):
+        listing.where('br.date <= %s', args['endDate'])
+    
+    return listing
+
 @app.route('/api/behavior-records', methods=['GET'])
+@conditional_get('behavior_records', 'students', 'users')
 def get_behavior_records():
     """Get behavior records with optional filtering"""
     connection = get_db_connection()
@@ -3619,100 +3762,38 @@ def get_behavior_records():
     try:
         cursor = connection.cursor(dictionary=True)
         # Get query parameters
-        student_id = request.args.get('student')
-        behavior_type = request.args.get('type')
-        category = request.args.get('category')
-        start_date = request.args.get('startDate')
-        end_date = request.args.get('endDate')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 20))
         offset = (page - 1) * limit
+        mapper = BEHAVIOR_FIELDS.compile(BEHAVIOR_FIELDS.parse(request.args))
         
         # Build query
-        base_query = """
-            SELECT br.*, s.name as student_name, u.name as recorder_name
-            FROM behavior_records br
-            LEFT JOIN students st ON br.student_id = st.student_id
-            LEFT JOIN users s ON st.user_id = s.user_id
-            LEFT JOIN users u ON br.reporter_id = u.user_id
-            WHERE br.is_active = TRUE
-        """
-        
-        params = []
-        if student_id:
-            base_query += " AND br.student_id = %s"
-            params.append(student_id)
-        
-        if behavior_type:
-            base_query += " AND br.behavior_type = %s"
-            params.append(behavior_type)
-        
-        if category:
-            base_query += " AND br.category = %s"
-            params.append(category)
-        
-        if start_date:
-            base_query += " AND br.date >= %s"
-            params.append(start_date)
-        
-        if end_date:
-            base_query += " AND br.date <= %s"
-            params.append(end_date)
-        
-        base_query += " ORDER BY br.date DESC"
+        listing = behavior_listing(request.args, mapper.select)
         
         # Get total count
-        count_query = base_query.replace(
-            "SELECT br.*, s.name as student_name, u.name as recorder_name",
-            "SELECT COUNT(*) as total"
-        )
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get paginated results
-        paginated_query = base_query + " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(paginated_query, params)
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_count, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
-        records = cursor.fetchall()        # Format response
-        result = []
-        for record in records:
-            result.append({
-                'id': record['record_id'],
-                'studentId': record['student_id'],
-                'student': {
-                    'id': record['student_id'],
-                    'name': record['student_name'] or 'Unknown Student'
-                },
-                'date': record['date'].isoformat() if record['date'] else None,
-                'type': record['behavior_type'],
-                'category': record['category'],
-                'description': record['description'],
-                'severity': record['severity'],
-                'actionTaken': record['action_taken'],
-                'reporter': {
-                    'id': record['reporter_id'],
-                    'name': record['recorder_name'] or 'System'
-                },
-                'followUpRequired': bool(record['follow_up_required'])
-            })
+        # Get paginated results (offset or cursor mode)
+        listing.prune_joins(BEHAVIOR_KEYSET.order_by())
+        result, page_info = fetch_page(
+            connection.cursor(), listing.sql(), listing.params, BEHAVIOR_KEYSET, request.args, limit, offset, mapper
+        )
         
-        total_pages = (total_count + limit - 1) // limit
+        total_pages = count_pages(total_count, limit)
         
-        return jsonify({
+        return list_response({
             'results': result,
             'count': total_count,
             'total_pages': total_pages,
-            'current_page': page
-        })
+            'current_page': page,
+            'count_mode': count_mode,
+            **page_info
+        }, 'results')
         
     except Error as e:
         logger.error(f"Error fetching behavior records: {e}")
         return jsonify({'error': 'Failed to fetch behavior records'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/behavior-records', methods=['POST'])
 def create_behavior_record():
@@ -3721,7 +3802,6 @@ def create_behavior_record():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None    
     try:
         data = request.get_json()
         
@@ -3799,11 +3879,6 @@ def create_behavior_record():
     except Error as e:        
         logger.error(f"Error creating behavior record: {e}")
         return jsonify({'error': 'Failed to create behavior record'}), 500
-    finally:
-        if connection and connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 @app.route('/api/behavior-records/<record_id>', methods=['PUT'])
 def update_behavior_record(record_id):
@@ -3890,10 +3965,6 @@ def update_behavior_record(record_id):
     except Error as e:
         logger.error(f"Error updating behavior record {record_id}: {e}")
         return jsonify({'error': 'Failed to update behavior record'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/behavior-records/<record_id>', methods=['DELETE'])
 def delete_behavior_record(record_id):
@@ -3910,7 +3981,9 @@ def delete_behavior_record(record_id):
             return jsonify({'error': 'Record not found'}), 404
         
         # Delete the record
+        record_deletions(cursor, 'behaviorRecords', 'behavior_records', 'record_id', 'record_id = %s', (record_id,))
         cursor.execute("DELETE FROM behavior_records WHERE record_id = %s", (record_id,))
+        bump_table_versions(cursor, 'behavior_records')
         connection.commit()
         
         return jsonify({'message': 'Record deleted successfully'})
@@ -3918,10 +3991,6 @@ def delete_behavior_record(record_id):
     except Error as e:
         logger.error(f"Error deleting behavior record {record_id}: {e}")
         return jsonify({'error': 'Failed to delete behavior record'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/behavior-records/summary', methods=['GET'])
 def get_behavior_summary():
@@ -3930,7 +3999,6 @@ def get_behavior_summary():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         student_id = request.args.get('student')
         if not student_id:
@@ -4011,14 +4079,70 @@ def get_behavior_summary():
     except Error as e:
         logger.error(f"Error fetching behavior summary: {e}")
         return jsonify({'error': 'Failed to fetch behavior summary'}), 500
-    finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 # Counseling Sessions Endpoints
+# Cursor pagination order for counseling sessions (newest first)
+SESSION_KEYSET = Keyset(
+    KeyColumn('cs.date', 'date', descending=True),
+    KeyColumn('cs.session_id', 'session_id', descending=True)
+)
+
+# Counseling session list fields in frontend format (?fields= picks a subset)
+SESSION_FIELDS = FieldSet(
+    Field('id', 'cs.session_id'),
+    Field('studentId', 'cs.student_id'),
+    Field('student', ('cs.student_id', 's.name as student_name'), lambda student_id, student_name: {
+        'id': student_id,
+        'name': student_name or 'Unknown Student'
+    }),
+    Field('date', 'cs.date', isoformat),
+    Field('duration', 'cs.duration'),
+    Field('type', 'cs.session_type'),
+    Field('notes', 'cs.notes'),
+    Field('outcome', 'cs.outcome'),
+    Field('nextSteps', 'cs.next_steps'),
+    Field('followUp', 'cs.follow_up'),
+    Field('approvalStatus', 'cs.approval_status'),
+    Field('approvedBy', 'cs.approved_by'),
+    Field('approvedAt', 'cs.approved_at', isoformat),
+    Field('rejectionReason', 'cs.rejection_reason'),
+    Field('counselor', ('cs.counselor_id', 'c.name as counselor_name'), lambda counselor_id, counselor_name: {
+        'id': counselor_id,
+        'name': counselor_name or 'Unknown Counselor'
+    }),
+    keys=('cs.date', 'cs.session_id')
+)
+
+def session_listing(args, select):
+    """Active counseling sessions matching the list filters in args"""
+    listing = ListQuery(select, 'counseling_sessions cs')
+    listing.join('st', 'LEFT JOIN students st ON cs.student_id = st.student_id')
+    listing.join('s', 'LEFT JOIN users s ON st.user_id = s.user_id', depends_on=('st',))
+    listing.join('c', 'LEFT JOIN users c ON cs.counselor_id = c.user_id')
+    listing.where('cs.is_active = TRUE')
+    
+    if args.get('student'):
+        listing.where('cs.student_id = %s', args['student'])
+    
+    if args.get('type'):
+        listing.where('cs.session_type = %s', args['type'])
+    
+    if args.get('outcome'):
+        listing.where('cs.outcome = %s', args['outcome'])
+    
+    if args.get('approvalStatus'):
+        listing.where('cs.approval_status = %s', args['approvalStatus'])
+    
+    if args.get('startDate'):
+        listing.where('cs.date >= %s', args['startDate'])
+    
+    if args.get('endDate'):
+        listing.where('cs.date <= %s', args['endDate'])
+    
+    return listing
+
 @app.route('/api/counseling-sessions', methods=['GET'])
+@conditional_get('counseling_sessions', 'students', 'users')
 def get_counseling_sessions():
     """Get counseling sessions with optional filtering"""
     connection = get_db_connection()
@@ -4027,109 +4151,38 @@ def get_counseling_sessions():
     
     try:
         cursor = connection.cursor(dictionary=True)        # Get query parameters
-        student_id = request.args.get('student')
-        session_type = request.args.get('type')
-        outcome = request.args.get('outcome')
-        approval_status = request.args.get('approvalStatus')
-        start_date = request.args.get('startDate')
-        end_date = request.args.get('endDate')
         page = int(request.args.get('page', 1))
         limit = int(request.args.get('limit', 20))
         offset = (page - 1) * limit
+        mapper = SESSION_FIELDS.compile(SESSION_FIELDS.parse(request.args))
         
         # Build query
-        base_query = """
-            SELECT cs.*, s.name as student_name, c.name as counselor_name
-            FROM counseling_sessions cs
-            LEFT JOIN students st ON cs.student_id = st.student_id
-            LEFT JOIN users s ON st.user_id = s.user_id
-            LEFT JOIN users c ON cs.counselor_id = c.user_id
-            WHERE cs.is_active = TRUE
-        """
-        
-        params = []
-        if student_id:
-            base_query += " AND cs.student_id = %s"
-            params.append(student_id)
-        if session_type:
-            base_query += " AND cs.session_type = %s"
-            params.append(session_type)
-        
-        if outcome:
-            base_query += " AND cs.outcome = %s"
-            params.append(outcome)
-        
-        if approval_status:
-            base_query += " AND cs.approval_status = %s"
-            params.append(approval_status)
-        
-        if start_date:
-            base_query += " AND cs.date >= %s"
-            params.append(start_date)
-        
-        if end_date:
-            base_query += " AND cs.date <= %s"
-            params.append(end_date)
-        
-        base_query += " ORDER BY cs.date DESC"
+        listing = session_listing(request.args, mapper.select)
         
         # Get total count
-        count_query = base_query.replace(
-            "SELECT cs.*, s.name as student_name, c.name as counselor_name",
-            "SELECT COUNT(*) as total"
-        )
-        cursor.execute(count_query, params)
-        total_count = cursor.fetchone()['total']
-        
-        # Get paginated results
-        paginated_query = base_query + " LIMIT %s OFFSET %s"
-        params.extend([limit, offset])
-        cursor.execute(paginated_query, params)
+        count_mode, count_max_age = parse_count_args(request.args)
+        total_count, count_mode = count_engine.count(cursor, listing, count_mode, count_max_age)
         
-        sessions = cursor.fetchall()
-          # Format response
-        result = []
-        for session in sessions:
-            result.append({
-                'id': session['session_id'],
-                'studentId': session['student_id'],
-                'student': {
-                    'id': session['student_id'],
-                    'name': session['student_name'] or 'Unknown Student'
-                },
-                'date': session['date'].isoformat() if session['date'] else None,
-                'duration': session['duration'],
-                'type': session['session_type'],
-                'notes': session['notes'],
-                'outcome': session['outcome'],
-                'nextSteps': session['next_steps'],
-                'followUp': session.get('follow_up', ''),
-                'approvalStatus': session.get('approval_status', 'pending'),
-                'approvedBy': session.get('approved_by'),
-                'approvedAt': session['approved_at'].isoformat() if session.get('approved_at') else None,
-                'rejectionReason': session.get('rejection_reason'),
-                'counselor': {
-                    'id': session['counselor_id'],
-                    'name': session['counselor_name'] or 'Unknown Counselor'
-                }
-            })
+        # Get paginated results (offset or cursor mode)
+        listing.prune_joins(SESSION_KEYSET.order_by())
+        result, page_info = fetch_page(
+            connection.cursor(), listing.sql(), listing.params, SESSION_KEYSET, request.args, limit, offset, mapper
+        )
         
-        total_pages = (total_count + limit - 1) // limit
+        total_pages = count_pages(total_count, limit)
         
-        return jsonify({
+        return list_response({
             'results': result,
             'count': total_count,
             'total_pages': total_pages,
-            'current_page': page
-        })
+            'current_page': page,
+            'count_mode': count_mode,
+            **page_info
+        }, 'results')
         
     except Error as e:
         logger.error(f"Error fetching counseling sessions: {e}")
         return jsonify({'error': 'Failed to fetch counseling sessions'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions', methods=['POST'])
 def create_counseling_session():
@@ -4138,7 +4191,6 @@ def create_counseling_session():
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         data = request.get_json()
         logger.info(f"Creating counseling session with data: {data}")
@@ -4249,13 +4301,9 @@ def create_counseling_session():
     except Exception as e:
         logger.error(f"Unexpected error creating counseling session: {e}")
         return jsonify({'error': f'Unexpected error: {str(e)}'}), 500
-    finally:
-        if connection and connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/<session_id>', methods=['GET'])
+@conditional_get('counseling_sessions', 'students', 'users')
 def get_counseling_session(session_id):
     """Get a specific counseling session"""
     connection = get_db_connection()
@@ -4301,10 +4349,6 @@ def get_counseling_session(session_id):
     except Error as e:
         logger.error(f"Error fetching counseling session {session_id}: {e}")
         return jsonify({'error': 'Failed to fetch counseling session'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/<session_id>', methods=['PUT'])
 def update_counseling_session(session_id):
@@ -4412,10 +4456,6 @@ def update_counseling_session(session_id):
     except Error as e:
         logger.error(f"Error updating counseling session {session_id}: {e}")
         return jsonify({'error': 'Failed to update counseling session'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/<session_id>', methods=['DELETE'])
 def delete_counseling_session(session_id):
@@ -4440,10 +4480,6 @@ def delete_counseling_session(session_id):
     except Error as e:
         logger.error(f"Error deleting counseling session {session_id}: {e}")
         return jsonify({'error': 'Failed to delete counseling session'}), 500
-    finally:
-        if connection.is_connected():
-            cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/<session_id>/approve', methods=['PUT'])
 def approve_counseling_session(session_id):
@@ -4452,7 +4488,6 @@ def approve_counseling_session(session_id):
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         data = request.get_json()
         approver_id = data.get('approver_id')
@@ -4517,11 +4552,6 @@ def approve_counseling_session(session_id):
     except Error as e:
         logger.error(f"Error approving counseling session {session_id}: {e}")
         return jsonify({'error': 'Failed to approve counseling session'}), 500
-    finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/<session_id>/reject', methods=['PUT'])
 def reject_counseling_session(session_id):
@@ -4530,7 +4560,6 @@ def reject_counseling_session(session_id):
     if not connection:
         return jsonify({'error': 'Database connection failed'}), 500
     
-    cursor = None
     try:
         data = request.get_json()
         approver_id = data.get('approver_id')
@@ -4596,11 +4625,6 @@ def reject_counseling_session(session_id):
     except Error as e:
         logger.error(f"Error rejecting counseling session {session_id}: {e}")
         return jsonify({'error': 'Failed to reject counseling session'}), 500
-    finally:
-        if connection.is_connected():
-            if cursor:
-                cursor.close()
-            connection.close()
 
 @app.route('/api/counseling-sessions/analytics', methods=['GET'])
 def get_counseling_analytics():
@@ -4697,11 +4721,443 @@ def get_counseling_analytics():
     except Error as e:
         logger.error(f"Error fetching counseling analytics: {e}")
         return jsonify({'error': 'Failed to fetch counseling analytics'}), 500
-    finally:
-        if connection.is_connected():
+
+# Delta Sync Endpoint
+# A row's change stamp is its own updated_at, so each feed seeks on
+# idx_updated_at. Student items also carry the user's name, email and photo
+# and the class: the handlers changing those touch the students as well.
+SYNC_ENTITIES = {
+    'students': SyncEntity(
+        'students',
+        lambda: ListQuery(STUDENT_FIELDS.select(), 'students s')
+            .join('u', 'JOIN users u ON s.user_id = u.user_id')
+            .join('c', 'LEFT JOIN classes c ON s.class_id = c.class_id'),
+        stamp='s.updated_at',
+        key='s.student_id', field='student_id', active='s.is_active',
+        format=STUDENT_FIELDS.compile().map_dict
+    ),
+    'classes': SyncEntity(
+        'classes',
+        lambda: ListQuery(CLASS_FIELDS.select(), 'classes'),
+        stamp='updated_at', key='class_id', field='class_id', active='is_active',
+        format=CLASS_FIELDS.compile().map_dict
+    ),
+    'counselingSessions': SyncEntity(
+        'counselingSessions',
+        lambda: ListQuery(SESSION_FIELDS.select(), 'counseling_sessions cs')
+            .join('st', 'LEFT JOIN students st ON cs.student_id = st.student_id')
+            .join('s', 'LEFT JOIN users s ON st.user_id = s.user_id', depends_on=('st',))
+            .join('c', 'LEFT JOIN users c ON cs.counselor_id = c.user_id'),
+        stamp='cs.updated_at', key='cs.session_id', field='session_id', active='cs.is_active',
+        format=SESSION_FIELDS.compile().map_dict
+    ),
+    'assessments': SyncEntity(
+        'assessments',
+        lambda: ListQuery(ASSESSMENT_FIELDS.select(), 'mental_health_assessments mha')
+            .join('u', 'LEFT JOIN users u ON mha.assessor_id = u.user_id'),
+        stamp='mha.updated_at', key='mha.assessment_id', field='assessment_id', active='mha.is_active',
+        format=ASSESSMENT_FIELDS.compile().map_dict
+    ),
+    'behaviorRecords': SyncEntity(
+        'behaviorRecords',
+        lambda: ListQuery(BEHAVIOR_FIELDS.select(), 'behavior_records br')
+            .join('st', 'LEFT JOIN students st ON br.student_id = st.student_id')
+            .join('s', 'LEFT JOIN users s ON st.user_id = s.user_id', depends_on=('st',))
+            .join('u', 'LEFT JOIN users u ON br.reporter_id = u.user_id'),
+        stamp='br.updated_at', key='br.record_id', field='record_id', active='br.is_active',
+        format=BEHAVIOR_FIELDS.compile().map_dict
+    ),
+}
+
+SYNC_MAX_LIMIT = 2000
+
+# User and class columns shown in student list items
+STUDENT_USER_FIELDS = ('name', 'email', 'photo')
+STUDENT_CLASS_FIELDS = ('name', 'gradeLevel')
+
+def touch_students(cursor, condition, params):
+    """Move updated_at of the students whose items show a changed user or class, in the writer's transaction"""
+    cursor.execute(f"UPDATE students SET updated_at = CURRENT_TIMESTAMP WHERE {condition}", params)
+
+# Synced items of the other feeds that show a user's name (student, counselor,
+# reporter, assessor), as (table, conditions on the user id)
+USER_NAME_ITEMS = (
+    ('counseling_sessions', (
+        'counselor_id = %s', 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)'
+    )),
+    ('behavior_records', (
+        'reporter_id = %s', 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)'
+    )),
+    ('mental_health_assessments', ('assessor_id = %s',)),
+)
+
+def touch_user_items(cursor, user_id):
+    """Move updated_at of the synced items showing the name of user_id, in the writer's transaction"""
+    for table, conditions in USER_NAME_ITEMS:
+        cursor.execute(
+            f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP WHERE {' OR '.join(conditions)}",
+            (user_id,) * len(conditions)
+        )
+
+@app.route('/api/sync', methods=['GET'])
+def get_sync_changes():
+    """
+    Rows changed since a watermark (?since=<watermark>) for ?entities=<names>
+    (default: all). Without a watermark every live row is returned. Keep
+    calling with the returned watermark while hasMore is true.
+    """
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        names = [name for name in request.args.get('entities', '').split(',') if name] or list(SYNC_ENTITIES)
+        unknown = [name for name in names if name not in SYNC_ENTITIES]
+        if unknown:
+            return jsonify({'error': f"Unknown entities: {', '.join(unknown)}", 'entities': list(SYNC_ENTITIES)}), 400
+        
+        limit = min(max(int(request.args.get('limit', 500)), 1), SYNC_MAX_LIMIT)
+        since = request.args.get('since')
+        positions = decode_watermark(since) if since else {}
+        
+        cursor = connection.cursor(dictionary=True)
+        horizon = sync_horizon(cursor)
+        
+        # Per entity, oldest change first; a client applies them in order
+        changes = {}
+        has_more = False
+        for name in names:
+            entity = SYNC_ENTITIES[name]
+            entity_changes, positions[name], more = fetch_changes(cursor, entity, positions.get(name), horizon, limit)
+            has_more = has_more or more
+            items = []
+            for op, item_id, row in entity_changes:
+                if op == 'upsert':
+                    data = entity.format(row)
+                    items.append({'op': 'upsert', 'id': data['id'], 'data': data})
+                else:
+                    items.append({'op': 'delete', 'id': item_id})
+            changes[name] = items
+        
+        return jsonify({
+            'changes': changes,
+            'watermark': encode_watermark(positions),
+            'hasMore': has_more,
+            'syncedUntil': horizon.isoformat()
+        })
+        
+    except InvalidCursorError:
+        raise
+    except Error as e:
+        logger.error(f"Error fetching sync changes: {e}")
+        return jsonify({'error': 'Failed to fetch changes'}), 500
+
+# Export Endpoints
+# Row sources are shared with the sync feed; exports keep live rows only and
+# follow an index order so MySQL can send rows without sorting them first
+EXPORTS = {
+    'students': {
+        'fields': STUDENT_FIELDS, 'query': SYNC_ENTITIES['students'].query,
+        'active': 's.is_active = TRUE', 'date': None, 'order_by': 's.student_id'
+    },
+    'counseling-sessions': {
+        'fields': SESSION_FIELDS, 'query': SYNC_ENTITIES['counselingSessions'].query,
+        'active': 'cs.is_active = TRUE', 'date': 'cs.date', 'order_by': 'cs.date, cs.session_id'
+    },
+    'assessments': {
+        'fields': ASSESSMENT_FIELDS, 'query': SYNC_ENTITIES['assessments'].query,
+        'active': None, 'date': 'mha.date', 'order_by': 'mha.date, mha.assessment_id'
+    },
+    'behavior-records': {
+        'fields': BEHAVIOR_FIELDS, 'query': SYNC_ENTITIES['behaviorRecords'].query,
+        'active': 'br.is_active = TRUE', 'date': 'br.date', 'order_by': 'br.date, br.record_id'
+    },
+}
+
+@app.route('/api/export/<entity>', methods=['GET'])
+def export_entity(entity):
+    """
+    Stream every row of an entity as NDJSON (default) or CSV (?format=csv).
+    ?fields= narrows the columns; dated records take ?startDate= and ?endDate=.
+    """
+    spec = EXPORTS.get(entity)
+    if spec is None:
+        return jsonify({'error': f'Unknown export: {entity}', 'exports': list(EXPORTS)}), 404
+    
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return jsonify({'error': f'Unsupported export format: {export_format}', 'formats': ['ndjson', 'csv']}), 400
+    
+    fields = spec['fields'].parse(request.args)
+    mapper = spec['fields'].compile(fields)
+    
+    listing = spec['query']()
+    listing.select = mapper.select
+    if spec['active']:
+        listing.where(spec['active'])
+    if spec['date']:
+        start_date = request.args.get('startDate')
+        end_date = request.args.get('endDate')
+        if start_date:
+            listing.where(f"{spec['date']} >= %s", start_date)
+        if end_date:
+            listing.where(f"{spec['date']} <= %s", end_date)
+    listing.prune_joins(spec['order_by'])
+    
+    try:
+        rows = export_streamer.open(f"{listing.sql()} ORDER BY {spec['order_by']}", listing.params)
+    except ExportBusyError as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '30'
+        return response
+    except Error as e:
+        logger.error(f"Error starting {entity} export: {e}")
+        return jsonify({'error': f'Failed to export {entity}'}), 500
+    
+    items = map(mapper, rows)
+    if export_format == 'csv':
+        body, mimetype, extension = csv_chunks(items, fields, export_streamer.batch_size), CSV_MIMETYPE, 'csv'
+    else:
+        body, mimetype, extension = ndjson_chunks(items, export_streamer.batch_size), NDJSON_MIMETYPE, 'ndjson'
+    
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{entity}-{date.today().isoformat()}.{extension}"'
+    # Let reverse proxies pass chunks through instead of buffering the whole export
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# Image Endpoints
+# Stored image names are unique per upload and never rewritten, so clients
+# and proxies may cache them for a year without revalidating
+IMAGE_CACHE_MAX_AGE = 365 * 24 * 3600
+
+def send_stored(key, etag=None, max_age=0):
+    """
+    Send an object from image storage: from disk with local storage, else by
+    redirecting to a presigned object store URL, else streamed through
+    """
+    storage = image_service.storage
+    path = storage.local_path(key)
+    if path is not None:
+        directory, filename = os.path.split(path)
+        return send_from_directory(directory, filename, conditional=True, etag=etag, max_age=max_age)
+    
+    cache_control = f"public, max-age={max_age}, immutable" if max_age else 'no-cache'
+    url = image_service.redirect_url(key, cache_control=cache_control)
+    if url is not None:
+        # The redirect itself must not outlive the presigned URL
+        response = redirect(url)
+        response.cache_control.max_age = min(max_age, image_service.redirect_expires // 2)
+        return response
+    
+    try:
+        size_bytes, mtime = storage.stat(key)
+    except FileNotFoundError:
+        abort(404)
+    
+    response = Response(
+        mimetype=mimetypes.guess_type(key)[0] or 'application/octet-stream',
+        direct_passthrough=True
+    )
+    response.content_length = size_bytes
+    response.last_modified = mtime
+    response.cache_control.max_age = max_age
+    if etag:
+        response.set_etag(etag)
+    # Settle 304/412/416 and the range first, so only the bytes sent are fetched
+    response.make_conditional(request.environ, accept_ranges=True, complete_length=size_bytes)
+    if response.status_code not in (200, 206) or request.method == 'HEAD':
+        return response
+    
+    byte_range = None
+    if response.status_code == 206:
+        byte_range = response.content_range.start, response.content_range.stop
+    try:
+        stream = storage.open(key, byte_range)
+    except FileNotFoundError:
+        abort(404)
+    response.response = wrap_file(request.environ, stream)
+    return response
+
+def send_image(key, etag):
+    """Send a stored image with Range, conditional GET and immutable caching"""
+    # Serve the WebP copy to browsers that accept it
+    if image_service.webp_variants and 'image/webp' in request.headers.get('Accept', ''):
+        webp_key = image_service.webp_variant_key(key)
+        if webp_key != key and image_service.storage.exists(webp_key):
+            key, etag = webp_key, f"webp-{etag}"
+    
+    response = send_stored(key, etag=etag, max_age=IMAGE_CACHE_MAX_AGE)
+    if not response.location:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    if image_service.webp_variants:
+        response.vary.add('Accept')
+    return response
+
+def send_pending_image(filename):
+    """Serve the raw upload, uncached, while its variants are being generated"""
+    staging_key = image_service.staging_key(filename)
+    if not image_service.storage.exists(staging_key):
+        abort(404)
+    
+    response = send_stored(staging_key)
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/api/images/upload', methods=['POST'])
+def upload_image():
+    """
+    Upload an image: multipart field 'image' or 'file', or the raw image as
+    the request body (Content-Type: image/*, optional ?filename=)
+    """
+    if request.mimetype.startswith('image/'):
+        result = image_service.upload_stream(
+            request.stream,
+            request.mimetype,
+            filename=request.args.get('filename'),
+            content_length=request.content_length
+        )
+    else:
+        file = request.files.get('image') or request.files.get('file')
+        result = image_service.upload_image(file)
+    
+    if 'error' in result:
+        return jsonify({'error': result['error']}), 400
+    
+    # 202 while thumbnails are still being generated in the background
+    file_info = result['file_info']
+    return jsonify(file_info), 201 if file_info['status'] == 'ready' else 202
+
+@app.route('/api/images/<filename>', methods=['GET'])
+def get_image(filename):
+    """Serve an uploaded image"""
+    if not image_service.allowed_file(filename):
+        abort(404)
+    
+    key = image_service.image_key(filename)
+    if not image_service.storage.exists(key):
+        return send_pending_image(filename)
+    
+    return send_image(key, etag=filename)
+
+@app.route('/api/images/<filename>/status', methods=['GET'])
+def get_image_status(filename):
+    """Processing status of an upload, for clients polling after a 202"""
+    status = image_service.allowed_file(filename) and image_service.image_status(filename)
+    if not status:
+        return jsonify({'error': 'Image not found'}), 404
+    
+    return jsonify({
+        'filename': filename,
+        'status': status,
+        'url': image_service.image_url(filename),
+        'thumbnail_urls': {
+            size_name: image_service.image_url(filename, size_name)
+            for size_name in image_service.thumbnail_sizes
+        }
+    })
+
+@app.route('/api/images/thumbnails/<size>/<filename>', methods=['GET'])
+def get_image_thumbnail(size, filename):
+    """
+    Serve a thumbnail of an uploaded image, rendered on first request.
+    size is small, medium, large or one of the allowed pixel sizes (e.g. 96).
+    """
+    if not image_service.thumbnail_box(size) or not image_service.allowed_file(filename):
+        abort(404)
+    
+    webp = image_service.webp_variants and 'image/webp' in request.headers.get('Accept', '')
+    key = image_service.get_thumbnail(filename, size, webp=webp)
+    if key is None:
+        return send_pending_image(filename)
+    
+    return send_image(key, etag=f"{'webp-' if webp else ''}{size}-{filename}")
+
+@app.route('/api/images/<filename>', methods=['DELETE'])
+def delete_image(filename):
+    """Delete an uploaded image and its thumbnails unless a user still uses it"""
+    if not image_service.allowed_file(filename):
+        abort(404)
+    
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+    
+    try:
+        cursor = connection.cursor(dictionary=True)
+        cursor.execute(
+            "SELECT COUNT(*) as count FROM users WHERE photo = %s",
+            (image_service.image_url(filename),)
+        )
+        if cursor.fetchone()['count'] > 0:
+            return jsonify({'error': 'Image is still in use'}), 409
+        
+        if not image_service.image_status(filename):
+            return jsonify({'error': 'Image not found'}), 404
+        
+        # Identical uploads share one stored image. If it was uploaded again
+        # recently, that upload may be about to be referenced, so only this
+        # reference is dropped and the orphan sweep removes the file later.
+        if image_service.recently_claimed(filename):
+            return jsonify({'message': 'Image deleted successfully'})
+        
+        if not image_service.delete_image(filename):
+            return jsonify({'error': 'Failed to delete image'}), 500
+        
+        return jsonify({'message': 'Image deleted successfully'})
+        
+    except Error as e:
+        logger.error(f"Error deleting image {filename}: {e}")
+        return jsonify({'error': 'Failed to delete image'}), 500
+
+# Worker lifecycle (see gunicorn.conf.py)
+# Reference data every page load asks for, fetched once before a worker takes traffic
+WARM_UP_PATHS = ('/api/counselors', '/api/classes')
+
+def warm_up():
+    """
+    Get a worker ready before it accepts requests: open its pool connections,
+    run a trivial query, start the invalidation listener, compile the default
+    row mappers and prime the reference cache. Returns False if the database
+    could not be reached (the worker still starts and retries on demand).
+    """
+    started = time.monotonic()
+    invalidation_bus.ensure_started()
+    for field_set in (USER_FIELDS, COUNSELOR_FIELDS, CLASS_FIELDS, CLASS_STUDENT_FIELDS, STUDENT_FIELDS,
+                      ASSESSMENT_FIELDS, CAREER_ASSESSMENT_FIELDS, CAREER_RESOURCE_FIELDS, BEHAVIOR_FIELDS, SESSION_FIELDS):
+        field_set.compile()
+
+    try:
+        db_pool.prefill()
+        connection = db_pool.acquire()
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
             cursor.close()
+        finally:
             connection.close()
+    except Error as e:
+        logger.error(f"Warm-up could not reach the database: {e}")
+        return False
+
+    with app.test_client() as client:
+        for path in WARM_UP_PATHS:
+            status = client.get(path).status_code
+            if status != 200:
+                logger.warning(f"Warm-up request {path} returned {status}")
+
+    logger.info(f"Worker {os.getpid()} warmed up in {(time.monotonic() - started) * 1000:.0f} ms")
+    return True
+
+def shut_down():
+    """Release a worker's resources once it has drained: finish queued image jobs, close idle connections"""
+    image_service.shutdown(wait=True)
+    db_pool.dispose()
 
+# Development server; production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == '__main__':
     # Test database connection on startup
     connection = get_db_connection()
@@ -0,0 +1,111 @@
+"""
+Compact encodings for list responses
+Clients opt in with ?format=columnar|msgpack or an Accept header. The items of
+a list payload become one array per field instead of one object per row, and
+columns with few distinct values (class names, counselor names, enums) are
+dictionary-encoded: the column holds indexes into a table of the values.
+"""
+
+from json_provider import dumps
+
+try:
+    import msgpack
+except ImportError:  # only needed for ?format=msgpack
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+COLUMNAR_MIMETYPE = 'application/vnd.counselorhub.columnar+json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+MIMETYPES = {
+    'json': JSON_MIMETYPE,
+    'columnar': COLUMNAR_MIMETYPE,
+    'msgpack': MSGPACK_MIMETYPE,
+}
+
+# A column is dictionary-encoded when it has at most this share of distinct values
+DICTIONARY_MAX_RATIO = 0.5
+
+
+class UnsupportedFormatError(ValueError):
+    """Raised when ?format= names an encoding this server cannot produce"""
+
+
+def available_formats():
+    return [name for name in MIMETYPES if name != 'msgpack' or msgpack is not None]
+
+
+def negotiate(request):
+    """Encoding for a response: ?format= if given, else the best match of the Accept header"""
+    requested = request.args.get('format')
+    if requested:
+        if requested not in available_formats():
+            raise UnsupportedFormatError(f"Unsupported format: {requested}")
+        return requested
+
+    # JSON comes first, so */* and equal preferences keep the default
+    offered = [MIMETYPES[name] for name in available_formats()]
+    best = request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+    return next(name for name, mimetype in MIMETYPES.items() if mimetype == best)
+
+
+def flatten(item, prefix=''):
+    """Nested objects ({'student': {'id', 'name'}}) become dotted fields"""
+    flat = {}
+    for key, value in item.items():
+        if isinstance(value, dict) and value:
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def _dictionary_encode(values):
+    """(table, codes) for a column of repeated strings, or None if it would not pay off"""
+    table = {}
+    for value in values:
+        if value is not None and not isinstance(value, str):
+            return None
+        if value not in table:
+            table[value] = len(table)
+            if len(table) > len(values) * DICTIONARY_MAX_RATIO:
+                return None
+    return list(table), [table[value] for value in values]
+
+
+def columnar(items):
+    """
+    {'count', 'fields', 'columns', 'dictionaries'}: columns[i] holds the
+    values of fields[i] for every item; for a field listed in dictionaries
+    it holds indexes into dictionaries[field] instead
+    """
+    rows = [flatten(item) for item in items]
+    fields = list(dict.fromkeys(field for row in rows for field in row))
+
+    columns = []
+    dictionaries = {}
+    for field in fields:
+        values = [row.get(field) for row in rows]
+        encoded = _dictionary_encode(values) if len(values) > 1 else None
+        if encoded is not None:
+            dictionaries[field], values = encoded
+        columns.append(values)
+
+    return {'count': len(rows), 'fields': fields, 'columns': columns, 'dictionaries': dictionaries}
+
+
+def encode(payload, items_key, format):
+    """
+    (body, mimetype) of a list payload in a compact format. items_key names
+    the list inside the payload; None when the payload is the list itself.
+    """
+    if items_key is None:
+        payload = columnar(payload)
+    else:
+        payload = dict(payload)
+        payload[items_key] = columnar(payload[items_key])
+    payload['encoding'] = 'columnar'
+
+    if format == 'msgpack':
+        return msgpack.packb(payload, default=str, use_bin_type=True), MSGPACK_MIMETYPE
+    return dumps(payload), COLUMNAR_MIMETYPE
@@ -0,0 +1,157 @@
+"""
+Response compression for API responses
+Text responses above a size threshold are compressed with the best encoding
+the client accepts (br when the brotli package is installed, else gzip).
+Streamed bodies such as exports are compressed chunk by chunk and flushed
+after every chunk, so rows still reach the client as they are read.
+"""
+
+import os
+import zlib
+import threading
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/msgpack',
+    'application/javascript',
+    'text/javascript',
+    'text/html',
+    'text/css',
+    'text/csv',
+    'text/plain',
+    'image/svg+xml',
+}
+
+
+def is_compressible(mimetype):
+    return mimetype in COMPRESSIBLE_MIMETYPES or (mimetype or '').endswith('+json')
+
+
+class _BrotliStream:
+    """zlib-style compress()/flush() over a brotli compressor"""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=zlib.Z_FINISH):
+        if mode == zlib.Z_FINISH:
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+class ResponseCompressor:
+    """
+    after_request hook compressing responses in place. Files sent from disk
+    (direct passthrough) are left alone: images are compressed already and
+    static assets have precompressed variants (see static_assets).
+    """
+
+    def __init__(self, min_size=1024, gzip_level=6, brotli_quality=4, stream=True, enabled=True):
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.stream = stream
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._stats = {'compressed': 0, 'streamed': 0, 'too_small': 0, 'bytes_in': 0, 'bytes_out': 0, 'br': 0, 'gzip': 0}
+
+    def encodings(self):
+        """Supported encodings, most preferred first"""
+        return ['br', 'gzip'] if brotli is not None else ['gzip']
+
+    def negotiate(self, request):
+        """Encoding to use for request, or None when the client accepts none of ours"""
+        return request.accept_encodings.best_match(self.encodings())
+
+    def _compressor(self, encoding):
+        if encoding == 'br':
+            return _BrotliStream(self.brotli_quality)
+        # wbits 31: deflate with a gzip header and trailer
+        return zlib.compressobj(self.gzip_level, zlib.DEFLATED, 31)
+
+    def _compress_stream(self, chunks, encoding):
+        compressor = self._compressor(encoding)
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode('utf-8')
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            # Closing the wrapper must still close the body (an export releases its connection)
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    def compress(self, request, response):
+        if not self.enabled or request.method == 'HEAD':
+            return response
+        if response.status_code < 200 or response.status_code in (204, 206, 304):
+            return response
+        if response.direct_passthrough or 'Content-Encoding' in response.headers:
+            return response
+        if not is_compressible(response.mimetype) or response.cache_control.no_transform:
+            return response
+        if response.is_streamed and not self.stream:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = self.negotiate(request)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+            with self._lock:
+                self._stats['streamed'] += 1
+                self._stats[encoding] += 1
+        else:
+            data = response.get_data()
+            if len(data) < self.min_size:
+                with self._lock:
+                    self._stats['too_small'] += 1
+                return response
+            compressor = self._compressor(encoding)
+            body = compressor.compress(data) + compressor.flush()
+            response.set_data(body)
+            with self._lock:
+                self._stats['compressed'] += 1
+                self._stats[encoding] += 1
+                self._stats['bytes_in'] += len(data)
+                self._stats['bytes_out'] += len(body)
+
+        response.headers['Content-Encoding'] = encoding
+        # The compressed bytes differ from the identity ones, so a strong ETag becomes weak
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['encodings'] = self.encodings()
+        stats['ratio'] = round(stats['bytes_out'] / stats['bytes_in'], 3) if stats['bytes_in'] else None
+        return stats
+
+
+def compressor_from_env():
+    return ResponseCompressor(
+        min_size=int(os.environ.get('COMPRESS_MIN_SIZE', 1024)),
+        gzip_level=int(os.environ.get('COMPRESS_GZIP_LEVEL', 6)),
+        brotli_quality=int(os.environ.get('COMPRESS_BROTLI_QUALITY', 4)),
+        stream=os.environ.get('COMPRESS_STREAMS', 'true').lower() in ('1', 'true', 'yes'),
+        enabled=os.environ.get('COMPRESS_RESPONSES', 'true').lower() in ('1', 'true', 'yes')
+    )
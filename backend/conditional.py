@@ -0,0 +1,97 @@
+"""
+Conditional GET support for JSON endpoints
+Strong ETags are derived from the change stamps of the tables a response is
+built from, so If-None-Match can be answered with 304 Not Modified before
+the endpoint runs its own queries
+"""
+
+import hashlib
+import json
+import logging
+from mysql.connector import Error
+
+from invalidation_bus import VERSIONS_TABLE
+
+logger = logging.getLogger(__name__)
+
+# updated_at has one-second resolution: two writes within the same second can
+# leave MAX(updated_at) unchanged, so no ETag is issued while the newest change
+# is this recent
+STAMP_GRACE_SECONDS = 2
+
+# Rows of cache_versions counting the hard deletes of each table
+TABLE_VERSION_PREFIX = 'table:'
+
+NO_SUCH_TABLE = 1146
+
+
+def bump_table_versions(cursor, *tables):
+    """
+    Count a hard delete from tables, on the cursor of the deleting
+    transaction so the new version is visible exactly when the rows are gone.
+    Inserts and updates need no bump: they move MAX(updated_at).
+    """
+    for table in tables:
+        try:
+            cursor.execute(
+                f"INSERT INTO `{VERSIONS_TABLE}` (namespace, version) VALUES (%s, 1) "
+                f"ON DUPLICATE KEY UPDATE version = version + 1",
+                (TABLE_VERSION_PREFIX + table,)
+            )
+        except Error as e:
+            # Before migration 3 responses simply go without ETags (table_stamps fails too)
+            if e.errno != NO_SUCH_TABLE:
+                raise
+            logger.warning(f"{VERSIONS_TABLE} is missing, run migrations.py")
+            return
+
+
+def table_stamps(cursor, tables):
+    """
+    (MAX(updated_at), delete version) of each table plus the server time, in
+    one round trip. MAX(updated_at) is read from idx_updated_at and the
+    version from the primary key of cache_versions, so neither scans the table.
+    Works with plain and dictionary cursors.
+    """
+    parts = ['NOW() AS now']
+    for index, table in enumerate(tables):
+        parts.append(f"(SELECT MAX(updated_at) FROM `{table}`) AS updated_{index}")
+        parts.append(
+            f"(SELECT version FROM `{VERSIONS_TABLE}` "
+            f"WHERE namespace = '{TABLE_VERSION_PREFIX}{table}') AS version_{index}"
+        )
+
+    cursor.execute(f"SELECT {', '.join(parts)}")
+    row = cursor.fetchone()
+    if isinstance(row, dict):
+        row = [row['now']] + [
+            value for index in range(len(tables))
+            for value in (row[f'updated_{index}'], row[f'version_{index}'])
+        ]
+    return row[0], list(row[1:])
+
+
+def tables_etag(cursor, tables, *variant):
+    """
+    Strong ETag for a response built from tables and varying by variant
+    (path, query string, ...). None while a change is too recent to be told
+    apart from the next one.
+    """
+    now, stamps = table_stamps(cursor, tables)
+    for updated_at in stamps[0::2]:
+        if updated_at is not None and (now - updated_at).total_seconds() < STAMP_GRACE_SECONDS:
+            return None
+
+    material = repr((tuple(tables), [str(stamp) for stamp in stamps], variant))
+    return hashlib.sha1(material.encode('utf-8')).hexdigest()
+
+
+def payload_etag(payload):
+    """Strong ETag of a JSON-serializable payload (for results kept in memory)"""
+    body = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()
+
+
+def request_variant(request):
+    """What a list/detail response varies by besides the data: path and query arguments"""
+    return request.path, tuple(sorted(request.args.items(multi=True)))
@@ -0,0 +1,135 @@
+"""
+Total-count engine for paginated list endpoints
+Supports exact, cached (with a freshness bound), estimated and skipped totals
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+COUNT_MODES = ('exact', 'cached', 'estimate', 'none')
+
+
+def parse_count_args(args):
+    """Read ?count=exact|cached|estimate|none and ?countMaxAge=<seconds>"""
+    mode = args.get('count', 'exact')
+    if mode not in COUNT_MODES:
+        mode = 'exact'
+
+    max_age = args.get('countMaxAge')
+    try:
+        max_age = float(max_age) if max_age is not None else None
+    except ValueError:
+        max_age = None
+
+    return mode, max_age
+
+
+def count_pages(total, limit):
+    if total is None or limit <= 0:
+        return None
+    return (total + limit - 1) // limit
+
+
+class CountEngine:
+    """Runs COUNT(*) for a ListQuery, optionally from a bounded TTL cache"""
+
+    def __init__(self, ttl=30.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (sql, params) -> (total, stored_at)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'estimates': 0, 'skipped': 0}
+
+    def count(self, cursor, listing, mode='exact', max_age=None):
+        """
+        Return (total, mode_used). total is None when the client skipped it.
+        cursor must be a dictionary cursor.
+        """
+        if mode == 'none':
+            with self._lock:
+                self._stats['skipped'] += 1
+            return None, 'none'
+
+        sql = listing.count_sql()
+        params = tuple(listing.params)
+
+        if mode == 'estimate':
+            estimate = self._estimate(cursor, sql, params)
+            if estimate is not None:
+                return estimate, 'estimate'
+            mode = 'exact'
+
+        if mode == 'cached':
+            # Clients may ask for fresher data than the server TTL, never staler
+            bound = self.ttl if max_age is None else min(max_age, self.ttl)
+            key = (sql, params)
+            now = time.monotonic()
+            with self._lock:
+                entry = self._cache.get(key)
+                if entry is not None and now - entry[1] <= bound:
+                    self._cache.move_to_end(key)
+                    self._stats['hits'] += 1
+                    return entry[0], 'cached'
+                self._stats['misses'] += 1
+
+            total = self._exact(cursor, sql, params)
+            self._store(key, total, now)
+            return total, 'cached'
+
+        return self._exact(cursor, sql, params), 'exact'
+
+    def _exact(self, cursor, sql, params):
+        cursor.execute(sql, params)
+        return cursor.fetchone()['total']
+
+    def _estimate(self, cursor, sql, params):
+        """Use the optimizer's row estimate from EXPLAIN instead of counting"""
+        try:
+            cursor.execute(f"EXPLAIN {sql}", params)
+            plan = cursor.fetchall()
+        except Exception as e:
+            logger.warning(f"Count estimate failed, falling back to exact count: {e}")
+            return None
+
+        estimate = 1.0
+        for step in plan:
+            rows = step.get('rows')
+            if rows is None:
+                continue
+            filtered = step.get('filtered') or 100.0
+            estimate *= float(rows) * float(filtered) / 100.0
+
+        with self._lock:
+            self._stats['estimates'] += 1
+        return int(round(estimate)) if plan else 0
+
+    def _store(self, key, total, stored_at):
+        with self._lock:
+            self._cache[key] = (total, stored_at)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._cache)
+            stats['ttl'] = self.ttl
+        return stats
+
+
+# Global instance
+count_engine = CountEngine(
+    ttl=float(os.environ.get('COUNT_CACHE_TTL', 30)),
+    max_entries=int(os.environ.get('COUNT_CACHE_MAX_ENTRIES', 1000))
+)
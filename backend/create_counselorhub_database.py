@@ -10,6 +10,7 @@ import bcrypt
 import uuid
 import json
 from datetime import datetime, date
+import migrations
 
 # Database configuration
 DB_CONFIG = {
@@ -577,7 +578,13 @@ def main():
         print("❌ Failed to create database user. Exiting.")
         return
     
-    # Step 5: Show information
+    # Step 5: Apply schema migrations (composite indexes)
+    print("\nStep 5: Applying schema migrations...")
+    if not migrations.migrate():
+        print("❌ Failed to apply schema migrations. Exiting.")
+        return
+    
+    # Step 6: Show information
     show_database_info()
     
     print("\n✅ CounselorHub database setup completed successfully!")
@@ -0,0 +1,298 @@
+"""
+Database connection pool for the CounselorHub backend
+Keeps a bounded set of MySQL connections that all request handlers share
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import deque
+import mysql.connector
+from mysql.connector import Error
+
+logger = logging.getLogger(__name__)
+
+
+class PoolExhaustedError(Error):
+    """Raised when no connection could be checked out before the acquire timeout"""
+
+
+class PooledConnection:
+    """
+    Thin wrapper around a MySQL connection checked out from the pool.
+    Calling close() hands the connection back to the pool instead of
+    tearing down the socket, so existing handlers keep working unchanged.
+    """
+
+    def __init__(self, pool, raw_connection, created_at):
+        self._pool = pool
+        self._raw = raw_connection
+        self._created_at = created_at
+        self._released = False
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def is_connected(self):
+        if self._released:
+            return False
+        return self._raw.is_connected()
+
+    def close(self):
+        """Return the connection to the pool (safe to call more than once)"""
+        if self._released:
+            return
+        self._released = True
+        self._pool._release(self._raw, self._created_at)
+
+    def discard(self):
+        """Close the connection instead of returning it (e.g. a result set was abandoned half read)"""
+        if self._released:
+            return
+        self._released = True
+        with self._pool._cond:
+            self._pool._in_use -= 1
+            self._pool._stats['checkins'] += 1
+        self._pool._discard(self._raw)
+
+    def __del__(self):
+        # Only report the leak: GC can run while this thread holds the pool's
+        # (non-reentrant) lock, so close() here could deadlock. Request
+        # connections are returned by the db_session teardown hook.
+        try:
+            if not self._released:
+                logger.warning("Pooled connection was garbage collected without being closed")
+        except Exception:
+            pass
+
+
+class ConnectionPool:
+    """
+    Bounded MySQL connection pool with overflow, acquire timeout,
+    pre-ping validation and max lifetime recycling.
+    """
+
+    def __init__(self, db_config, pool_size=5, max_overflow=10, timeout=10.0,
+                 recycle=3600, pre_ping=True, ping_interval=30.0):
+        self.db_config = dict(db_config)
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.pre_ping = pre_ping
+        self.ping_interval = ping_interval
+
+        self._idle = deque()  # (raw_connection, created_at, last_used)
+        self._open_count = 0
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+
+        self._stats = {
+            'checkouts': 0,
+            'checkins': 0,
+            'connects': 0,
+            'disconnects': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'waits': 0,
+            'wait_time_total_ms': 0.0,
+            'wait_time_max_ms': 0.0,
+            'exhausted': 0
+        }
+
+    @property
+    def max_connections(self):
+        return self.pool_size + self.max_overflow
+
+    def _connect(self):
+        raw = mysql.connector.connect(**self.db_config)
+        with self._cond:
+            self._stats['connects'] += 1
+        return raw
+
+    def _discard(self, raw, reason=None):
+        """Close a raw connection and free its slot"""
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._open_count -= 1
+            self._stats['disconnects'] += 1
+            if reason == 'recycled':
+                self._stats['recycled'] += 1
+            elif reason == 'ping':
+                self._stats['ping_failures'] += 1
+            self._cond.notify()
+
+    def _is_stale(self, created_at, now):
+        return self.recycle and self.recycle > 0 and now - created_at >= self.recycle
+
+    def _validate(self, raw, created_at, last_used, now):
+        """Return True if an idle connection is still usable"""
+        if self._is_stale(created_at, now):
+            self._discard(raw, 'recycled')
+            return False
+
+        if self.pre_ping and now - last_used >= self.ping_interval:
+            try:
+                raw.ping(reconnect=False)
+            except Exception as e:
+                logger.warning(f"Discarding pooled connection that failed pre-ping: {e}")
+                self._discard(raw, 'ping')
+                return False
+
+        return True
+
+    def acquire(self, timeout=None):
+        """Check out a connection, waiting up to timeout seconds for a free slot"""
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+
+        while True:
+            candidate = None
+            create_new = False
+
+            with self._cond:
+                while True:
+                    if self._idle:
+                        candidate = self._idle.pop()
+                        break
+                    if self._open_count < self.max_connections:
+                        self._open_count += 1
+                        create_new = True
+                        break
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats['exhausted'] += 1
+                        raise PoolExhaustedError(
+                            msg=f"Connection pool exhausted ({self.max_connections} connections in use)"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+            now = time.monotonic()
+
+            if create_new:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._open_count -= 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+            else:
+                raw, created_at, last_used = candidate
+                if not self._validate(raw, created_at, last_used, now):
+                    continue
+
+            wait_ms = (time.monotonic() - started) * 1000
+            with self._cond:
+                self._in_use += 1
+                self._stats['checkouts'] += 1
+                if waited:
+                    self._stats['waits'] += 1
+                self._stats['wait_time_total_ms'] += wait_ms
+                self._stats['wait_time_max_ms'] = max(self._stats['wait_time_max_ms'], wait_ms)
+
+            return PooledConnection(self, raw, created_at)
+
+    def _release(self, raw, created_at):
+        """Return a raw connection to the idle set or close it"""
+        with self._cond:
+            self._in_use -= 1
+            self._stats['checkins'] += 1
+
+        now = time.monotonic()
+        if self._is_stale(created_at, now):
+            self._discard(raw, 'recycled')
+            return
+
+        try:
+            # Never hand an open transaction to the next request
+            if raw.in_transaction:
+                raw.rollback()
+        except Exception as e:
+            logger.warning(f"Discarding pooled connection that could not be reset: {e}")
+            self._discard(raw)
+            return
+
+        with self._cond:
+            if len(self._idle) >= self.pool_size:
+                # Overflow connection: close it instead of keeping it idle
+                keep = False
+            else:
+                self._idle.append((raw, created_at, now))
+                keep = True
+                self._cond.notify()
+
+        if not keep:
+            self._discard(raw)
+
+    def prefill(self, count=None):
+        """Open up to count (default pool_size) connections ahead of the first requests"""
+        count = self.pool_size if count is None else min(count, self.max_connections)
+        connections = []
+        try:
+            for _ in range(count):
+                connections.append(self.acquire())
+        finally:
+            for connection in connections:
+                connection.close()
+        return len(connections)
+
+    def reset_after_fork(self):
+        """
+        Forget the connections inherited from the parent process. Their
+        sockets belong to the parent, so they are dropped without a close
+        (which would end the parent's session).
+        """
+        self._idle = deque()
+        self._open_count = 0
+        self._in_use = 0
+        self._cond = threading.Condition(threading.Lock())
+
+    def dispose(self):
+        """Close all idle connections"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+
+        for raw, _, _ in idle:
+            self._discard(raw)
+
+    def stats(self):
+        """Return pool counters for operators"""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'pool_size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'open': self._open_count,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'overflow_in_use': max(0, self._open_count - self.pool_size)
+            })
+
+        checkouts = stats['checkouts']
+        stats['wait_time_avg_ms'] = round(stats['wait_time_total_ms'] / checkouts, 3) if checkouts else 0.0
+        stats['wait_time_total_ms'] = round(stats['wait_time_total_ms'], 3)
+        stats['wait_time_max_ms'] = round(stats['wait_time_max_ms'], 3)
+        return stats
+
+
+def pool_settings_from_env():
+    """Read pool tuning knobs from the environment"""
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10)),
+        'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        'recycle': int(os.environ.get('DB_POOL_RECYCLE', 3600)),
+        'pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ('1', 'true', 'yes'),
+        'ping_interval': float(os.environ.get('DB_POOL_PING_INTERVAL', 30))
+    }
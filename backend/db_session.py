@@ -0,0 +1,66 @@
+"""
+Request-scoped database session for the CounselorHub backend
+A pooled connection is checked out on first use within a request and
+returned to the pool by the app teardown hook, whatever path the handler took
+"""
+
+from flask import g
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DatabaseSession:
+    """Wraps the request's pooled connection and tracks the cursors it hands out"""
+
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursors = []
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self._connection.cursor(*args, **kwargs)
+        self._cursors.append(cursor)
+        return cursor
+
+    def is_connected(self):
+        return self._connection is not None and self._connection.is_connected()
+
+    def close(self):
+        """Close tracked cursors and return the connection to the pool"""
+        if self._connection is None:
+            return
+
+        for cursor in self._cursors:
+            try:
+                cursor.close()
+            except Exception as e:
+                logger.debug(f"Error closing cursor during session cleanup: {e}")
+        self._cursors = []
+
+        connection = self._connection
+        self._connection = None
+        connection.close()
+
+
+def get_db(pool):
+    """Get the current request's session, checking out a connection on first use"""
+    session = g.get('_db_session')
+    if session is None or session._connection is None:
+        session = DatabaseSession(pool.acquire())
+        g._db_session = session
+    return session
+
+
+def close_db(exception=None):
+    """Teardown hook: release the request's connection if one was acquired"""
+    session = g.pop('_db_session', None)
+    if session is not None:
+        session.close()
+
+
+def init_app(app):
+    """Register the session teardown hook on the Flask app"""
+    app.teardown_appcontext(close_db)
@@ -0,0 +1,157 @@
+"""
+Streaming exports (NDJSON and CSV)
+Rows are read from an unbuffered cursor in batches and written out as they
+arrive, so an export of any size runs in constant memory. Each export holds
+its own pooled connection for as long as the client keeps reading.
+"""
+
+import os
+import io
+import csv
+import threading
+import itertools
+import logging
+from compact import flatten
+from json_provider import dumps
+
+logger = logging.getLogger(__name__)
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+CSV_MIMETYPE = 'text/csv'
+
+
+class ExportBusyError(RuntimeError):
+    """Raised when the maximum number of concurrent exports is already running"""
+
+
+class ExportStreamer:
+    """
+    Runs export queries on connections of its own (not the request's, which
+    is released before a streamed body is read) and limits how many exports
+    run at once, since each one keeps a pool connection busy.
+    """
+
+    def __init__(self, pool, max_concurrent=2, batch_size=500, net_write_timeout=3600):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.net_write_timeout = net_write_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._stats = {'started': 0, 'completed': 0, 'aborted': 0, 'rejected': 0, 'rows': 0}
+
+    def open(self, query, params=()):
+        """
+        Run an export query and return an iterator over its rows (tuples).
+        The query runs here, so its errors (and ExportBusyError when no slot
+        is free) reach the view before the response starts; the remaining
+        rows are read as the iterator is consumed.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise ExportBusyError('Too many exports running, try again shortly')
+
+        rows = self._rows(query, params)
+        try:
+            first = next(rows)
+        except StopIteration:
+            return iter(())
+        return itertools.chain([first], rows)
+
+    def _rows(self, query, params):
+        connection = None
+        finished = False
+        count = 0
+        try:
+            with self._lock:
+                self._stats['started'] += 1
+            connection = self.pool.acquire()
+            cursor = connection.cursor()
+            # MySQL stops sending after net_write_timeout if the client reads slowly
+            cursor.execute("SET SESSION net_write_timeout = %s", (self.net_write_timeout,))
+            cursor.close()
+
+            cursor = connection.cursor(buffered=False)
+            cursor.execute(query, list(params))
+            while True:
+                batch = cursor.fetchmany(self.batch_size)
+                if not batch:
+                    break
+                count += len(batch)
+                yield from batch
+            cursor.close()
+            finished = True
+        finally:
+            with self._lock:
+                self._stats['rows'] += count
+                self._stats['completed' if finished else 'aborted'] += 1
+            if connection is not None:
+                if finished:
+                    try:
+                        cursor = connection.cursor()
+                        cursor.execute("SET SESSION net_write_timeout = DEFAULT")
+                        cursor.close()
+                        connection.close()
+                    except Exception as e:
+                        logger.warning(f"Discarding export connection that could not be reset: {e}")
+                        connection.discard()
+                else:
+                    # Unread rows are still pending on the socket
+                    connection.discard()
+            self._slots.release()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def ndjson_chunks(items, batch_size=500):
+    """One JSON document per line, joined into chunks of batch_size lines"""
+    lines = []
+    for item in items:
+        lines.append(dumps(item))
+        if len(lines) >= batch_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+def csv_chunks(items, columns, batch_size=500):
+    """
+    CSV with a header row. Nested objects become dotted columns
+    (student.name), lists are joined with ';'. columns is the header used
+    when there are no rows to take it from.
+    """
+    buffer = io.StringIO()
+    writer = None
+    pending = 0
+    for item in items:
+        row = flatten(item)
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row), extrasaction='ignore')
+            writer.writeheader()
+        writer.writerow({
+            key: ';'.join(map(str, value)) if isinstance(value, list) else value
+            for key, value in row.items()
+        })
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if writer is None:
+        csv.writer(buffer).writerow(columns)
+    if buffer.getvalue():
+        yield buffer.getvalue()
+
+
+def streamer_from_env(pool):
+    return ExportStreamer(
+        pool,
+        max_concurrent=int(os.environ.get('EXPORT_MAX_CONCURRENT', 2)),
+        batch_size=int(os.environ.get('EXPORT_BATCH_SIZE', 500)),
+        net_write_timeout=int(os.environ.get('EXPORT_NET_WRITE_TIMEOUT', 3600))
+    )
@@ -0,0 +1,69 @@
+"""
+Production server settings for the CounselorHub backend
+Run from the backend directory (gunicorn reads this file by default):
+
+    gunicorn app:app
+
+Sizing: handlers spend most of their time waiting on MySQL, so each worker
+runs threads (gthread) and the worker count follows the cores. Every worker
+has its own connection pool. A request thread holds at most one connection
+(cache invalidations are published on it), but each running export streams
+on a connection of its own and keeps it after its request has ended, so
+keep GUNICORN_THREADS + EXPORT_MAX_CONCURRENT <= DB_POOL_SIZE +
+DB_POOL_MAX_OVERFLOW and GUNICORN_WORKERS * (DB_POOL_SIZE +
+DB_POOL_MAX_OVERFLOW) below MySQL's max_connections (151 by default). Every setting below can be overridden
+with its environment variable.
+"""
+
+import os
+import multiprocessing
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Load the app once in the master; workers fork with modules, the static
+# manifest and compiled code already in memory
+preload_app = True
+
+# gthread workers heartbeat between requests, so long exports do not trip this
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+# On SIGTERM workers stop accepting and get this long to finish in-flight requests
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then, staggered so they do not restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    server.log.info(f"Serving with {workers} workers x {threads} threads")
+
+
+def pre_fork(server, worker):
+    # Connections must not be shared with the children
+    from app import db_pool
+    db_pool.dispose()
+
+
+def post_fork(server, worker):
+    from app import db_pool
+    db_pool.reset_after_fork()
+
+
+def post_worker_init(worker):
+    # Runs before the worker's accept loop starts
+    from app import warm_up
+    warm_up()
+
+
+def worker_exit(server, worker):
+    from app import shut_down
+    shut_down()
@@ -1,95 +1,394 @@
 """
-Image upload service for handling file system storage
+Image upload service for handling image storage
 Provides endpoints for uploading, retrieving, and managing image files
+(on the local filesystem or an S3-compatible object store, see image_storage)
 """
 
 import os
+import io
+import re
+import time
 import uuid
+import base64
+import tempfile
+import hashlib
+import binascii
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
 from datetime import datetime
 from werkzeug.utils import secure_filename
-from PIL import Image
+from PIL import Image, features
+from image_storage import LocalStorage, storage_from_env
 import logging
 
+try:
+    import fcntl
+except ImportError:  # Windows: render coalescing is per process only
+    fcntl = None
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+IMAGE_URL_PREFIX = '/api/images/'
+
+# data:image/png;base64,....
+DATA_URL_PATTERN = re.compile(r'^data:image/(?P<subtype>[a-z0-9.+-]+);base64,(?P<data>.*)$', re.IGNORECASE | re.DOTALL)
+
+DATA_URL_EXTENSIONS = {
+    'png': 'png',
+    'jpeg': 'jpg',
+    'jpg': 'jpg',
+    'pjpeg': 'jpg',
+    'gif': 'gif',
+    'webp': 'webp'
+}
+
+# Pillow format names for the variant file extensions (used for atomic saves)
+SAVE_FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+    '.webp': 'WEBP'
+}
+
+HEX_DIGITS = set('0123456789abcdef')
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+UPLOAD_SPOOL_MEMORY = 1024 * 1024  # raw uploads above this spill to a temporary file
+
+# Leading bytes of the formats we accept; WebP is RIFF....WEBP
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif')
+)
+
+def sniff_image_type(header):
+    """Image type from the magic bytes at the start of a file, or None"""
+    for signature, image_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return image_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    return None
+
 class ImageUploadService:
-    def __init__(self, upload_folder='uploads/images', max_size_mb=5):
+    def __init__(self, upload_folder='uploads/images', max_size_mb=5, webp_variants=False, webp_quality=80,
+                 workers=0, max_pending=32, thumbnail_cache_mb=512, storage=None,
+                 redirect=False, redirect_expires=3600, max_pixels=40_000_000):
+        # upload_folder holds the files themselves with local storage, and
+        # only render locks when a remote backend is used
         self.upload_folder = upload_folder
+        self.storage = storage or LocalStorage(upload_folder)
+        
+        # Remote backends can hand clients presigned URLs instead of
+        # streaming image bytes through the web workers
+        self.redirect = redirect
+        self.redirect_expires = redirect_expires
+        self.max_size_mb = max_size_mb
         self.max_size_bytes = max_size_mb * 1024 * 1024
+        
+        # Decompression bomb guard: a small file can declare huge dimensions,
+        # so uploads are also limited by pixel count, read from the header
+        self.max_pixels = max_pixels
+        Image.MAX_IMAGE_PIXELS = max_pixels
         self.allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
         self.thumbnail_sizes = {
             'small': (150, 150),
             'medium': (300, 300),
             'large': (800, 800)
         }
+        # Extra square sizes (pixels) clients may request, e.g. /thumbnails/96/<file>
+        self.pixel_sizes = {48, 64, 96, 128, 192, 256, 384, 512}
+        
+        # Thumbnails are rendered on first request into thumbnails/, which is
+        # kept under thumbnail_cache_mb by evicting the least recently used
+        self.thumbnail_cache_bytes = thumbnail_cache_mb * 1024 * 1024
+        self._cache_size = None
+        self._render_locks = {}
+        self._evict_lock = threading.Lock()
+        
+        # Optional WebP copies of every variant, served to browsers that accept them
+        self.webp_variants = webp_variants and features.check('webp')
+        self.webp_quality = webp_quality
+        if webp_variants and not self.webp_variants:
+            logger.warning("Pillow was built without WebP support; WebP variants disabled")
+        
+        # Background processing: uploads are staged in incoming/ and finished
+        # by a process pool (workers=0 processes them inline instead)
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = None
+        self._executor_pid = None
+        self._pending = 0
+        self._lock = threading.Lock()
         
         # Create upload directory if it doesn't exist
-        os.makedirs(self.upload_folder, exist_ok=True)
-        os.makedirs(os.path.join(self.upload_folder, 'thumbnails'), exist_ok=True)
+        os.makedirs(os.path.join(self.upload_folder, 'locks'), exist_ok=True)
     
     def allowed_file(self, filename):
         """Check if file extension is allowed"""
         return '.' in filename and \
                filename.rsplit('.', 1)[1].lower() in self.allowed_extensions
     
-    def generate_filename(self, original_filename):
-        """Generate unique filename while preserving extension"""
+    def generate_filename(self, original_filename, digest=None):
+        """
+        Filename for stored content, preserving the extension. Named after
+        the content digest, so identical uploads map to one stored image.
+        """
         ext = original_filename.rsplit('.', 1)[1].lower()
-        unique_filename = f"{uuid.uuid4().hex}.{ext}"
-        return unique_filename
+        name = digest[:32] if digest else uuid.uuid4().hex
+        return f"{name}.{ext}"
     
-    def optimize_image(self, file_path, max_width=800, max_height=800, quality=85):
-        """Optimize image size and quality"""
+    def content_digest(self, stream):
+        """
+        SHA-256 and size of a seekable stream's bytes, read in chunks.
+        The stream is rewound afterwards.
+        Returns: (hex digest, size)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        for chunk in iter(partial(stream.read, UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+            size += len(chunk)
+        stream.seek(0)
+        return digest.hexdigest(), size
+    
+    def _too_large(self):
+        max_size_mb = self.max_size_bytes / (1024 * 1024)
+        return {'error': f'File too large. Maximum size is {max_size_mb}MB'}
+    
+    def check_header(self, stream):
+        """
+        Validate an upload without decoding its pixel data: the magic bytes
+        must be those of an allowed type (which need not match the extension,
+        as every upload is re-encoded) and the dimensions declared in the header
+        must stay within max_pixels. The stream is rewound afterwards.
+        Returns: error message, or None if the upload looks acceptable
+        """
         try:
-            with Image.open(file_path) as img:
-                # Convert RGBA to RGB if necessary (for JPEG)
-                if img.mode in ('RGBA', 'LA'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
+            image_type = sniff_image_type(stream.read(16))
+            stream.seek(0)
+            if image_type is None or image_type not in self.allowed_extensions:
+                return 'Invalid image data'
+            
+            with Image.open(stream) as img:
+                width, height = img.size
+        except Image.DecompressionBombError:
+            return 'Image dimensions too large'
+        except Exception:
+            return 'Invalid image data'
+        finally:
+            stream.seek(0)
+        
+        if width * height > self.max_pixels:
+            return 'Image dimensions too large'
+        return None
+    
+    def process_image(self, source, filename, max_width=800, max_height=800, quality=85):
+        """
+        Decode an upload once and write the optimized original (thumbnails
+        are rendered lazily from it, see get_thumbnail)
+        Returns: True on success, False on failure
+        """
+        try:
+            with Image.open(source) as img:
+                # Let the JPEG decoder drop resolution we would discard anyway
+                if img.format == 'JPEG':
+                    img.draft('RGB', (max_width, max_height))
+                img.load()
+                img = self._prepare_mode(img, filename)
                 
                 # Resize if necessary
                 if img.width > max_width or img.height > max_height:
-                    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-                
-                # Save optimized version
-                img.save(file_path, optimize=True, quality=quality)
+                    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
                 
+                self._save_variant(img, self.original_key(filename), quality)
                 return True
+                
         except Exception as e:
-            logger.error(f"Error optimizing image {file_path}: {e}")
+            logger.error(f"Error processing image {filename}: {e}")
             return False
     
-    def create_thumbnails(self, file_path, filename):
-        """Create thumbnail versions of the image"""
-        thumbnails = {}
+    def _prepare_mode(self, img, filename):
+        """Convert RGBA to RGB if necessary (for JPEG)"""
+        if img.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.split()[-1])
+            return background
+        if img.mode not in ('RGB', 'L') and os.path.splitext(filename)[1].lower() in ('.jpg', '.jpeg'):
+            return img.convert('RGB')
+        return img
+    
+    def thumbnail_box(self, size):
+        """Bounding box for a thumbnail size name or pixel size, None if not allowed"""
+        if size in self.thumbnail_sizes:
+            return self.thumbnail_sizes[size]
+        if isinstance(size, str) and size.isdigit() and int(size) in self.pixel_sizes:
+            return (int(size), int(size))
+        return None
+    
+    def get_thumbnail(self, filename, size, webp=False, quality=85):
+        """
+        Storage key of a thumbnail, rendering it on first request.
+        Concurrent requests for the same variant wait for a single render.
+        Returns: key, or None if the original is not available (yet)
+        """
+        key = self.image_key(filename, size)
+        if webp:
+            key = self.webp_variant_key(key)
+        
+        if self.storage.exists(key):
+            self.storage.touch(key)
+            return key
+        
+        with self._render_lock(key):
+            # Another request may have rendered it while we waited
+            if not self.storage.exists(key):
+                try:
+                    source = self.storage.open(self.image_key(filename))
+                except FileNotFoundError:
+                    return None
+                
+                with source, Image.open(source) as img:
+                    box = self.thumbnail_box(size)
+                    if img.format == 'JPEG':
+                        img.draft('RGB', box)
+                    img.load()
+                    img = self._prepare_mode(img, filename)
+                    img.thumbnail(box, Image.Resampling.LANCZOS, reducing_gap=3.0)
+                    
+                    if webp:
+                        size_bytes = self._save_image(img, key, quality=self.webp_quality, method=4)
+                    else:
+                        size_bytes = self._save_image(img, key, optimize=True, quality=quality)
+                
+                self._thumbnail_added(size_bytes)
+        
+        return key
+    
+    @contextmanager
+    def _render_lock(self, key):
+        """Serialize renders of one variant across threads and, where supported, processes"""
+        with self._lock:
+            entry = self._render_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
         
         try:
-            with Image.open(file_path) as img:
-                for size_name, (width, height) in self.thumbnail_sizes.items():
-                    # Create thumbnail
-                    thumbnail = img.copy()
-                    thumbnail.thumbnail((width, height), Image.Resampling.LANCZOS)
-                    
-                    # Generate thumbnail filename
-                    name, ext = os.path.splitext(filename)
-                    thumbnail_filename = f"{name}_{size_name}{ext}"
-                    thumbnail_path = os.path.join(self.upload_folder, 'thumbnails', thumbnail_filename)
-                    
-                    # Save thumbnail
-                    thumbnail.save(thumbnail_path, optimize=True, quality=85)
-                    thumbnails[size_name] = thumbnail_filename
-                    
+            with entry[0]:
+                if fcntl is None:
+                    yield
+                    return
+                
+                # Lock files stay local whatever the storage backend
+                lock_name = hashlib.sha1(key.encode('utf-8')).hexdigest()
+                lock_path = os.path.join(self.upload_folder, 'locks', f"{lock_name}.lock")
+                lock_file = self._open_locked(lock_path)
+                try:
+                    yield
+                finally:
+                    # Removed while still held: a process waiting on this file
+                    # finds it gone once it gets the lock, and starts over
+                    os.remove(lock_path)
+                    lock_file.close()
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._render_locks[key]
+    
+    @staticmethod
+    def _open_locked(lock_path):
+        """Open and flock lock_path, retrying until the locked file is the one still at that path"""
+        while True:
+            lock_file = open(lock_path, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            # The holder removed it after we opened it; another process may already lock its successor
+            lock_file.close()
+    
+    def _thumbnail_added(self, size_bytes):
+        with self._lock:
+            if self._cache_size is not None:
+                self._cache_size += size_bytes
+            over_budget = self._cache_size is None or self._cache_size > self.thumbnail_cache_bytes
+        
+        if over_budget:
+            self.evict_thumbnails()
+    
+    def evict_thumbnails(self, target_ratio=0.9):
+        """
+        Delete least recently used thumbnails until the cache is back under
+        target_ratio of its budget. Returns the number of files removed.
+        """
+        # One eviction pass per process at a time; others just skip
+        if not self._evict_lock.acquire(blocking=False):
+            return 0
+        
+        try:
+            entries = []
+            total = 0
+            for key, mtime, size_bytes in self.storage.list('thumbnails/'):
+                entries.append((mtime, size_bytes, key))
+                total += size_bytes
+            
+            removed = 0
+            if total > self.thumbnail_cache_bytes:
+                target = self.thumbnail_cache_bytes * target_ratio
+                entries.sort()
+                for _, size_bytes, key in entries:
+                    if total <= target:
+                        break
+                    self.storage.delete(key)
+                    total -= size_bytes
+                    removed += 1
+                logger.info(f"Evicted {removed} cached thumbnails")
+            
+            with self._lock:
+                self._cache_size = total
+            return removed
+            
         except Exception as e:
-            logger.error(f"Error creating thumbnails for {file_path}: {e}")
+            logger.error(f"Error evicting thumbnails: {e}")
+            return 0
+        finally:
+            self._evict_lock.release()
+    
+    def _save_variant(self, img, key, quality):
+        """Save one variant, plus its WebP copy when enabled"""
+        webp_key = self.webp_variant_key(key)
+        if self.webp_variants and webp_key != key:
+            self._save_image(img, webp_key, quality=self.webp_quality, method=4)
         
-        return thumbnails
+        self._save_image(img, key, optimize=True, quality=quality)
+    
+    def _save_image(self, img, key, **params):
+        """Encode in memory and store in one go, so readers never see a partial image"""
+        buffer = io.BytesIO()
+        img.save(buffer, SAVE_FORMATS[os.path.splitext(key)[1].lower()], **params)
+        size_bytes = buffer.tell()
+        buffer.seek(0)
+        self.storage.save(key, buffer)
+        return size_bytes
+    
+    def webp_variant_key(self, key):
+        """Key of the WebP copy stored next to a variant"""
+        return os.path.splitext(key)[0] + '.webp'
     
     def upload_image(self, file):
         """
-        Upload and process an image file
+        Upload an image file. The upload is stored durably first and then
+        processed in the background; file_info['status'] reports progress.
         Returns: dict with file info or error
         """
         try:
@@ -100,72 +399,353 @@ class ImageUploadService:
             if not self.allowed_file(file.filename):
                 return {'error': 'File type not allowed'}
             
-            # Check file size
-            file.seek(0, os.SEEK_END)
-            file_size = file.tell()
-            file.seek(0)
-            
+            # The request size limit already bounded what Werkzeug spooled;
+            # size and digest are taken in one chunked pass
+            digest, file_size = self.content_digest(file.stream)
             if file_size > self.max_size_bytes:
-                max_size_mb = self.max_size_bytes / (1024 * 1024)
-                return {'error': f'File too large. Maximum size is {max_size_mb}MB'}
+                return self._too_large()
             
-            # Generate secure filename
             original_filename = secure_filename(file.filename)
-            unique_filename = self.generate_filename(original_filename)
-            file_path = os.path.join(self.upload_folder, unique_filename)
+            return self._ingest(file.stream, original_filename, file_size, digest)
             
-            # Save original file
-            file.save(file_path)
+        except Exception as e:
+            logger.error(f"Error uploading image: {e}")
+            return {'error': 'Failed to upload image'}
+    
+    def upload_stream(self, stream, content_type, filename=None, content_length=None):
+        """
+        Upload a raw image request body (Content-Type: image/*) without the
+        multipart parser. The body is read in chunks into a spool file that
+        only spills to disk above UPLOAD_SPOOL_MEMORY, hashing as it goes,
+        and reading stops as soon as the size limit is exceeded.
+        Returns: dict with file info or error, like upload_image
+        """
+        if content_length is not None and content_length > self.max_size_bytes:
+            return self._too_large()
+        
+        subtype = content_type.split('/', 1)[-1].lower() if content_type else ''
+        if filename and self.allowed_file(filename):
+            original_filename = secure_filename(filename)
+        elif subtype in DATA_URL_EXTENSIONS:
+            original_filename = f"upload.{DATA_URL_EXTENSIONS[subtype]}"
+        else:
+            return {'error': 'File type not allowed'}
+        
+        try:
+            with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MEMORY) as spool:
+                digest = hashlib.sha256()
+                file_size = 0
+                for chunk in iter(partial(stream.read, UPLOAD_CHUNK_SIZE), b''):
+                    file_size += len(chunk)
+                    if file_size > self.max_size_bytes:
+                        return self._too_large()
+                    digest.update(chunk)
+                    spool.write(chunk)
+                
+                if file_size == 0:
+                    return {'error': 'No file provided'}
+                
+                spool.seek(0)
+                return self._ingest(spool, original_filename, file_size, digest.hexdigest())
             
-            # Optimize image
-            if not self.optimize_image(file_path):
-                os.remove(file_path)
+        except Exception as e:
+            logger.error(f"Error uploading image stream: {e}")
+            return {'error': 'Failed to upload image'}
+    
+    def _ingest(self, stream, original_filename, file_size, digest):
+        """Validate the header of a received upload, then store it under its content name"""
+        error = self.check_header(stream)
+        if error:
+            return {'error': error}
+        
+        unique_filename = self.generate_filename(original_filename, digest)
+        return self._store_upload(unique_filename, original_filename, file_size, stream)
+    
+    def _stage(self, filename, stream):
+        """Durably store the raw upload until it has been processed"""
+        self.storage.save(self.staging_key(filename), stream, sync=True)
+    
+    def _store_upload(self, unique_filename, original_filename, file_size, stream):
+        """Store new content, or reuse the stored image when the same content was uploaded before"""
+        status = self.image_status(unique_filename)
+        if status in ('ready', 'processing'):
+            self._claim(unique_filename)
+            logger.info(f"Reusing stored image for duplicate upload: {unique_filename}")
+            return self._describe(unique_filename, original_filename, file_size, deduplicated=True)
+        
+        if status == 'failed':
+            self.storage.delete(self._failed_marker_key(unique_filename))
+        
+        self._stage(unique_filename, stream)
+        return self._store_image(unique_filename, original_filename, file_size)
+    
+    def _store_image(self, unique_filename, original_filename, file_size):
+        """Process a staged upload (in the pool when possible) and describe it"""
+        if not self._submit(unique_filename):
+            if not self.finish_processing(unique_filename):
+                self.delete_image(unique_filename)
                 return {'error': 'Failed to process image'}
-            
-            # Create thumbnails
-            thumbnails = self.create_thumbnails(file_path, unique_filename)
-            
-            # Get file info
-            file_info = {
-                'filename': unique_filename,
-                'original_filename': original_filename,
-                'file_size': os.path.getsize(file_path),
-                'upload_date': datetime.now().isoformat(),
-                'thumbnails': thumbnails,
-                'url': f'/api/images/{unique_filename}'
-            }
-            
-            logger.info(f"Successfully uploaded image: {unique_filename}")
-            return {'success': True, 'file_info': file_info}
+        
+        logger.info(f"Successfully uploaded image: {unique_filename}")
+        return self._describe(unique_filename, original_filename, file_size)
+    
+    def _describe(self, unique_filename, original_filename, file_size, deduplicated=False):
+        # Get file info
+        file_info = {
+            'filename': unique_filename,
+            'original_filename': original_filename,
+            'file_size': file_size,
+            'upload_date': datetime.now().isoformat(),
+            'status': self.image_status(unique_filename),
+            'status_url': f"{self.image_url(unique_filename)}/status",
+            'url': self.image_url(unique_filename),
+            'thumbnail_urls': {
+                size_name: self.image_url(unique_filename, size_name)
+                for size_name in self.thumbnail_sizes
+            },
+            'deduplicated': deduplicated
+        }
+        
+        return {'success': True, 'file_info': file_info}
+    
+    def staging_key(self, filename):
+        """Key of the raw upload while it waits to be processed"""
+        return f"incoming/{filename}"
+    
+    def _failed_marker_key(self, filename):
+        return f"incoming/{filename}.failed"
+    
+    def _claim_key(self, filename):
+        return f"incoming/{filename}.claim"
+    
+    def _claim(self, filename):
+        """
+        Record that the content was uploaded again. The new upload may not be
+        referenced from the database yet, so a recent claim keeps the shared
+        image from being deleted (the orphan sweep drops stale claims).
+        """
+        self.storage.save(self._claim_key(filename), io.BytesIO(datetime.now().isoformat().encode('utf-8')))
+    
+    def recently_claimed(self, filename, max_age=24 * 3600):
+        """True if a duplicate upload of this image happened within max_age seconds"""
+        try:
+            _, mtime = self.storage.stat(self._claim_key(filename))
+        except FileNotFoundError:
+            return False
+        return mtime >= time.time() - max_age
+    
+    def _mark_failed(self, filename):
+        marker = io.BytesIO(datetime.now().isoformat().encode('utf-8'))
+        self.storage.save(self._failed_marker_key(filename), marker)
+        self.storage.delete(self.staging_key(filename))
+    
+    def finish_processing(self, filename):
+        """Turn a staged upload into the optimized original"""
+        staging_key = self.staging_key(filename)
+        
+        try:
+            source = self.storage.open(staging_key)
+        except FileNotFoundError:
+            # A concurrent upload of the same content finished it first
+            return self.storage.exists(self.image_key(filename))
+        
+        with source:
+            processed = self.process_image(source, filename)
+        
+        if not processed:
+            self._mark_failed(filename)
+            return False
+        
+        self.storage.delete(staging_key)
+        return True
+    
+    def image_status(self, filename):
+        """
+        Processing state of an upload: 'processing', 'ready' or 'failed'
+        (None if unknown). Read from storage so any web worker can answer it.
+        """
+        if self.storage.exists(self._failed_marker_key(filename)):
+            return 'failed'
+        if self.storage.exists(self.staging_key(filename)):
+            return 'processing'
+        if self.storage.exists(self.image_key(filename)):
+            return 'ready'
+        return None
+    
+    def _get_executor(self):
+        # Pools do not survive fork; each (gunicorn) worker process gets its own
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            self._executor_pid = os.getpid()
+        return self._executor
+    
+    def _worker_settings(self):
+        return {
+            'upload_folder': os.path.abspath(self.upload_folder),
+            'storage': self.storage,
+            'max_size_mb': self.max_size_mb,
+            'max_pixels': self.max_pixels,
+            'webp_variants': self.webp_variants,
+            'webp_quality': self.webp_quality
+        }
+    
+    def _submit(self, filename):
+        """
+        Queue a staged upload for the process pool. Returns False when it
+        has to be processed inline: no pool configured, or the queue is full
+        (which throttles uploaders instead of growing the backlog).
+        """
+        if self.workers <= 0:
+            return False
+        
+        with self._lock:
+            if self._pending >= self.max_pending:
+                return False
+            self._pending += 1
+        
+        try:
+            future = self._get_executor().submit(_process_in_worker, self._worker_settings(), filename)
+        except Exception as e:
+            # A broken pool (crashed worker) is rebuilt on the next upload
+            logger.error(f"Error queueing image {filename}, processing inline: {e}")
+            self._executor = None
+            with self._lock:
+                self._pending -= 1
+            return False
+        
+        future.add_done_callback(partial(self._job_done, filename))
+        return True
+    
+    def _job_done(self, filename, future):
+        with self._lock:
+            self._pending -= 1
+        
+        error = future.exception()
+        if error is not None:
+            # The worker died before it could record the outcome itself
+            logger.error(f"Error processing image {filename} in worker: {error}")
+            self._mark_failed(filename)
+        elif not future.result():
+            logger.error(f"Failed to process image {filename}")
+    
+    def shutdown(self, wait=True):
+        """Stop the process pool, finishing queued uploads when wait is True"""
+        if self._executor is not None and self._executor_pid == os.getpid():
+            self._executor.shutdown(wait=wait)
+        self._executor = None
+    
+    def is_data_url(self, value):
+        """Check if a value is an inline base64 image (data URL)"""
+        return isinstance(value, str) and value[:11].lower() == 'data:image/'
+    
+    def save_data_url(self, data_url):
+        """
+        Decode a base64 data URL into image storage
+        Returns: dict with file info or error, like upload_image
+        """
+        match = DATA_URL_PATTERN.match(data_url or '')
+        if not match:
+            return {'error': 'Invalid image data'}
+        
+        ext = DATA_URL_EXTENSIONS.get(match.group('subtype').lower())
+        if not ext:
+            return {'error': 'File type not allowed'}
+        
+        # Base64 is 4 characters per 3 bytes; refuse oversized payloads before decoding
+        if len(match.group('data')) * 3 // 4 > self.max_size_bytes + 3:
+            return self._too_large()
+        
+        try:
+            content = base64.b64decode(match.group('data'), validate=False)
+        except (binascii.Error, ValueError):
+            return {'error': 'Invalid image data'}
+        
+        if len(content) > self.max_size_bytes:
+            return self._too_large()
+        
+        try:
+            return self._ingest(io.BytesIO(content), f"photo.{ext}", len(content), hashlib.sha256(content).hexdigest())
             
         except Exception as e:
-            logger.error(f"Error uploading image: {e}")
+            logger.error(f"Error storing data URL image: {e}")
             return {'error': 'Failed to upload image'}
     
-    def get_image_path(self, filename, thumbnail_size=None):
-        """Get the full path to an image file"""
-        if thumbnail_size and thumbnail_size in self.thumbnail_sizes:
-            name, ext = os.path.splitext(filename)
-            thumbnail_filename = f"{name}_{thumbnail_size}{ext}"
-            return os.path.join(self.upload_folder, 'thumbnails', thumbnail_filename)
-        else:
-            return os.path.join(self.upload_folder, filename)
+    def image_url(self, filename, thumbnail_size=None):
+        """Public URL of a stored image or one of its thumbnails"""
+        if thumbnail_size and self.thumbnail_box(str(thumbnail_size)):
+            return f"{IMAGE_URL_PREFIX}thumbnails/{thumbnail_size}/{filename}"
+        return f"{IMAGE_URL_PREFIX}{filename}"
+    
+    def filename_from_url(self, url):
+        """Stored filename referenced by an image URL, or None for other values"""
+        if not isinstance(url, str) or not url.startswith(IMAGE_URL_PREFIX):
+            return None
+        filename = url[len(IMAGE_URL_PREFIX):]
+        if '/' in filename or not self.allowed_file(filename):
+            return None
+        return filename
+    
+    def thumbnail_url(self, photo, thumbnail_size='small'):
+        """
+        URL to ship for a stored photo reference in list responses.
+        Values that are not image service references (external URLs, photos
+        not migrated yet) are returned unchanged.
+        """
+        filename = self.filename_from_url(photo)
+        if filename is None:
+            return photo
+        return self.image_url(filename, thumbnail_size)
+    
+    def redirect_url(self, key, cache_control=None):
+        """Presigned URL to send clients to instead of streaming key, or None"""
+        if not self.redirect:
+            return None
+        return self.storage.url(key, expires=self.redirect_expires, cache_control=cache_control)
+    
+    def _shard(self, filename):
+        """Two directory levels from a hash of the name, e.g. ('3f', 'a0')"""
+        digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+        return digest[:2], digest[2:4]
+    
+    def original_key(self, filename):
+        """Sharded key of a stored original: 3f/a0/<filename>"""
+        return '/'.join((*self._shard(filename), filename))
+    
+    def _thumbnail_prefix(self, filename):
+        """All thumbnails of one image live together: thumbnails/3f/a0/<name>/"""
+        name = os.path.splitext(filename)[0]
+        return '/'.join(('thumbnails', *self._shard(filename), name)) + '/'
+    
+    def image_key(self, filename, thumbnail_size=None):
+        """Get the storage key of an image file"""
+        if thumbnail_size and self.thumbnail_box(thumbnail_size):
+            ext = os.path.splitext(filename)[1]
+            return f"{self._thumbnail_prefix(filename)}{thumbnail_size}{ext}"
+        
+        key = self.original_key(filename)
+        if not self.storage.exists(key) and self.storage.exists(filename):
+            # Not moved by migrate_layout() yet
+            return filename
+        return key
     
     def delete_image(self, filename):
         """Delete an image and all its thumbnails"""
         try:
-            # Delete main image
-            main_path = os.path.join(self.upload_folder, filename)
-            if os.path.exists(main_path):
-                os.remove(main_path)
-            
-            # Delete thumbnails
-            name, ext = os.path.splitext(filename)
-            for size_name in self.thumbnail_sizes:
-                thumbnail_filename = f"{name}_{size_name}{ext}"
-                thumbnail_path = os.path.join(self.upload_folder, 'thumbnails', thumbnail_filename)
-                if os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
+            original = self.image_key(filename)
+            keys = (
+                original,
+                self.webp_variant_key(original),
+                self.staging_key(filename),
+                self._failed_marker_key(filename),
+                self._claim_key(filename)
+            )
+            for key in keys:
+                self.storage.delete(key)
+            
+            self.storage.delete_prefix(self._thumbnail_prefix(filename))
             
             logger.info(f"Successfully deleted image: {filename}")
             return True
@@ -174,30 +754,153 @@ class ImageUploadService:
             logger.error(f"Error deleting image {filename}: {e}")
             return False
     
-    def cleanup_orphaned_files(self, used_filenames):
-        """Clean up files that are no longer referenced in the database"""
-        try:
-            # Get all files in upload directory
-            all_files = set()
-            for filename in os.listdir(self.upload_folder):
-                if os.path.isfile(os.path.join(self.upload_folder, filename)):
-                    all_files.add(filename)
+    def _is_webp_copy(self, filename, siblings):
+        """WebP copies share the stem of their original"""
+        name, ext = os.path.splitext(filename)
+        if ext.lower() != '.webp':
+            return False
+        return any(f"{name}.{other}" in siblings for other in self.allowed_extensions if other != 'webp')
+    
+    def _originals_in(self, files):
+        """(filename, mtime, size) of the originals among one directory's {name: (mtime, size)}"""
+        for name, (mtime, size_bytes) in files.items():
+            if self.allowed_file(name) and not self._is_webp_copy(name, files):
+                yield name, mtime, size_bytes
+    
+    def _iter_originals(self):
+        """
+        Stream (filename, mtime, size) for every stored original, one shard
+        directory at a time, including files still in the legacy flat layout
+        """
+        for first in range(256):
+            directory, files = None, {}
+            for key, mtime, size_bytes in self.storage.list(f"{first:02x}/"):
+                parts = key.split('/')
+                if len(parts) != 3 or not set(parts[1]) <= HEX_DIGITS:
+                    continue
+                if parts[1] != directory:
+                    yield from self._originals_in(files)
+                    directory, files = parts[1], {}
+                files[parts[2]] = (mtime, size_bytes)
+            yield from self._originals_in(files)
+        
+        legacy = {key: (mtime, size_bytes) for key, mtime, size_bytes in self.storage.list('', recursive=False)}
+        yield from self._originals_in(legacy)
+    
+    def sweep_orphans(self, find_referenced, batch_size=500, dry_run=False, min_age=24 * 3600, io_workers=4):
+        """
+        Delete stored images nothing references any more.
+        Files are streamed from disk in batches and find_referenced(filenames)
+        must return the subset still in use (checked against the database in
+        chunks by the caller). Files younger than min_age seconds, or uploaded
+        again within that time, are kept, as their reference may not have been
+        saved yet. Deletes run on at most
+        io_workers threads, one batch at a time.
+        Returns: report dict
+        """
+        report = {
+            'dry_run': dry_run,
+            'scanned': 0,
+            'orphaned': 0,
+            'deleted': 0,
+            'bytes': 0,
+            'stale_uploads': 0,
+            'orphans': []  # first 100, for the dry-run report
+        }
+        cutoff = time.time() - min_age
+        
+        def process(batch):
+            report['scanned'] += len(batch)
+            candidates = {name: size for name, mtime, size in batch if mtime < cutoff}
+            if not candidates:
+                return
             
-            # Find orphaned files
-            orphaned_files = all_files - set(used_filenames)
+            referenced = set(find_referenced(list(candidates)))
+            orphans = [
+                name for name in candidates
+                if name not in referenced and not self.recently_claimed(name, min_age)
+            ]
+            report['orphaned'] += len(orphans)
+            report['bytes'] += sum(candidates[name] for name in orphans)
+            report['orphans'].extend(orphans[:100 - len(report['orphans'])])
             
-            # Delete orphaned files
-            deleted_count = 0
-            for filename in orphaned_files:
-                if self.delete_image(filename):
-                    deleted_count += 1
+            if orphans and not dry_run:
+                report['deleted'] += sum(pool.map(self.delete_image, orphans))
+        
+        with ThreadPoolExecutor(max_workers=io_workers) as pool:
+            batch = []
+            for item in self._iter_originals():
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    process(batch)
+                    batch = []
+            if batch:
+                process(batch)
+        
+        # Uploads that never finished processing, and failure markers
+        for key, mtime, _ in self.storage.list('incoming/'):
+            if mtime < cutoff:
+                report['stale_uploads'] += 1
+                if not dry_run:
+                    self.storage.delete(key)
+        
+        logger.info(
+            f"Orphan sweep{' (dry run)' if dry_run else ''}: scanned {report['scanned']}, "
+            f"orphaned {report['orphaned']}, deleted {report['deleted']}"
+        )
+        return report
+    
+    def cleanup_orphaned_files(self, used_filenames):
+        """Clean up files that are no longer referenced in the database"""
+        used_filenames = set(used_filenames)
+        report = self.sweep_orphans(lambda names: used_filenames.intersection(names), min_age=0)
+        return report['deleted']
+    
+    def migrate_layout(self, dry_run=False):
+        """
+        Move originals from the legacy flat layout into shard directories.
+        Flat thumbnails are dropped; they are re-rendered on demand.
+        Returns: (originals moved, thumbnails removed)
+        """
+        names = {key for key, _, _ in self.storage.list('', recursive=False) if self.allowed_file(key)}
+        
+        moved = 0
+        for name in names:
+            if self._is_webp_copy(name, names):
+                continue
             
-            logger.info(f"Cleaned up {deleted_count} orphaned image files")
-            return deleted_count
+            # WebP copies move along with their original
+            target = self.original_key(name)
+            moves = [(name, target)]
+            webp_name = os.path.splitext(name)[0] + '.webp'
+            if webp_name != name and webp_name in names:
+                moves.append((webp_name, self.webp_variant_key(target)))
             
-        except Exception as e:
-            logger.error(f"Error during cleanup: {e}")
-            return 0
+            moved += 1
+            if not dry_run:
+                for source, target_key in moves:
+                    self.storage.move(source, target_key)
+        
+        removed = 0
+        for key, _, _ in self.storage.list('thumbnails/', recursive=False):
+            removed += 1
+            if not dry_run:
+                self.storage.delete(key)
+        
+        return moved, removed
+
+def _process_in_worker(settings, filename):
+    """Process pool entry point: finish a staged upload in a worker process"""
+    return ImageUploadService(**settings).finish_processing(filename)
 
 # Global instance
-image_service = ImageUploadService()
+image_service = ImageUploadService(
+    webp_variants=os.environ.get('IMAGE_WEBP_VARIANTS', 'false').lower() in ('1', 'true', 'yes'),
+    workers=int(os.environ.get('IMAGE_WORKERS', 2)),
+    max_pending=int(os.environ.get('IMAGE_MAX_PENDING', 32)),
+    thumbnail_cache_mb=int(os.environ.get('THUMBNAIL_CACHE_MB', 512)),
+    storage=storage_from_env('uploads/images'),
+    redirect=os.environ.get('IMAGE_REDIRECT', 'true').lower() in ('1', 'true', 'yes'),
+    redirect_expires=int(os.environ.get('IMAGE_REDIRECT_EXPIRES', 3600)),
+    max_pixels=int(os.environ.get('IMAGE_MAX_PIXELS', 40_000_000))
+)
@@ -0,0 +1,346 @@
+"""
+Storage backends for the image service
+Images are addressed by keys such as '3f/a0/<filename>'; a backend maps them
+to a local directory or to an S3-compatible bucket (AWS S3, MinIO, ...)
+"""
+
+import io
+import os
+import abc
+import time
+import shutil
+import mimetypes
+import threading
+import logging
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config
+    from botocore.exceptions import ClientError
+except ImportError:  # only needed for IMAGE_STORAGE=s3
+    boto3 = None
+
+logger = logging.getLogger(__name__)
+
+
+class _FileSlice(io.RawIOBase):
+    """Reads length bytes of an open file from its current position; closing it closes the file"""
+
+    def __init__(self, file, length):
+        self._file = file
+        self._remaining = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self._remaining)
+        if size <= 0:
+            return 0
+        count = self._file.readinto(memoryview(buffer)[:size])
+        self._remaining -= count
+        return count
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+class StorageBackend(abc.ABC):
+    """
+    Interface shared by the backends. Keys use '/' as separator.
+    Missing keys raise FileNotFoundError from open() and stat().
+    """
+
+    @abc.abstractmethod
+    def open(self, key, byte_range=None):
+        """
+        Readable binary stream of the object's content, read sequentially
+        (it need not be seekable). With byte_range=(start, stop) only those
+        bytes are returned, so a Range request fetches no more than it sends.
+        """
+
+    @abc.abstractmethod
+    def save(self, key, stream, sync=False):
+        """Store a stream under key, replacing any previous object atomically"""
+
+    @abc.abstractmethod
+    def stat(self, key):
+        """(size, mtime) of a stored object"""
+
+    def exists(self, key):
+        try:
+            self.stat(key)
+            return True
+        except FileNotFoundError:
+            return False
+
+    @abc.abstractmethod
+    def delete(self, key):
+        """Delete an object; deleting a missing key is not an error"""
+
+    def delete_prefix(self, prefix):
+        """Delete every object whose key starts with prefix"""
+        for key, _, _ in self.list(prefix):
+            self.delete(key)
+
+    @abc.abstractmethod
+    def move(self, source, target):
+        """Rename an object, replacing target"""
+
+    @abc.abstractmethod
+    def list(self, prefix='', recursive=True):
+        """
+        Stream (key, mtime, size) for objects under prefix, objects of one
+        directory together. With recursive=False only the objects directly
+        under prefix are listed.
+        """
+
+    def touch(self, key, interval=3600):
+        """Record an access for LRU eviction where the backend can (at most once per interval)"""
+
+    def local_path(self, key):
+        """Filesystem path of an object, or None if it is not stored locally"""
+        return None
+
+    def url(self, key, expires=3600, cache_control=None):
+        """Time-limited URL clients can fetch the object from directly, or None"""
+        return None
+
+
+class LocalStorage(StorageBackend):
+    """Objects are files below root"""
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def open(self, key, byte_range=None):
+        f = open(self._path(key), 'rb')
+        if byte_range is None:
+            return f
+        start, stop = byte_range
+        f.seek(start)
+        return _FileSlice(f, stop - start)
+
+    def save(self, key, stream, sync=False):
+        # Write to a temporary file and rename, so readers never see a partial file
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                shutil.copyfileobj(stream, f)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def stat(self, key):
+        stat = os.stat(self._path(key))
+        return stat.st_size, stat.st_mtime
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix):
+        path = self._path(prefix.rstrip('/'))
+        if prefix.endswith('/'):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            super().delete_prefix(prefix)
+
+    def move(self, source, target):
+        target_path = self._path(target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        os.replace(self._path(source), target_path)
+
+    def list(self, prefix='', recursive=True):
+        # Walk from the deepest directory the prefix names, filter the rest
+        directory, _, name_prefix = prefix.rpartition('/')
+        base = self._path(directory) if directory else self.root
+        if not os.path.isdir(base):
+            return
+
+        for current, dirs, files in os.walk(base):
+            dirs.sort()
+            relative = os.path.relpath(current, self.root)
+            key_dir = '' if relative == '.' else relative.replace(os.sep, '/') + '/'
+            if current == base and name_prefix:
+                dirs[:] = [d for d in dirs if d.startswith(name_prefix)]
+            if not recursive:
+                dirs[:] = []
+
+            for name in sorted(files):
+                if name.endswith(('.tmp', '.lock')):
+                    continue
+                key = key_dir + name
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(current, name))
+                except FileNotFoundError:
+                    continue
+                yield key, stat.st_mtime, stat.st_size
+
+    def touch(self, key, interval=3600):
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) < time.time() - interval:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def local_path(self, key):
+        return self._path(key)
+
+
+class S3Storage(StorageBackend):
+    """
+    Objects in an S3-compatible bucket. Uploads are streamed, switching to
+    multipart transfers above multipart_threshold_mb, open() returns the
+    object's body as it arrives (a range of it when asked), and url()
+    returns presigned GET URLs so image bytes need not pass through the app.
+    """
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None,
+                 multipart_threshold_mb=8, multipart_chunk_mb=8, max_concurrency=4):
+        if boto3 is None:
+            raise RuntimeError("boto3 is required for S3 image storage (pip install boto3)")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.endpoint_url = endpoint_url
+        self.region = region
+        self.multipart_threshold_mb = multipart_threshold_mb
+        self.multipart_chunk_mb = multipart_chunk_mb
+        self.max_concurrency = max_concurrency
+        self._client = None
+
+    def __getstate__(self):
+        # Clients cannot be pickled; process pool workers create their own
+        state = self.__dict__.copy()
+        state['_client'] = None
+        return state
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Custom endpoints (MinIO and friends) usually need path-style addressing
+            config = Config(s3={'addressing_style': 'path'}) if self.endpoint_url else None
+            self._client = boto3.client('s3', endpoint_url=self.endpoint_url, region_name=self.region, config=config)
+        return self._client
+
+    @property
+    def _transfer_config(self):
+        return TransferConfig(
+            multipart_threshold=self.multipart_threshold_mb * 1024 * 1024,
+            multipart_chunksize=self.multipart_chunk_mb * 1024 * 1024,
+            max_concurrency=self.max_concurrency
+        )
+
+    def _object_key(self, key):
+        return self.prefix + key
+
+    def _not_found(self, error):
+        return error.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound')
+
+    def open(self, key, byte_range=None):
+        # The response body itself: bytes are read from the connection as the caller consumes them
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if byte_range is not None:
+            # HTTP ranges are inclusive
+            params['Range'] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+        try:
+            return self.client.get_object(**params)['Body']
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+
+    def save(self, key, stream, sync=False):
+        # Objects only become visible once the (multipart) upload completes
+        content_type = mimetypes.guess_type(key)[0] or 'application/octet-stream'
+        self.client.upload_fileobj(
+            stream, self.bucket, self._object_key(key),
+            ExtraArgs={'ContentType': content_type},
+            Config=self._transfer_config
+        )
+
+    def stat(self, key):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._object_key(key))
+        except ClientError as e:
+            if self._not_found(e):
+                raise FileNotFoundError(key) from e
+            raise
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._object_key(key))
+
+    def delete_prefix(self, prefix):
+        batch = []
+        for key, _, _ in self.list(prefix):
+            batch.append({'Key': self._object_key(key)})
+            if len(batch) == 1000:  # DeleteObjects limit
+                self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True})
+                batch = []
+        if batch:
+            self.client.delete_objects(Bucket=self.bucket, Delete={'Objects': batch, 'Quiet': True})
+
+    def move(self, source, target):
+        # Managed copy, multipart for large objects
+        self.client.copy(
+            {'Bucket': self.bucket, 'Key': self._object_key(source)},
+            self.bucket, self._object_key(target),
+            Config=self._transfer_config
+        )
+        self.delete(source)
+
+    def list(self, prefix='', recursive=True):
+        params = {'Bucket': self.bucket, 'Prefix': self._object_key(prefix)}
+        if not recursive:
+            params['Delimiter'] = '/'
+
+        for page in self.client.get_paginator('list_objects_v2').paginate(**params):
+            for item in page.get('Contents', ()):
+                yield item['Key'][len(self.prefix):], item['LastModified'].timestamp(), item['Size']
+
+    def url(self, key, expires=3600, cache_control=None):
+        params = {'Bucket': self.bucket, 'Key': self._object_key(key)}
+        if cache_control:
+            params['ResponseCacheControl'] = cache_control
+        return self.client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires)
+
+
+def storage_from_env(upload_folder):
+    """
+    Backend selected by IMAGE_STORAGE: 'local' (default, files below
+    upload_folder) or 's3' (IMAGE_S3_BUCKET, IMAGE_S3_PREFIX,
+    IMAGE_S3_ENDPOINT for MinIO-style servers, IMAGE_S3_REGION; credentials
+    come from the usual AWS environment variables or config files)
+    """
+    kind = os.environ.get('IMAGE_STORAGE', 'local').lower()
+    if kind == 'local':
+        return LocalStorage(upload_folder)
+    if kind == 's3':
+        return S3Storage(
+            bucket=os.environ['IMAGE_S3_BUCKET'],
+            prefix=os.environ.get('IMAGE_S3_PREFIX', ''),
+            endpoint_url=os.environ.get('IMAGE_S3_ENDPOINT') or None,
+            region=os.environ.get('IMAGE_S3_REGION') or None,
+            multipart_threshold_mb=int(os.environ.get('IMAGE_S3_MULTIPART_MB', 8))
+        )
+    raise ValueError(f"Unknown IMAGE_STORAGE backend: {kind}")
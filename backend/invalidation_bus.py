@@ -0,0 +1,242 @@
+"""
+Cross-worker cache invalidation
+A write bumps the version of a cache namespace ('classes', 'counselors', ...)
+in a shared store and every worker learns about the new version, either
+through Redis pub/sub or by polling a MySQL table. Versions only grow, so a
+late or repeated message for a version a worker has already seen is ignored.
+"""
+
+import os
+import json
+import threading
+import time
+import logging
+from flask import has_request_context
+
+import db_session
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BUS=redis
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_TABLE = 'cache_versions'
+
+
+class InvalidationBus:
+    """
+    Process-local bus: versions are not shared, so this is only correct with a
+    single worker (and for development). The shared buses extend it.
+    subscribe(handler) registers handler(namespace, version), called for each
+    newer version, including the echo of this worker's own publishes.
+    """
+
+    def __init__(self):
+        self._handlers = []
+        self._versions = {}  # namespace -> highest version seen
+        self._local_versions = {}  # namespace -> last version published, for the process-local bus
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stats = {'published': 0, 'received': 0, 'ignored': 0, 'errors': 0}
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+
+    def publish(self, namespace):
+        """Announce a write to namespace. Returns the new version, or None if it could not be shared."""
+        try:
+            version = self._bump(namespace)
+            with self._lock:
+                self._stats['published'] += 1
+            # _versions is left to the echo of this bump (pub/sub or the next
+            # poll): a lower version from another worker may still be on its
+            # way, and the echo drops our own cache again after the bump, so a
+            # reload that raced the writer's first drop does not stick
+            self._announce(namespace, version)
+            return version
+        except Exception as e:
+            # Other workers catch up when their cache entries expire
+            logger.error(f"Error publishing invalidation for {namespace}: {e}")
+            with self._lock:
+                self._stats['errors'] += 1
+            return None
+
+    def _bump(self, namespace):
+        with self._lock:
+            version = self._local_versions.get(namespace, 0) + 1
+            self._local_versions[namespace] = version
+            return version
+
+    def _announce(self, namespace, version):
+        """Tell the other workers (push-based buses)"""
+
+    def _deliver(self, namespace, version):
+        with self._lock:
+            if version <= self._versions.get(namespace, 0):
+                self._stats['ignored'] += 1
+                return
+            self._versions[namespace] = version
+            self._stats['received'] += 1
+
+        for handler in self._handlers:
+            try:
+                handler(namespace, version)
+            except Exception as e:
+                logger.error(f"Error handling invalidation for {namespace}: {e}")
+
+    def ensure_started(self):
+        """Start listening in this process; threads do not survive a fork, so this runs per worker"""
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        self._start()
+
+    def _start(self):
+        pass
+
+    def _spawn(self, name, target):
+        threading.Thread(target=target, name=name, daemon=True).start()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['backend'] = type(self).__name__
+            stats['versions'] = dict(self._versions)
+        return stats
+
+
+class RedisInvalidationBus(InvalidationBus):
+    """
+    Versions live in a Redis hash and new ones are pushed over pub/sub.
+    After (re)connecting the listener re-reads the hash, so messages missed
+    while disconnected are not lost.
+    """
+
+    def __init__(self, url, channel='counselorhub:invalidate'):
+        super().__init__()
+        if redis is None:
+            raise RuntimeError("redis is required for CACHE_BUS=redis (pip install redis)")
+        self.url = url
+        self.channel = channel
+        self.versions_key = f"{channel}:versions"
+        self._client = redis.Redis.from_url(url)
+
+    def _bump(self, namespace):
+        return self._client.hincrby(self.versions_key, namespace, 1)
+
+    def _announce(self, namespace, version):
+        self._client.publish(self.channel, json.dumps({'namespace': namespace, 'version': version}))
+
+    def _resync(self, client):
+        for namespace, version in client.hgetall(self.versions_key).items():
+            self._deliver(namespace.decode('utf-8'), int(version))
+
+    def _start(self):
+        self._spawn('invalidation-bus', self._listen)
+
+    def _listen(self):
+        delay = 1.0
+        while True:
+            try:
+                client = redis.Redis.from_url(self.url)
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._resync(client)
+                delay = 1.0
+                for message in pubsub.listen():
+                    payload = json.loads(message['data'])
+                    self._deliver(payload['namespace'], int(payload['version']))
+            except Exception as e:
+                logger.error(f"Invalidation bus listener error, reconnecting in {delay:.0f}s: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+                time.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+
+class MySQLInvalidationBus(InvalidationBus):
+    """
+    Versions live in the cache_versions table (see migrations.py) and each
+    worker polls it every poll_interval seconds. Needs no extra service;
+    other workers see a write within one interval.
+    """
+
+    def __init__(self, pool, poll_interval=1.0):
+        super().__init__()
+        self.pool = pool
+        self.poll_interval = poll_interval
+
+    def _bump(self, namespace):
+        # Writers publish after their commit, on the connection their request
+        # already holds: a thread never checks out a second one for the bump
+        if has_request_context():
+            return self._bump_on(db_session.get_db(self.pool), namespace)
+        connection = self.pool.acquire()
+        try:
+            return self._bump_on(connection, namespace)
+        finally:
+            connection.close()
+
+    def _bump_on(self, connection, namespace):
+        cursor = connection.cursor()
+        try:
+            cursor.execute(
+                f"INSERT INTO `{VERSIONS_TABLE}` (namespace, version) VALUES (%s, 1) "
+                "ON DUPLICATE KEY UPDATE version = version + 1",
+                (namespace,)
+            )
+            # The row stays locked until commit, so this reads our own bump
+            cursor.execute(f"SELECT version FROM `{VERSIONS_TABLE}` WHERE namespace = %s", (namespace,))
+            version = cursor.fetchone()[0]
+            connection.commit()
+            return version
+        finally:
+            cursor.close()
+
+    def poll(self):
+        """Read all versions once and deliver the new ones"""
+        connection = self.pool.acquire()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f"SELECT namespace, version FROM `{VERSIONS_TABLE}`")
+            rows = cursor.fetchall()
+            # End the snapshot so the next poll sees new commits
+            connection.commit()
+        finally:
+            connection.close()
+
+        for namespace, version in rows:
+            self._deliver(namespace, int(version))
+
+    def _start(self):
+        self._spawn('invalidation-poller', self._poll_forever)
+
+    def _poll_forever(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Error polling cache versions: {e}")
+                with self._lock:
+                    self._stats['errors'] += 1
+            time.sleep(self.poll_interval)
+
+
+def bus_from_env(pool):
+    """
+    Bus selected by CACHE_BUS: 'local' (default, single worker), 'redis'
+    (CACHE_BUS_REDIS_URL) or 'mysql' (CACHE_BUS_POLL_INTERVAL seconds)
+    """
+    kind = os.environ.get('CACHE_BUS', 'local').lower()
+    if kind == 'local':
+        return InvalidationBus()
+    if kind == 'redis':
+        return RedisInvalidationBus(os.environ.get('CACHE_BUS_REDIS_URL', 'redis://localhost:6379/0'))
+    if kind == 'mysql':
+        return MySQLInvalidationBus(pool, poll_interval=float(os.environ.get('CACHE_BUS_POLL_INTERVAL', 1.0)))
+    raise ValueError(f"Unknown CACHE_BUS backend: {kind}")
@@ -0,0 +1,86 @@
+"""
+Fast JSON serialization for responses
+OrjsonProvider plugs orjson into Flask when it is installed and writes the
+same documents as Flask's default provider: sorted keys, dates as HTTP
+dates, Decimal and UUID as strings. Values orjson refuses (integers wider
+than 64 bits, for one) fall back to the standard library encoder.
+"""
+
+import json
+import uuid
+import decimal
+import dataclasses
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # the stdlib provider is used instead
+    orjson = None
+
+
+def _flask_default(value):
+    """Same conversions as Flask's default provider"""
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    if dataclasses.is_dataclass(value):
+        return dataclasses.asdict(value)
+    if hasattr(value, '__html__'):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (output is UTF-8 rather than ASCII-escaped)"""
+
+    def _options(self, indent=False):
+        # Dates go through _flask_default so they keep Flask's format
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def _dump_bytes(self, obj, indent=False):
+        try:
+            return orjson.dumps(obj, default=_flask_default, option=self._options(indent))
+        except orjson.JSONEncodeError:
+            kwargs = {'indent': 2} if indent else {'separators': (',', ':')}
+            return super().dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        # Callers passing json.dumps options get the stdlib encoder
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return self._dump_bytes(obj).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = self.compact is False or (self.compact is None and self._app.debug)
+        return self._app.response_class(self._dump_bytes(obj, indent) + b'\n', mimetype=self.mimetype)
+
+
+def provider_for(app):
+    """JSON provider for app: OrjsonProvider when orjson is installed, else Flask's default"""
+    if orjson is None:
+        return DefaultJSONProvider(app)
+    return OrjsonProvider(app)
+
+
+def dumps(obj):
+    """Compact JSON text outside a Flask response; values JSON has no type for become str()"""
+    if orjson is None:
+        return json.dumps(obj, default=str, separators=(',', ':'))
+    try:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME).decode('utf-8')
+    except orjson.JSONEncodeError:
+        return json.dumps(obj, default=str, separators=(',', ':'))
@@ -0,0 +1,79 @@
+"""
+Structured description of list endpoint queries
+Keeps the SELECT list, joins and filters apart so derived queries (COUNT,
+keyset pages) can be generated without string-replacing the full SQL
+"""
+
+import re
+
+
+class ListQuery:
+    """
+    SELECT/FROM/JOIN/WHERE parts of a list query.
+    Joins are registered under their alias. Every join used by the list
+    endpoints is to-one (a row-preserving LEFT JOIN or an inner join on a
+    NOT NULL foreign key), so a join no filter refers to can be left out of
+    the COUNT(*) without changing the result, and a join nothing refers to
+    at all can be left out of a projected query.
+    """
+
+    def __init__(self, select, from_clause):
+        self.select = select
+        self.from_clause = from_clause
+        self.joins = []  # (alias, clause, depends_on)
+        self.conditions = []
+        self.params = []
+        self.referenced = None  # set by prune_joins()
+
+    def join(self, alias, clause, depends_on=()):
+        self.joins.append((alias, clause, tuple(depends_on)))
+        return self
+
+    def where(self, condition, *params):
+        self.conditions.append(condition)
+        self.params.extend(params)
+        return self
+
+    def prune_joins(self, *also_referenced):
+        """
+        Leave joins out of sql() unless the SELECT list, the filters or
+        also_referenced (the ORDER BY keys) refer to them; used once the
+        SELECT list is narrowed to a field projection
+        """
+        self.referenced = also_referenced
+        return self
+
+    def _where_sql(self):
+        return ' AND '.join(self.conditions) if self.conditions else '1=1'
+
+    def _referenced_aliases(self, *sql_parts):
+        text = ' '.join(sql_parts)
+        return {alias for alias, _, _ in self.joins if re.search(rf'\b{re.escape(alias)}\.', text)}
+
+    def _required_joins(self, aliases):
+        """Expand the referenced aliases with the joins they depend on"""
+        required = set(aliases)
+        changed = True
+        while changed:
+            changed = False
+            for alias, _, depends_on in self.joins:
+                if alias in required:
+                    for dependency in depends_on:
+                        if dependency not in required:
+                            required.add(dependency)
+                            changed = True
+        return [clause for alias, clause, _ in self.joins if alias in required]
+
+    def sql(self):
+        if self.referenced is None:
+            joins = '\n'.join(clause for _, clause, _ in self.joins)
+        else:
+            aliases = self._referenced_aliases(self.select, self._where_sql(), *self.referenced)
+            joins = '\n'.join(self._required_joins(aliases))
+        return f"SELECT {self.select}\nFROM {self.from_clause}\n{joins}\nWHERE {self._where_sql()}"
+
+    def count_sql(self):
+        """COUNT(*) query that only keeps the joins the filters need"""
+        where_sql = self._where_sql()
+        joins = '\n'.join(self._required_joins(self._referenced_aliases(where_sql)))
+        return f"SELECT COUNT(*) AS total\nFROM {self.from_clause}\n{joins}\nWHERE {where_sql}"
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""
+CounselorHub schema migrations and index advisor
+Applies versioned schema changes on top of create_counselorhub_database.py
+and EXPLAINs the endpoint query catalog to flag full scans and filesorts.
+
+Usage:
+    python migrations.py            # apply pending migrations
+    python migrations.py status     # list applied / pending migrations
+    python migrations.py advise     # EXPLAIN the endpoint queries
+    python migrations.py photos     # move base64 users.photo values into image storage
+    python migrations.py images-layout  # move uploads into the sharded directory layout
+    python migrations.py sweep-images   # delete unreferenced uploads (see --dry-run)
+"""
+import argparse
+import sys
+import mysql.connector
+from mysql.connector import Error
+
+# Database configuration
+DB_CONFIG = {
+    'host': 'localhost',
+    'user': 'admin',
+    'password': 'admin',
+    'database': 'counselorhub',
+    'charset': 'utf8mb4'
+}
+
+MIGRATIONS_TABLE = 'schema_migrations'
+
+# Each step is ('add', table, index, columns), ('drop', table, index) or
+# ('create', table, definition); a column may be given as
+# (name, prefix_length) for TEXT columns.
+# Steps are idempotent so a migration interrupted half way (MySQL DDL is not
+# transactional) can simply be re-run. Composite indexes are added before the
+# single-column indexes they replace are dropped, so foreign keys always keep
+# a usable index.
+MIGRATIONS = [
+    (1, 'Composite indexes for list queries, drop duplicate indexes', [
+        # Secondary indexes that duplicate the primary key or a UNIQUE key
+        ('drop', 'users', 'idx_user_id'),
+        ('drop', 'users', 'idx_username'),
+        ('drop', 'users', 'idx_email'),
+        ('drop', 'classes', 'idx_class_id'),
+        ('drop', 'students', 'idx_student_id'),
+        ('drop', 'counseling_sessions', 'idx_session_id'),
+        ('drop', 'behavior_records', 'idx_record_id'),
+        ('drop', 'career_assessments', 'idx_assessment_id'),
+        ('drop', 'career_resources', 'idx_resource_id'),
+        ('drop', 'notifications', 'idx_notification_id'),
+
+        # users: counselor list filters by role and is_active, ordered by name
+        ('add', 'users', 'idx_role_active_name', ('role', 'is_active', 'name')),
+        ('drop', 'users', 'idx_role'),
+
+        # classes: list filters by is_active and grade, ordered by grade and name
+        ('add', 'classes', 'idx_active_grade_name', ('is_active', 'grade_level', 'name')),
+
+        # students: class rosters and the class delete check
+        ('add', 'students', 'idx_class_active', ('class_id', 'is_active')),
+        ('drop', 'students', 'class_id'),
+
+        # counseling_sessions: per-student history, approval queue, full list
+        ('add', 'counseling_sessions', 'idx_student_active_date', ('student_id', 'is_active', 'date')),
+        ('add', 'counseling_sessions', 'idx_approval_status_date', ('approval_status', 'date')),
+        ('add', 'counseling_sessions', 'idx_active_date', ('is_active', 'date')),
+        ('drop', 'counseling_sessions', 'idx_student_id'),
+        ('drop', 'counseling_sessions', 'idx_approval_status'),
+
+        # mental_health_assessments had no index on student_id or date at all;
+        # its queries do not filter on is_active
+        ('add', 'mental_health_assessments', 'idx_student_date', ('student_id', 'date')),
+        ('add', 'mental_health_assessments', 'idx_date', ('date',)),
+
+        # behavior_records: per-student history and full list
+        ('add', 'behavior_records', 'idx_student_active_date', ('student_id', 'is_active', 'date')),
+        ('add', 'behavior_records', 'idx_active_date', ('is_active', 'date')),
+        ('drop', 'behavior_records', 'idx_student_id'),
+
+        # career_assessments: per-student history and full list
+        ('add', 'career_assessments', 'idx_student_active_date', ('student_id', 'is_active', 'date')),
+        ('add', 'career_assessments', 'idx_active_date', ('is_active', 'date')),
+        ('drop', 'career_assessments', 'idx_student_id'),
+
+        # career_resources: type filter always comes with is_active
+        ('add', 'career_resources', 'idx_type_active', ('resource_type', 'is_active')),
+        ('drop', 'career_resources', 'idx_resource_type'),
+
+        # notifications: unread notifications per user
+        ('add', 'notifications', 'idx_user_read', ('user_id', 'is_read')),
+        ('drop', 'notifications', 'idx_user_id'),
+    ]),
+    (2, 'Prefix index on users.photo for image reference lookups', [
+        # Photos are stored as /api/images/<file> URLs; 64 chars cover them
+        ('add', 'users', 'idx_photo', (('photo', 64),)),
+    ]),
+    (3, 'Cache version table for cross-worker invalidation', [
+        # Polled by every worker when CACHE_BUS=mysql (see invalidation_bus.py)
+        ('create', 'cache_versions', """
+            `namespace` varchar(64) NOT NULL,
+            `version` bigint(20) NOT NULL DEFAULT 0,
+            `updated_at` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+            PRIMARY KEY (`namespace`)
+        """),
+    ]),
+    (4, 'updated_at indexes for ETag change stamps', [
+        # conditional.table_stamps reads MAX(updated_at) on every list/detail GET
+        ('add', 'students', 'idx_updated_at', ('updated_at',)),
+        ('add', 'users', 'idx_updated_at', ('updated_at',)),
+        ('add', 'classes', 'idx_updated_at', ('updated_at',)),
+        ('add', 'counseling_sessions', 'idx_updated_at', ('updated_at',)),
+        ('add', 'behavior_records', 'idx_updated_at', ('updated_at',)),
+    ]),
+    (5, 'Tombstones and updated_at index for the delta sync feed', [
+        # Hard deletes leave no updated_at behind; the handlers record them here (see sync_feed.py)
+        ('create', 'sync_tombstones', """
+            `id` bigint(20) NOT NULL AUTO_INCREMENT,
+            `entity` varchar(64) NOT NULL,
+            `entity_id` varchar(50) NOT NULL,
+            `deleted_at` timestamp NOT NULL DEFAULT current_timestamp(),
+            PRIMARY KEY (`id`),
+            KEY `idx_entity_deleted` (`entity`, `deleted_at`, `id`)
+        """),
+        ('add', 'mental_health_assessments', 'idx_updated_at', ('updated_at',)),
+    ]),
+]
+
+# Sample parameters for the query catalog
+SAMPLE_STUDENT_ID = '1103250001'
+SAMPLE_STAMP = '2025-01-01 00:00:00'
+SAMPLE_HORIZON = '2030-01-01 00:00:00'
+
+
+def query_catalog():
+    """
+    Representative shapes of the hot queries, with sample parameters, as
+    (name, sql, params). Built with the listing builders, keysets and field
+    sets of the handlers in app.py, so the advisor EXPLAINs what the
+    endpoints actually run.
+    """
+    # Imported here so that the schema commands do not load the app
+    import app
+    from pagination import page_query, encode_cursor
+
+    def page(name, build, fields, keyset, args, limit):
+        listing = build(args, fields.compile().select)
+        listing.prune_joins(keyset.order_by())
+        sql, params, _, _ = page_query(listing.sql(), listing.params, keyset, args, limit, 0)
+        return name, sql, tuple(params)
+
+    def classes(name, args):
+        listing = app.class_listing(args, app.CLASS_FIELDS.compile().select)
+        return name, f"{listing.sql()} ORDER BY {app.CLASS_ORDER} LIMIT %s OFFSET %s", tuple(listing.params + [12, 0])
+
+    class_students = app.class_student_listing('CLS001', app.CLASS_STUDENT_FIELDS.compile().select)
+    catalog = [
+        ('GET /api/counselors', app.COUNSELOR_QUERY.format(select=app.COUNSELOR_FIELDS.compile().select), ()),
+        classes('GET /api/classes', {}),
+        classes('GET /api/classes?grade=', {'grade': '10'}),
+        ('GET /api/classes/<id>/students',
+         f"{class_students.sql()} ORDER BY {app.CLASS_STUDENT_ORDER}", tuple(class_students.params)),
+        page('GET /api/students', app.student_listing, app.STUDENT_FIELDS, app.STUDENT_KEYSET, {}, 50),
+        page('GET /api/students?cursor=', app.student_listing, app.STUDENT_FIELDS, app.STUDENT_KEYSET,
+             {'cursor': encode_cursor(['10', '10 A', 'Ani', SAMPLE_STUDENT_ID], 'next')}, 50),
+        page('GET /api/counseling-sessions', app.session_listing, app.SESSION_FIELDS, app.SESSION_KEYSET, {}, 20),
+        page('GET /api/counseling-sessions?student=', app.session_listing, app.SESSION_FIELDS, app.SESSION_KEYSET,
+             {'student': SAMPLE_STUDENT_ID}, 20),
+        page('GET /api/counseling-sessions?approvalStatus=', app.session_listing, app.SESSION_FIELDS,
+             app.SESSION_KEYSET, {'approvalStatus': 'pending'}, 20),
+        page('GET /api/counseling-sessions?cursor=', app.session_listing, app.SESSION_FIELDS, app.SESSION_KEYSET,
+             {'cursor': encode_cursor(['2025-06-01', 'SES001'], 'next')}, 20),
+        page('GET /api/mental-health/assessments', app.assessment_listing, app.ASSESSMENT_FIELDS,
+             app.MENTAL_HEALTH_KEYSET, {}, 20),
+        page('GET /api/mental-health/assessments?studentId=', app.assessment_listing, app.ASSESSMENT_FIELDS,
+             app.MENTAL_HEALTH_KEYSET, {'studentId': SAMPLE_STUDENT_ID}, 20),
+        ('GET /api/mental-health/trends', app.TREND_QUERY, (SAMPLE_STUDENT_ID,)),
+        page('GET /api/behavior-records', app.behavior_listing, app.BEHAVIOR_FIELDS, app.BEHAVIOR_KEYSET, {}, 20),
+        page('GET /api/behavior-records?student=', app.behavior_listing, app.BEHAVIOR_FIELDS, app.BEHAVIOR_KEYSET,
+             {'student': SAMPLE_STUDENT_ID}, 20),
+        page('GET /api/career-assessments', app.career_assessment_listing, app.CAREER_ASSESSMENT_FIELDS,
+             app.CAREER_ASSESSMENT_KEYSET, {}, 20),
+        page('GET /api/career-assessments?student=', app.career_assessment_listing, app.CAREER_ASSESSMENT_FIELDS,
+             app.CAREER_ASSESSMENT_KEYSET, {'student': SAMPLE_STUDENT_ID}, 20),
+        page('GET /api/career-resources?type=', app.career_resource_listing, app.CAREER_RESOURCE_FIELDS,
+             app.CAREER_RESOURCE_KEYSET, {'type': 'article'}, 20),
+        page('GET /api/career-resources?type=&cursor=', app.career_resource_listing, app.CAREER_RESOURCE_FIELDS,
+             app.CAREER_RESOURCE_KEYSET, {'type': 'article', 'cursor': encode_cursor([SAMPLE_STAMP, 'RES001'], 'next')}, 20),
+    ]
+
+    for name, entity in app.SYNC_ENTITIES.items():
+        sql, params = entity.changed_rows_query([SAMPLE_STAMP, ''], SAMPLE_HORIZON, 500)
+        catalog.append((f"GET /api/sync?entities={name}", sql, tuple(params)))
+    sql, params = app.SYNC_ENTITIES['students'].deleted_rows_query([SAMPLE_STAMP, 0], SAMPLE_HORIZON, 500)
+    catalog.append(('GET /api/sync (tombstones)', sql, tuple(params)))
+    return catalog
+
+
+def create_connection():
+    """Create database connection"""
+    try:
+        return mysql.connector.connect(**DB_CONFIG)
+    except Error as e:
+        print(f"Error connecting to MySQL: {e}")
+        return None
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{MIGRATIONS_TABLE}` (
+            `version` int(11) NOT NULL,
+            `description` varchar(200) NOT NULL,
+            `applied_at` timestamp NOT NULL DEFAULT current_timestamp(),
+            PRIMARY KEY (`version`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci
+    """)
+
+
+def applied_versions(cursor):
+    cursor.execute(f"SELECT version FROM `{MIGRATIONS_TABLE}`")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def index_exists(cursor, table, index):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+    """, (table, index))
+    return cursor.fetchone() is not None
+
+
+def table_exists(cursor, table):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s
+        LIMIT 1
+    """, (table,))
+    return cursor.fetchone() is not None
+
+
+def step_label(step):
+    if step[0] == 'create':
+        return f"create {step[1]}"
+    return f"{step[0]} {step[1]}.{step[2]}"
+
+
+def apply_step(cursor, step):
+    """Apply one add/drop/create step, skipping it if the schema is already there"""
+    if step[0] == 'create':
+        _, table, definition = step
+        if table_exists(cursor, table):
+            return False
+        cursor.execute(
+            f"CREATE TABLE `{table}` ({definition}) ENGINE=InnoDB DEFAULT CHARSET=utf8 COLLATE=utf8_unicode_ci"
+        )
+        return True
+
+    action, table, index = step[:3]
+
+    if action == 'add':
+        if index_exists(cursor, table, index):
+            return False
+        columns = ', '.join(
+            f"`{column[0]}`({column[1]})" if isinstance(column, tuple) else f"`{column}`"
+            for column in step[3]
+        )
+        cursor.execute(f"ALTER TABLE `{table}` ADD INDEX `{index}` ({columns})")
+        return True
+
+    if action == 'drop':
+        if not index_exists(cursor, table, index):
+            return False
+        cursor.execute(f"ALTER TABLE `{table}` DROP INDEX `{index}`")
+        return True
+
+    raise ValueError(f"Unknown migration step: {action}")
+
+
+def migrate():
+    """Apply all pending migrations in version order"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        applied = applied_versions(cursor)
+
+        pending = [m for m in sorted(MIGRATIONS) if m[0] not in applied]
+        if not pending:
+            print("✓ Schema is up to date")
+            return True
+
+        for version, description, steps in pending:
+            print(f"Applying migration {version}: {description}")
+            for step in steps:
+                if apply_step(cursor, step):
+                    print(f"  ✓ {step_label(step)}")
+
+            cursor.execute(
+                f"INSERT INTO `{MIGRATIONS_TABLE}` (version, description) VALUES (%s, %s)",
+                (version, description)
+            )
+            connection.commit()
+            print(f"✓ Migration {version} applied")
+
+        return True
+
+    except Error as e:
+        print(f"Error applying migrations: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def show_status():
+    """Print applied and pending migrations"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    cursor = connection.cursor()
+    try:
+        ensure_migrations_table(cursor)
+        applied = applied_versions(cursor)
+
+        for version, description, _ in sorted(MIGRATIONS):
+            state = 'applied' if version in applied else 'pending'
+            print(f"{version:>4}  {state:<8} {description}")
+        return True
+
+    except Error as e:
+        print(f"Error reading migration status: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def explain_problems(plan, min_rows):
+    """Return the warnings for one EXPLAIN result (list of dict rows)"""
+    problems = []
+    for step in plan:
+        table = step.get('table')
+        extra = step.get('Extra') or ''
+        rows = step.get('rows') or 0
+
+        if step.get('type') == 'ALL' and rows >= min_rows:
+            problems.append(f"full table scan on {table} (~{rows} rows)")
+        if 'Using filesort' in extra:
+            problems.append(f"filesort on {table}")
+        if 'Using temporary' in extra:
+            problems.append(f"temporary table for {table}")
+    return problems
+
+
+def advise(min_rows=0):
+    """EXPLAIN every catalog query and report full scans, filesorts and temp tables"""
+    connection = create_connection()
+    if not connection:
+        return False
+
+    flagged = 0
+    cursor = connection.cursor(dictionary=True)
+    try:
+        catalog = query_catalog()
+        for name, sql, params in catalog:
+            cursor.execute(f"EXPLAIN {sql}", params)
+            plan = cursor.fetchall()
+            problems = explain_problems(plan, min_rows)
+            keys = ', '.join(f"{step['table']}:{step.get('key') or '-'}" for step in plan)
+
+            if problems:
+                flagged += 1
+                print(f"⚠ {name}  [{keys}]")
+                for problem in problems:
+                    print(f"    - {problem}")
+            else:
+                print(f"✓ {name}  [{keys}]")
+
+        print(f"\n{flagged} of {len(catalog)} queries flagged")
+        return flagged == 0
+
+    except Error as e:
+        print(f"Error running index advisor: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def migrate_photos(batch_size=100):
+    """
+    Move base64 data URL photos out of users.photo into the image service,
+    keeping only the stored image URL in the column. Safe to re-run: only
+    rows that still hold a data URL are picked up.
+    """
+    # Imported here so that the schema commands do not touch upload storage
+    from image_service import image_service
+    from app import touch_students
+
+    connection = create_connection()
+    if not connection:
+        return False
+
+    moved = 0
+    failed = 0
+    cursor = connection.cursor(dictionary=True)
+    try:
+        last_user_id = ''
+
+        while True:
+            cursor.execute("""
+                SELECT user_id, photo FROM users
+                WHERE user_id > %s AND photo LIKE %s
+                ORDER BY user_id
+                LIMIT %s
+            """, (last_user_id, 'data:image/%', batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            for row in rows:
+                last_user_id = row['user_id']
+                result = image_service.save_data_url(row['photo'])
+                if 'error' in result:
+                    failed += 1
+                    print(f"  ⚠ {row['user_id']}: {result['error']}")
+                    continue
+
+                # Skip users whose photo changed since the batch was read (the
+                # stored copy is then unreferenced and left to sweep-images)
+                cursor.execute(
+                    "UPDATE users SET photo = %s WHERE user_id = %s AND photo = %s",
+                    (result['file_info']['url'], row['user_id'], row['photo'])
+                )
+                if cursor.rowcount:
+                    # Synced students show the photo
+                    touch_students(cursor, 'user_id = %s', (row['user_id'],))
+                    moved += 1
+
+            connection.commit()
+            print(f"  ✓ {moved} photos moved so far")
+
+        print(f"✓ Moved {moved} photos into image storage ({failed} could not be decoded)")
+        return failed == 0
+
+    except Error as e:
+        print(f"Error migrating photos: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def migrate_image_layout(dry_run=False):
+    """Move uploads from the flat uploads/images directory into shard directories"""
+    from image_service import image_service
+
+    moved, removed = image_service.migrate_layout(dry_run=dry_run)
+    prefix = '(dry run) ' if dry_run else ''
+    print(f"✓ {prefix}Moved {moved} images into shard directories, removed {removed} flat thumbnails")
+    return True
+
+
+def sweep_images(dry_run=False, min_age_hours=24, batch_size=500):
+    """Delete stored images that no user photo references any more"""
+    from image_service import image_service
+
+    connection = create_connection()
+    if not connection:
+        return False
+
+    cursor = connection.cursor()
+    try:
+        def find_referenced(filenames):
+            # Chunked lookup through idx_photo instead of loading every photo
+            urls = [image_service.image_url(filename) for filename in filenames]
+            placeholders = ', '.join(['%s'] * len(urls))
+            cursor.execute(f"SELECT photo FROM users WHERE photo IN ({placeholders})", urls)
+            return {image_service.filename_from_url(row[0]) for row in cursor.fetchall()}
+
+        report = image_service.sweep_orphans(
+            find_referenced,
+            batch_size=batch_size,
+            dry_run=dry_run,
+            min_age=min_age_hours * 3600
+        )
+
+        action = 'would delete' if dry_run else 'deleted'
+        print(f"Scanned {report['scanned']} images, {report['orphaned']} unreferenced "
+              f"({report['bytes'] / (1024 * 1024):.1f} MB), {action} {report['orphaned'] if dry_run else report['deleted']}")
+        print(f"Stale unprocessed uploads: {report['stale_uploads']}")
+        for filename in report['orphans']:
+            print(f"  - {filename}")
+        return True
+
+    except Error as e:
+        print(f"Error sweeping images: {e}")
+        return False
+    finally:
+        cursor.close()
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='CounselorHub schema migrations')
+    parser.add_argument('command', nargs='?', default='migrate', choices=['migrate', 'status', 'advise', 'photos', 'images-layout', 'sweep-images'])
+    parser.add_argument('--min-rows', type=int, default=0,
+                        help='advise: ignore full scans of tables estimated below this many rows')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='photos: users updated per transaction; sweep-images: files checked per query')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='images-layout, sweep-images: report without moving or deleting files')
+    parser.add_argument('--min-age', type=float, default=24,
+                        help='sweep-images: keep files younger than this many hours')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        ok = show_status()
+    elif args.command == 'advise':
+        ok = advise(args.min_rows)
+    elif args.command == 'photos':
+        ok = migrate_photos(args.batch_size)
+    elif args.command == 'images-layout':
+        ok = migrate_image_layout(args.dry_run)
+    elif args.command == 'sweep-images':
+        ok = sweep_images(args.dry_run, args.min_age, args.batch_size)
+    else:
+        ok = migrate()
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
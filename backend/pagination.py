@@ -0,0 +1,201 @@
+"""
+Keyset (cursor) pagination helpers for list endpoints
+Cursors are opaque tokens carrying the ORDER BY key values of the boundary
+row, so the next page is found with an index seek instead of OFFSET scans
+"""
+
+import base64
+import json
+from datetime import datetime, date
+from decimal import Decimal
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a client sends a cursor that cannot be decoded"""
+
+
+class KeyColumn:
+    """
+    One ORDER BY key: SQL expression, row field it is read from and
+    direction. Keys that may be NULL are marked nullable; MySQL sorts NULL
+    before every value, so NULL rows come first ascending and last descending.
+    """
+
+    def __init__(self, expr, field, descending=False, nullable=False):
+        self.expr = expr
+        self.field = field
+        self.descending = descending
+        self.nullable = nullable
+
+    def after(self, value, op):
+        """Predicate for rows strictly past value in op ('<' or '>') order, with its params"""
+        if value is None:
+            # Past NULL ascending is any value; descending nothing follows NULL
+            return (f"{self.expr} IS NOT NULL", []) if op == '>' else ('FALSE', [])
+        if self.nullable and op == '<':
+            return f"({self.expr} < %s OR {self.expr} IS NULL)", [value]
+        return f"{self.expr} {op} %s", [value]
+
+    def equal(self, value):
+        if value is None:
+            return f"{self.expr} IS NULL", []
+        return f"{self.expr} = %s", [value]
+
+    def at_or_after(self, value, op):
+        """after() or equal(), as index ranges; None when every row qualifies"""
+        if value is None:
+            return None if op == '>' else (f"{self.expr} IS NULL", [])
+        if self.nullable and op == '<':
+            return f"({self.expr} <= %s OR {self.expr} IS NULL)", [value]
+        return f"{self.expr} {op}= %s", [value]
+
+    def value(self, row, index=None):
+        """Cursor value of a dict row, or of a tuple row given the position of each field"""
+        value = row[self.field] if index is None else row[index[self.field]]
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S.%f' if value.microsecond else '%Y-%m-%d %H:%M:%S')
+        if isinstance(value, date):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+
+def encode_cursor(values, direction):
+    payload = json.dumps({'k': values, 'd': direction}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values = payload['k']
+        direction = payload.get('d', 'next')
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursorError('Invalid cursor')
+
+    if not isinstance(values, list) or direction not in ('next', 'prev'):
+        raise InvalidCursorError('Invalid cursor')
+    # Values are bound as query parameters, which must be scalars
+    for value in values:
+        if value is not None and (isinstance(value, bool) or not isinstance(value, (str, int, float))):
+            raise InvalidCursorError('Invalid cursor')
+    return values, direction
+
+
+class Keyset:
+    """Deterministic ordering for a list query, ending in a unique key"""
+
+    def __init__(self, *keys):
+        self.keys = keys
+
+    def order_by(self, reverse=False):
+        parts = []
+        for key in self.keys:
+            descending = key.descending != reverse
+            parts.append(f"{key.expr} {'DESC' if descending else 'ASC'}")
+        return ', '.join(parts)
+
+    def seek(self, values, direction):
+        """Build the WHERE predicate that starts after (or before) the cursor row"""
+        if values is None:
+            return '', []
+        if len(values) != len(self.keys):
+            raise InvalidCursorError('Invalid cursor')
+
+        reverse = direction == 'prev'
+
+        # Built inside out: k1 > v1 OR (k1 = v1 AND (k2 > v2 OR (k2 = v2 AND ...)))
+        clause = None
+        for key, value in reversed(list(zip(self.keys, values))):
+            op = '<' if key.descending != reverse else '>'
+            after_sql, after_params = key.after(value, op)
+            if clause is None:
+                clause, clause_params = after_sql, after_params
+            else:
+                equal_sql, equal_params = key.equal(value)
+                clause = f"({after_sql} OR ({equal_sql} AND {clause}))"
+                clause_params = after_params + equal_params + clause_params
+
+        # Leading range on the first key lets MySQL use an index range scan
+        first = self.keys[0]
+        leading = first.at_or_after(values[0], '<' if first.descending != reverse else '>')
+        if leading is None:
+            return f"({clause})", clause_params
+        return f"({leading[0]} AND {clause})", leading[1] + clause_params
+
+    def page(self, rows, limit, direction, has_cursor, index=None):
+        """Trim the over-fetched rows and compute the neighbouring cursors"""
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+
+        if direction == 'prev':
+            rows.reverse()
+            prev_cursor = self._cursor(rows[0], 'prev', index) if has_more and rows else None
+            next_cursor = self._cursor(rows[-1], 'next', index) if rows else None
+        else:
+            next_cursor = self._cursor(rows[-1], 'next', index) if has_more and rows else None
+            prev_cursor = self._cursor(rows[0], 'prev', index) if has_cursor and rows else None
+
+        return rows, next_cursor, prev_cursor
+
+    def _cursor(self, row, direction, index=None):
+        return encode_cursor([key.value(row, index) for key in self.keys], direction)
+
+
+def keyset_requested(args):
+    """Cursor mode is opt-in via ?paginate=cursor or by sending a cursor"""
+    return args.get('paginate') == 'cursor' or bool(args.get('cursor'))
+
+
+def page_query(query, params, keyset, args, limit, offset):
+    """
+    (sql, params, cursor values, direction) of one page of a list query
+    (WHERE clause included, no ORDER BY/LIMIT). Offset mode returns None for
+    both cursor fields; keyset mode fetches one row more than limit to tell
+    whether another page follows.
+    """
+    if not keyset_requested(args):
+        return (
+            f"{query} ORDER BY {keyset.order_by()} LIMIT %s OFFSET %s",
+            list(params) + [limit, offset], None, None
+        )
+
+    token = args.get('cursor')
+    values, direction = decode_cursor(token) if token else (None, 'next')
+
+    seek_sql, seek_params = keyset.seek(values, direction)
+    if seek_sql:
+        query = f"{query} AND {seek_sql}"
+
+    return (
+        f"{query} ORDER BY {keyset.order_by(reverse=direction == 'prev')} LIMIT %s",
+        list(params) + seek_params + [limit + 1], values, direction
+    )
+
+
+def fetch_page(cursor, query, params, keyset, args, limit, offset, mapper=None):
+    """
+    Run a list query (WHERE clause included, no ORDER BY/LIMIT) in either
+    offset or keyset mode. Returns the rows and the extra paging fields
+    for the response (empty in offset mode). With a RowMapper (see
+    projection) the cursor returns tuples and the rows come back as items.
+    """
+    sql, sql_params, values, direction = page_query(query, params, keyset, args, limit, offset)
+    cursor.execute(sql, sql_params)
+
+    if direction is None:
+        rows = cursor.fetchall()
+        return (rows if mapper is None else list(map(mapper, rows))), {}
+
+    index = None if mapper is None else mapper.index
+    rows, next_cursor, prev_cursor = keyset.page(cursor.fetchall(), limit, direction, values is not None, index)
+    if mapper is not None:
+        rows = list(map(mapper, rows))
+
+    return rows, {
+        'nextCursor': next_cursor,
+        'prevCursor': prev_cursor,
+        'hasMore': next_cursor is not None
+    }
@@ -0,0 +1,106 @@
+"""
+In-process cache for reference data (classes, counselors)
+Entries expire after a TTL and are dropped explicitly by the handlers that
+write the underlying tables, in every worker when a shared invalidation bus
+is attached
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """
+    Bounded LRU of loaded results, grouped in namespaces ('classes',
+    'counselors'). invalidate() drops a whole namespace; a load that was
+    already running when its namespace was invalidated is returned to its
+    caller but not stored, so a write is never hidden by an older read.
+    """
+
+    def __init__(self, ttl=300.0, max_entries=1000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._cache = OrderedDict()  # (namespace, key) -> (value, stored_at)
+        self._generations = {}  # namespace -> invalidation counter
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self.bus = None
+
+    def attach(self, bus):
+        """Share invalidations with the other workers through an InvalidationBus"""
+        self.bus = bus
+        bus.subscribe(lambda namespace, version: self.drop(namespace))
+
+    def get_or_load(self, namespace, key, loader):
+        """Return the cached value for (namespace, key), calling loader() on a miss"""
+        cache_key = (namespace, key)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(cache_key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl:
+                    self._cache.move_to_end(cache_key)
+                    self._stats['hits'] += 1
+                    return entry[0]
+                del self._cache[cache_key]
+                self._stats['expirations'] += 1
+            self._stats['misses'] += 1
+            generation = self._generations.get(namespace, 0)
+
+        value = loader()
+
+        with self._lock:
+            if self._generations.get(namespace, 0) == generation:
+                self._cache[cache_key] = (value, now)
+                self._cache.move_to_end(cache_key)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+                    self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, *namespaces):
+        """Drop every entry of the given namespaces, here and in the other workers"""
+        self.drop(*namespaces)
+        if self.bus is not None:
+            for namespace in namespaces:
+                self.bus.publish(namespace)
+
+    def drop(self, *namespaces):
+        """Drop every entry of the given namespaces in this process only"""
+        with self._lock:
+            for namespace in namespaces:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+                stale = [cache_key for cache_key in self._cache if cache_key[0] == namespace]
+                for cache_key in stale:
+                    del self._cache[cache_key]
+                self._stats['invalidations'] += 1
+        logger.debug(f"Dropped reference cache namespaces: {', '.join(namespaces)}")
+
+    def clear(self):
+        with self._lock:
+            for namespace in {cache_key[0] for cache_key in self._cache}:
+                self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._cache)
+            stats['ttl'] = self.ttl
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+        if self.bus is not None:
+            stats['bus'] = self.bus.stats()
+        return stats
+
+
+# Global instance
+reference_cache = ReferenceCache(
+    ttl=float(os.environ.get('REFERENCE_CACHE_TTL', 300)),
+    max_entries=int(os.environ.get('REFERENCE_CACHE_MAX_ENTRIES', 1000))
+)
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Serving the React build (dist/)
+The build is scanned once into a manifest, so a request for an asset is a
+dict lookup and any other path (a client-side route) gets index.html from
+memory without touching the disk. A new build is picked up when index.html
+changes. Compressible files get .br/.gz variants written next to them after
+each build; Vite names bundle files after their content hash, so those may
+be cached forever while index.html is revalidated on every load.
+
+With STATIC_ACCEL_REDIRECT=/_dist/ assets are handed to nginx instead of
+being sent by the worker:
+
+    location /_dist/ {
+        internal;
+        alias /srv/counselorhub/dist/;
+        gzip_static on;
+    }
+
+Usage:
+    python static_assets.py [dist]   # write .gz/.br variants (default ../dist)
+"""
+
+import os
+import re
+import sys
+import gzip
+import time
+import hashlib
+import threading
+import mimetypes
+from flask import send_file, abort, Response
+from compression import is_compressible
+
+try:
+    import brotli
+except ImportError:  # .gz variants only
+    brotli = None
+
+# Vite output names: assets/<name>-<8 character content hash>.<ext>
+HASHED_ASSET = re.compile(r'^assets/.+-[A-Za-z0-9_-]{8}\.[a-z0-9]+$')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Variant suffix per encoding, most preferred first
+VARIANTS = (('br', '.br'), ('gzip', '.gz'))
+
+PRECOMPRESS_MIN_SIZE = 1024
+
+
+def is_hashed_asset(path):
+    return bool(HASHED_ASSET.match(path))
+
+
+def _mimetype(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+class Asset:
+    """One file of the build: its path under dist/ and the precompressed variants next to it"""
+
+    def __init__(self, path, variants):
+        self.path = path
+        self.mimetype = _mimetype(path)
+        self.variants = variants  # encoding -> path of the variant
+        self.immutable = is_hashed_asset(path)
+
+
+class IndexPage:
+    """index.html held in memory, with its compressed forms"""
+
+    def __init__(self, body, mtime):
+        self.body = body
+        self.mtime = mtime
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.encoded = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(body, quality=11)
+
+
+class StaticSite:
+    """
+    Manifest of the build in directory. index.html is stat()ed at most every
+    reload_interval seconds (0: never) and the build is rescanned when it
+    changed. With accel_prefix assets are sent as X-Accel-Redirect responses.
+    """
+
+    def __init__(self, directory, accel_prefix=None, reload_interval=2.0):
+        self.directory = os.path.abspath(directory)
+        self.accel_prefix = accel_prefix
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._manifest = {}
+        self._index = None
+        self._index_mtime = None
+        self._checked_at = 0.0
+        self._stats = {'scans': 0, 'assets_served': 0, 'index_served': 0, 'accel_redirects': 0, 'not_found': 0}
+        self.scan()
+
+    def _index_stamp(self):
+        try:
+            return os.path.getmtime(os.path.join(self.directory, 'index.html'))
+        except OSError:
+            return None
+
+    def scan(self):
+        """Read the build into a fresh manifest and swap it in"""
+        with self._lock:
+            mtime = self._index_stamp()
+            files = set()
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    files.add(os.path.relpath(os.path.join(root, name), self.directory).replace(os.sep, '/'))
+
+            manifest = {}
+            for path in files:
+                if path.endswith(('.gz', '.br', '.tmp')):
+                    continue
+                variants = {}
+                if is_compressible(_mimetype(path)):
+                    variants = {encoding: path + suffix for encoding, suffix in VARIANTS if path + suffix in files}
+                manifest[path] = Asset(path, variants)
+
+            index = None
+            if 'index.html' in manifest:
+                with open(os.path.join(self.directory, 'index.html'), 'rb') as f:
+                    index = IndexPage(f.read(), mtime)
+
+            self._manifest, self._index, self._index_mtime = manifest, index, mtime
+            self._checked_at = time.monotonic()
+            self._stats['scans'] += 1
+
+    def _reload_if_changed(self):
+        if not self.reload_interval or time.monotonic() - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = time.monotonic()
+        if self._index_stamp() != self._index_mtime:
+            self.scan()
+
+    def serve(self, path, request):
+        """An asset of the build, or index.html for any other path (client-side routes)"""
+        self._reload_if_changed()
+        asset = self._manifest.get(path)
+        if asset is None or path == 'index.html':
+            # A missing bundle file must not be answered with HTML
+            if path.startswith('assets/'):
+                self._count('not_found')
+                abort(404)
+            return self.index(request)
+        return self._send(asset, request)
+
+    def index(self, request):
+        """index.html from memory, compressed when the client accepts it"""
+        self._reload_if_changed()
+        page = self._index
+        if page is None:
+            self._count('not_found')
+            abort(404)
+
+        encoding = request.accept_encodings.best_match(list(page.encoded))
+        response = Response(page.encoded[encoding] if encoding else page.body, mimetype='text/html')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.set_etag(f"{page.etag}-{encoding}" if encoding else page.etag)
+        response.last_modified = page.mtime
+        response.cache_control.no_cache = True
+        self._count('index_served')
+        return response.make_conditional(request)
+
+    def _send(self, asset, request):
+        max_age = IMMUTABLE_MAX_AGE if asset.immutable else None
+
+        if self.accel_prefix:
+            # The proxy picks .gz/.br variants itself (gzip_static)
+            response = Response(mimetype=asset.mimetype)
+            response.headers['X-Accel-Redirect'] = f"{self.accel_prefix.rstrip('/')}/{asset.path}"
+            if max_age:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+                response.cache_control.immutable = True
+            self._count('accel_redirects')
+            return response
+
+        encoding = request.accept_encodings.best_match(list(asset.variants)) if asset.variants else None
+        filename = asset.variants[encoding] if encoding else asset.path
+        try:
+            # Without max_age the file is sent with no-cache, so it is revalidated
+            response = send_file(
+                os.path.join(self.directory, filename), mimetype=asset.mimetype,
+                conditional=True, max_age=max_age
+            )
+        except FileNotFoundError:
+            # Removed since the last scan (a deploy in progress)
+            self.scan()
+            self._count('not_found')
+            abort(404)
+
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        if asset.variants:
+            response.vary.add('Accept-Encoding')
+        if asset.immutable:
+            response.cache_control.immutable = True
+        self._count('assets_served')
+        return response
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'directory': self.directory,
+            'assets': len(self._manifest),
+            'precompressed': sum(1 for asset in self._manifest.values() if asset.variants),
+            'index_loaded': self._index is not None,
+            'accel_redirect': self.accel_prefix
+        })
+        return stats
+
+
+def _compress_file(source, target, compress):
+    with open(source, 'rb') as f:
+        data = f.read()
+    compressed = compress(data)
+    # Not worth a variant if it saves less than a tenth; an older one would be served stale
+    if len(compressed) > len(data) * 0.9:
+        _remove(target)
+        return False
+    temporary = f"{target}.tmp"
+    with open(temporary, 'wb') as f:
+        f.write(compressed)
+    os.replace(temporary, target)
+    return True
+
+
+def precompress(directory, min_size=PRECOMPRESS_MIN_SIZE):
+    """
+    Write missing or outdated .gz/.br variants of compressible files and remove
+    the outdated ones that can no longer be rebuilt; returns the number written
+    """
+    compressors = {'.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors['.br'] = lambda data: brotli.compress(data, quality=11)
+
+    written = 0
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith(('.gz', '.br', '.tmp')):
+                continue
+            source = os.path.join(root, name)
+            if not is_compressible(mimetypes.guess_type(name)[0]) or os.path.getsize(source) < min_size:
+                # A variant left from a larger build of this file would be served in its place
+                for _, suffix in VARIANTS:
+                    _remove(source + suffix)
+                continue
+            for _, suffix in VARIANTS:
+                target = source + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                    continue
+                if suffix not in compressors:
+                    _remove(target)  # outdated, and brotli is not installed to rebuild it
+                elif _compress_file(source, target, compressors[suffix]):
+                    written += 1
+    return written
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'dist')
+    directory = sys.argv[1] if len(sys.argv) > 1 else default
+    if not os.path.isdir(directory):
+        print(f"No build found at {directory}, run npm run build first")
+        sys.exit(1)
+    written = precompress(directory)
+    print(f"Wrote {written} compressed variants in {os.path.abspath(directory)}"
+          + ('' if brotli is not None else ' (gzip only, install brotli for .br)'))
+
+
+def site_from_env(directory):
+    return StaticSite(
+        directory,
+        accel_prefix=os.environ.get('STATIC_ACCEL_REDIRECT') or None,
+        reload_interval=float(os.environ.get('STATIC_RELOAD_INTERVAL', 2))
+    )
+
+
+if __name__ == '__main__':
+    main()
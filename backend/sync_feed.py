@@ -0,0 +1,172 @@
+"""
+Delta sync feed
+Clients keep a watermark and ask for the rows that changed after it. Updated
+and soft-deleted rows are found through their updated_at stamp, hard deletes
+through the tombstones the deleting handlers record in sync_tombstones.
+"""
+
+import base64
+import json
+import logging
+from mysql.connector import Error
+from pagination import Keyset, KeyColumn, InvalidCursorError
+from conditional import STAMP_GRACE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+TOMBSTONES_TABLE = 'sync_tombstones'
+NO_SUCH_TABLE = 1146  # ER_NO_SUCH_TABLE: migrations not applied yet
+
+TOMBSTONE_KEYSET = Keyset(
+    KeyColumn('deleted_at', 'sync_stamp'),
+    KeyColumn('id', 'id')
+)
+
+
+class SyncEntity:
+    """
+    One entity of the feed. query() returns a fresh ListQuery selecting the
+    rows (key column included), stamp is the SQL expression of a row's last
+    change, active tells live rows from soft-deleted ones and format turns a
+    row into the same item the list endpoint returns.
+    """
+
+    def __init__(self, name, query, stamp, key, field, active, format):
+        self.name = name
+        self.query = query
+        self.stamp = stamp
+        self.field = field
+        self.active = active
+        self.format = format
+        self.keyset = Keyset(KeyColumn(stamp, 'sync_stamp'), KeyColumn(key, field))
+
+    def changed_rows_query(self, position, horizon, limit):
+        """(sql, params) selecting up to limit + 1 rows changed after position and no later than horizon"""
+        listing = self.query()
+        listing.select += f", {self.stamp} AS sync_stamp, {self.active} AS sync_active"
+        listing.where(f"{self.stamp} <= %s", horizon)
+
+        query = listing.sql()
+        seek_sql, seek_params = self.keyset.seek(position, 'next')
+        if seek_sql:
+            query = f"{query} AND {seek_sql}"
+        return f"{query} ORDER BY {self.keyset.order_by()} LIMIT %s", listing.params + seek_params + [limit + 1]
+
+    def changed_rows(self, cursor, position, horizon, limit):
+        """Up to limit + 1 rows changed after position and no later than horizon, oldest first"""
+        cursor.execute(*self.changed_rows_query(position, horizon, limit))
+        return cursor.fetchall()
+
+    def deleted_rows_query(self, position, horizon, limit):
+        """(sql, params) selecting up to limit + 1 tombstones recorded after position and no later than horizon"""
+        query = (
+            f"SELECT id, entity_id, deleted_at AS sync_stamp FROM `{TOMBSTONES_TABLE}` "
+            "WHERE entity = %s AND deleted_at <= %s"
+        )
+        seek_sql, seek_params = TOMBSTONE_KEYSET.seek(position, 'next')
+        if seek_sql:
+            query = f"{query} AND {seek_sql}"
+        return f"{query} ORDER BY {TOMBSTONE_KEYSET.order_by()} LIMIT %s", [self.name, horizon] + seek_params + [limit + 1]
+
+    def deleted_rows(self, cursor, position, horizon, limit):
+        """Up to limit + 1 tombstones recorded after position and no later than horizon, oldest first"""
+        cursor.execute(*self.deleted_rows_query(position, horizon, limit))
+        return cursor.fetchall()
+
+    def last_tombstone(self, cursor, horizon):
+        """Position of the newest tombstone up to horizon (where a first sync starts)"""
+        cursor.execute(
+            f"SELECT id, deleted_at AS sync_stamp FROM `{TOMBSTONES_TABLE}` "
+            f"WHERE entity = %s AND deleted_at <= %s ORDER BY {TOMBSTONE_KEYSET.order_by(reverse=True)} LIMIT 1",
+            (self.name, horizon)
+        )
+        row = cursor.fetchone()
+        return [key.value(row) for key in TOMBSTONE_KEYSET.keys] if row else None
+
+
+def sync_horizon(cursor):
+    """
+    Newest change stamp a response may include. updated_at has one-second
+    resolution, so rows stamped in the last STAMP_GRACE_SECONDS can still be
+    joined by rows with the same stamp that a client would then never see.
+    """
+    cursor.execute("SELECT NOW() - INTERVAL %s SECOND AS horizon", (STAMP_GRACE_SECONDS,))
+    return cursor.fetchone()['horizon']
+
+
+def fetch_changes(cursor, entity, position, horizon, limit):
+    """
+    Changes of one entity after position ({'rows': ..., 'deleted': ...} or
+    None for a first sync), oldest first, as ('upsert', id, row) and
+    ('delete', id, None). Returns the changes, the new position and whether
+    more changes are waiting. A first sync leaves deleted rows out.
+    Needs a dictionary cursor.
+    """
+    initial = position is None
+    position = dict(position or {})
+
+    events = [(row['sync_stamp'], 1, 'rows', row) for row in entity.changed_rows(cursor, position.get('rows'), horizon, limit)]
+    if initial:
+        position['deleted'] = entity.last_tombstone(cursor, horizon)
+    else:
+        events += [(row['sync_stamp'], 0, 'deleted', row) for row in entity.deleted_rows(cursor, position.get('deleted'), horizon, limit)]
+
+    # Both streams are in stamp order; a delete sorts before a row re-created with the same stamp.
+    # Stamps are compared as text, whichever type the driver returns them as
+    events.sort(key=lambda event: (str(event[0]), event[1]))
+    has_more = len(events) > limit
+
+    changes = []
+    for _, _, stream, row in events[:limit]:
+        if stream == 'rows':
+            position['rows'] = [key.value(row) for key in entity.keyset.keys]
+            if row['sync_active']:
+                changes.append(('upsert', row[entity.field], row))
+            elif not initial:
+                changes.append(('delete', row[entity.field], None))
+        else:
+            position['deleted'] = [key.value(row) for key in TOMBSTONE_KEYSET.keys]
+            changes.append(('delete', row['entity_id'], None))
+
+    return changes, position, has_more
+
+
+def record_deletions(cursor, entity, table, key, condition, params):
+    """
+    Record tombstones for the rows of table a hard delete is about to remove,
+    in the same transaction as the DELETE
+    """
+    try:
+        cursor.execute(
+            f"INSERT INTO `{TOMBSTONES_TABLE}` (entity, entity_id) SELECT %s, {key} FROM {table} WHERE {condition}",
+            [entity] + list(params)
+        )
+    except Error as e:
+        if e.errno != NO_SUCH_TABLE:
+            raise
+        logger.warning(f"{TOMBSTONES_TABLE} is missing, run migrations; hard delete of {entity} not recorded")
+
+
+def encode_watermark(positions):
+    payload = json.dumps({'v': 1, 'p': positions}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_watermark(token):
+    """Per-entity positions of a watermark token"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        positions = payload['p']
+    except (ValueError, KeyError, TypeError):
+        raise InvalidCursorError('Invalid watermark')
+
+    if not isinstance(positions, dict):
+        raise InvalidCursorError('Invalid watermark')
+    for position in positions.values():
+        if not isinstance(position, dict):
+            raise InvalidCursorError('Invalid watermark')
+        for values in position.values():
+            if values is not None and (not isinstance(values, list) or len(values) != 2):
+                raise InvalidCursorError('Invalid watermark')
+    return positions
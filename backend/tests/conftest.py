@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend modules import each other by name (python app.py runs from backend/)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing app must not start image worker processes
+os.environ.setdefault('IMAGE_WORKERS', '0')
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from mysql.connector import Error
+
+import conditional
+
+
+class RecordingCursor:
+    def __init__(self, row=None, error=None):
+        self.row = row
+        self.error = error
+        self.executed = []
+
+    def execute(self, sql, params=None):
+        self.executed.append((sql, params))
+        if self.error is not None:
+            raise self.error
+
+    def fetchone(self):
+        return self.row
+
+
+NOW = datetime(2026, 1, 1, 12, 0, 0)
+EARLIER = NOW - timedelta(minutes=5)
+
+
+def test_stamps_read_max_updated_at_and_versions_without_counting():
+    cursor = RecordingCursor((NOW, EARLIER, 3, EARLIER, None))
+    now, stamps = conditional.table_stamps(cursor, ('students', 'users'))
+
+    sql = cursor.executed[0][0]
+    assert 'COUNT' not in sql
+    assert "namespace = 'table:students'" in sql and "namespace = 'table:users'" in sql
+    assert now == NOW
+    assert stamps == [EARLIER, 3, EARLIER, None]
+
+
+def test_stamps_from_dictionary_cursor():
+    row = {'now': NOW, 'updated_0': EARLIER, 'version_0': 7}
+    assert conditional.table_stamps(RecordingCursor(row), ('classes',)) == (NOW, [EARLIER, 7])
+
+
+def test_etag_changes_with_the_delete_version():
+    before = conditional.tables_etag(RecordingCursor((NOW, EARLIER, 1)), ('students',))
+    after = conditional.tables_etag(RecordingCursor((NOW, EARLIER, 2)), ('students',))
+    assert before and after and before != after
+
+
+def test_no_etag_while_a_change_is_recent():
+    cursor = RecordingCursor((NOW, NOW - timedelta(seconds=1), 1))
+    assert conditional.tables_etag(cursor, ('students',)) is None
+
+
+def test_bump_runs_one_upsert_per_table():
+    cursor = RecordingCursor()
+    conditional.bump_table_versions(cursor, 'students', 'users')
+    assert [params for _, params in cursor.executed] == [('table:students',), ('table:users',)]
+    assert all('version = version + 1' in sql for sql, _ in cursor.executed)
+
+
+def test_bump_tolerates_missing_versions_table():
+    cursor = RecordingCursor(error=Error(errno=conditional.NO_SUCH_TABLE))
+    conditional.bump_table_versions(cursor, 'students', 'users')
+    assert len(cursor.executed) == 1
@@ -0,0 +1,213 @@
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+import image_storage
+
+
+class StubClientError(Exception):
+    """Stands in for botocore's ClientError when boto3 is not installed"""
+
+    def __init__(self, error_response, operation_name):
+        super().__init__(error_response['Error']['Code'])
+        self.response = error_response
+
+
+class StubBody(io.RawIOBase):
+    """Like botocore's StreamingBody: read-only and not seekable"""
+
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+        self.closed_by_caller = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+    def close(self):
+        self.closed_by_caller = True
+        super().close()
+
+
+class StubS3Client:
+    """The calls S3Storage makes, against a dict of objects"""
+
+    page_size = 2
+
+    def __init__(self, client_error):
+        self.client_error = client_error
+        self.objects = {}  # key -> (data, last_modified, content_type)
+        self.ranges = []
+
+    def _missing(self, code, operation):
+        return self.client_error({'Error': {'Code': code, 'Message': 'Not Found'}}, operation)
+
+    def upload_fileobj(self, stream, bucket, key, ExtraArgs=None, Config=None):
+        self.objects[key] = (stream.read(), datetime.now(timezone.utc), (ExtraArgs or {}).get('ContentType'))
+
+    def get_object(self, Bucket, Key, Range=None):
+        if Key not in self.objects:
+            raise self._missing('NoSuchKey', 'GetObject')
+        data = self.objects[Key][0]
+        self.ranges.append(Range)
+        if Range is not None:
+            start, end = Range[len('bytes='):].split('-')
+            data = data[int(start):int(end) + 1]
+        return {'Body': StubBody(data), 'ContentLength': len(data)}
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self._missing('404', 'HeadObject')
+        data, last_modified, content_type = self.objects[Key]
+        return {'ContentLength': len(data), 'LastModified': last_modified, 'ContentType': content_type}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop(Key, None)
+
+    def delete_objects(self, Bucket, Delete):
+        for item in Delete['Objects']:
+            self.objects.pop(item['Key'], None)
+
+    def copy(self, CopySource, Bucket, Key, Config=None):
+        self.objects[Key] = self.objects[CopySource['Key']]
+
+    def get_paginator(self, operation):
+        assert operation == 'list_objects_v2'
+        return self
+
+    def paginate(self, Bucket, Prefix='', Delimiter=None):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        if Delimiter:
+            keys = [key for key in keys if Delimiter not in key[len(Prefix):]]
+        for start in range(0, len(keys), self.page_size):
+            yield {'Contents': [
+                {'Key': key, 'LastModified': self.objects[key][1], 'Size': len(self.objects[key][0])}
+                for key in keys[start:start + self.page_size]
+            ]}
+
+    def generate_presigned_url(self, operation, Params, ExpiresIn):
+        query = f"expires={ExpiresIn}"
+        if 'ResponseCacheControl' in Params:
+            query += f"&cache-control={Params['ResponseCacheControl']}"
+        return f"https://s3.example.com/{Params['Bucket']}/{Params['Key']}?{query}"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    if image_storage.boto3 is None:
+        # The client is replaced below; only the names S3Storage refers to must exist
+        monkeypatch.setattr(image_storage, 'boto3', object())
+        monkeypatch.setattr(image_storage, 'ClientError', StubClientError, raising=False)
+        monkeypatch.setattr(image_storage, 'TransferConfig', lambda **kwargs: kwargs, raising=False)
+    storage = image_storage.S3Storage('photos', prefix='/images/')
+    storage._client = StubS3Client(image_storage.ClientError)
+    return storage
+
+
+def test_backends_implement_the_interface():
+    with pytest.raises(TypeError):
+        image_storage.StorageBackend()
+
+    class Partial(image_storage.StorageBackend):
+        def open(self, key, byte_range=None):
+            return io.BytesIO()
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_save_stat_open(s3):
+    s3.save('3f/a0/photo.jpg', io.BytesIO(b'jpeg bytes'))
+
+    assert s3.client.objects['images/3f/a0/photo.jpg'][2] == 'image/jpeg'
+    size, mtime = s3.stat('3f/a0/photo.jpg')
+    assert size == 10 and mtime > 0
+    with s3.open('3f/a0/photo.jpg') as body:
+        assert body.read() == b'jpeg bytes'
+    assert s3.client.ranges == [None]
+
+
+def test_open_passes_the_range_through(s3):
+    s3.save('a.jpg', io.BytesIO(b'0123456789'))
+    assert s3.open('a.jpg', (2, 5)).read() == b'234'
+    assert s3.client.ranges == ['bytes=2-4']
+
+
+def test_missing_objects_raise_file_not_found(s3):
+    with pytest.raises(FileNotFoundError):
+        s3.open('missing.jpg')
+    with pytest.raises(FileNotFoundError):
+        s3.stat('missing.jpg')
+    assert not s3.exists('missing.jpg')
+
+
+def test_delete_move_and_list(s3):
+    for key in ('aa/1.jpg', 'aa/2.jpg', 'aa/sub/3.jpg', 'bb/4.jpg'):
+        s3.save(key, io.BytesIO(key.encode()))
+
+    assert [key for key, _, _ in s3.list('aa/')] == ['aa/1.jpg', 'aa/2.jpg', 'aa/sub/3.jpg']
+    assert [key for key, _, _ in s3.list('aa/', recursive=False)] == ['aa/1.jpg', 'aa/2.jpg']
+    assert [size for _, _, size in s3.list('bb/')] == [8]
+
+    s3.move('aa/1.jpg', 'cc/1.jpg')
+    assert not s3.exists('aa/1.jpg') and s3.open('cc/1.jpg').read() == b'aa/1.jpg'
+
+    s3.delete('bb/4.jpg')
+    s3.delete('bb/4.jpg')
+    s3.delete_prefix('aa/')
+    assert [key for key, _, _ in s3.list()] == ['cc/1.jpg']
+
+
+def test_url_is_presigned(s3):
+    url = s3.url('aa/1.jpg', expires=60, cache_control='no-cache')
+    assert url == 'https://s3.example.com/photos/images/aa/1.jpg?expires=60&cache-control=no-cache'
+
+
+def test_local_open_reads_only_the_range(tmp_path):
+    storage = image_storage.LocalStorage(str(tmp_path))
+    storage.save('aa/1.jpg', io.BytesIO(b'0123456789'))
+    with storage.open('aa/1.jpg', (2, 5)) as stream:
+        assert stream.read() == b'234'
+    with storage.open('aa/1.jpg') as f:
+        assert f.read() == b'0123456789'
+
+
+@pytest.fixture
+def served(s3, monkeypatch):
+    import app
+    monkeypatch.setattr(app.image_service, 'storage', s3)
+    monkeypatch.setattr(app.image_service, 'redirect_url', lambda key, cache_control=None: None)
+    s3.save('aa/1.jpg', io.BytesIO(b'0123456789'))
+
+    def send(headers=None, method='GET'):
+        with app.app.test_request_context('/image', method=method, headers=headers or {}):
+            response = app.send_stored('aa/1.jpg', etag='v1', max_age=60)
+            body = b''.join(response.response) if response.status_code in (200, 206) and method == 'GET' else b''
+            return response, body
+
+    return send
+
+
+def test_send_stored_streams_the_object(served, s3):
+    response, body = served()
+    assert response.status_code == 200 and body == b'0123456789'
+    assert response.content_length == 10 and response.accept_ranges == 'bytes'
+    assert s3.client.ranges == [None]
+
+
+def test_send_stored_fetches_only_the_requested_range(served, s3):
+    response, body = served({'Range': 'bytes=3-6'})
+    assert response.status_code == 206 and body == b'3456'
+    assert response.headers['Content-Range'] == 'bytes 3-6/10'
+    assert s3.client.ranges == ['bytes=3-6']
+
+
+def test_send_stored_does_not_fetch_for_not_modified_or_head(served, s3):
+    response, _ = served({'If-None-Match': '"v1"'})
+    assert response.status_code == 304
+    response, _ = served(method='HEAD')
+    assert response.status_code == 200
+    assert s3.client.ranges == []
@@ -0,0 +1,39 @@
+from invalidation_bus import InvalidationBus
+from reference_cache import ReferenceCache
+
+
+class SharedBus(InvalidationBus):
+    """Bus whose versions come from a counter shared with another worker"""
+
+    def __init__(self, counter):
+        super().__init__()
+        self.counter = counter
+
+    def _bump(self, namespace):
+        self.counter[namespace] = self.counter.get(namespace, 0) + 1
+        return self.counter[namespace]
+
+
+def test_publish_leaves_lower_versions_of_other_workers_deliverable():
+    counter = {}
+    ours, theirs = SharedBus(counter), SharedBus(counter)
+    delivered = []
+    ours.subscribe(lambda namespace, version: delivered.append(version))
+
+    theirs.publish('classes')  # version 1, not polled yet
+    ours.publish('classes')  # version 2
+    ours._deliver('classes', 1)
+    ours._deliver('classes', 2)
+    assert delivered == [1, 2]
+
+
+def test_echo_drops_a_reload_that_raced_the_writer():
+    bus = SharedBus({})
+    cache = ReferenceCache(ttl=60, max_entries=10)
+    cache.attach(bus)
+
+    cache.invalidate('classes')
+    # A reader reloads the old rows between the writer's drop and the echo
+    cache.get_or_load('classes', 'all', lambda: 'stale')
+    bus._deliver('classes', 1)
+    assert cache.get_or_load('classes', 'all', lambda: 'fresh') == 'fresh'
@@ -0,0 +1,113 @@
+import json
+import base64
+import sqlite3
+
+import pytest
+
+from pagination import KeyColumn, Keyset, InvalidCursorError, encode_cursor, decode_cursor, fetch_page
+
+# SQLite sorts NULL first ascending and last descending, like MySQL
+RESOURCES = [
+    (1, '2026-01-03'), (2, None), (3, '2026-01-01'), (4, '2026-01-03'),
+    (5, None), (6, '2026-01-02'), (7, None), (8, '2026-01-01'),
+]
+
+NEWEST_FIRST = Keyset(
+    KeyColumn('date_published', 'date_published', descending=True, nullable=True),
+    KeyColumn('resource_id', 'resource_id', descending=True)
+)
+
+BY_CLASS = Keyset(
+    KeyColumn('grade_level', 'grade_level', nullable=True),
+    KeyColumn('resource_id', 'resource_id')
+)
+
+
+class Cursor:
+    """MySQL-style %s placeholders over sqlite, rows as dicts"""
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor()
+        self.statements = []
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        self._cursor.execute(sql.replace('%s', '?'), params)
+
+    def fetchall(self):
+        names = [column[0] for column in self._cursor.description]
+        return [dict(zip(names, row)) for row in self._cursor.fetchall()]
+
+
+@pytest.fixture
+def cursor():
+    connection = sqlite3.connect(':memory:')
+    connection.execute('CREATE TABLE resources (resource_id INTEGER PRIMARY KEY, date_published TEXT, grade_level TEXT)')
+    connection.executemany('INSERT INTO resources VALUES (?, ?, ?)', [row + (row[1],) for row in RESOURCES])
+    return Cursor(connection)
+
+
+def all_ids(cursor, keyset):
+    cursor.execute(f"SELECT resource_id FROM resources ORDER BY {keyset.order_by()}")
+    return [row['resource_id'] for row in cursor.fetchall()]
+
+
+def walk(cursor, keyset, limit):
+    """Page forward to the end, then back to the start, returning the ids of each page"""
+    query = 'SELECT resource_id, date_published, grade_level FROM resources WHERE 1 = 1'
+    forward, args = [], {'paginate': 'cursor'}
+    while True:
+        rows, paging = fetch_page(cursor, query, [], keyset, args, limit, 0)
+        forward.append([row['resource_id'] for row in rows])
+        if not paging['nextCursor']:
+            break
+        args = {'cursor': paging['nextCursor']}
+
+    backward = [forward[-1]]
+    while paging['prevCursor']:
+        rows, paging = fetch_page(cursor, query, [], keyset, {'cursor': paging['prevCursor']}, limit, 0)
+        backward.insert(0, [row['resource_id'] for row in rows])
+    return forward, backward
+
+
+@pytest.mark.parametrize('keyset', [NEWEST_FIRST, BY_CLASS])
+@pytest.mark.parametrize('limit', [1, 2, 3, 5])
+def test_cursor_pages_match_offset_order_with_nulls(cursor, keyset, limit):
+    expected = all_ids(cursor, keyset)
+    forward, backward = walk(cursor, keyset, limit)
+    assert [resource_id for page in forward for resource_id in page] == expected
+    assert backward == forward
+
+
+def test_null_dates_come_last_newest_first(cursor):
+    assert all_ids(cursor, NEWEST_FIRST) == [4, 1, 6, 8, 3, 7, 5, 2]
+
+
+def test_sort_keys_are_plain_columns():
+    # COALESCE() would keep MySQL from reading the order or the seek range from an index
+    assert NEWEST_FIRST.order_by() == 'date_published DESC, resource_id DESC'
+    seek_sql, params = NEWEST_FIRST.seek(['2026-01-02', 6], 'next')
+    assert 'COALESCE' not in seek_sql
+    assert seek_sql.startswith('((date_published <= %s OR date_published IS NULL) AND ')
+    assert params[0] == '2026-01-02'
+
+
+def test_offset_mode_orders_by_the_plain_columns(cursor):
+    fetch_page(cursor, 'SELECT * FROM resources WHERE 1 = 1', [], NEWEST_FIRST, {}, 3, 3)
+    assert cursor.statements[-1].endswith('ORDER BY date_published DESC, resource_id DESC LIMIT %s OFFSET %s')
+
+
+@pytest.mark.parametrize('values', [[['nested'], 1], [{'a': 1}, 1], [True, 1]])
+def test_decode_rejects_non_scalar_values(values):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(encode_cursor(values, 'next'))
+
+
+def test_decode_accepts_scalars_and_null():
+    assert decode_cursor(encode_cursor(['2026-01-02', None, 3, 1.5], 'prev')) == (['2026-01-02', None, 3, 1.5], 'prev')
+
+
+def test_decode_rejects_garbage():
+    for token in ('!!!', base64.urlsafe_b64encode(json.dumps({'k': 'x'}).encode()).decode()):
+        with pytest.raises(InvalidCursorError):
+            decode_cursor(token)
@@ -0,0 +1,69 @@
+import pytest
+from mysql.connector import Error
+
+import app
+import migrations
+
+SAMPLE = migrations.SAMPLE_STUDENT_ID
+
+# Catalog entry -> request that should run exactly that query
+REQUESTS = {
+    'GET /api/counselors': '/api/counselors',
+    'GET /api/classes?grade=': '/api/classes?grade=10',
+    'GET /api/classes/<id>/students': '/api/classes/CLS001/students',
+    'GET /api/students': '/api/students',
+    'GET /api/counseling-sessions?student=': f'/api/counseling-sessions?student={SAMPLE}',
+    'GET /api/counseling-sessions?approvalStatus=': '/api/counseling-sessions?approvalStatus=pending',
+    'GET /api/mental-health/assessments?studentId=': f'/api/mental-health/assessments?studentId={SAMPLE}',
+    'GET /api/mental-health/trends': f'/api/mental-health/trends?student_id={SAMPLE}',
+    'GET /api/behavior-records?student=': f'/api/behavior-records?student={SAMPLE}',
+    'GET /api/career-assessments?student=': f'/api/career-assessments?student={SAMPLE}',
+    'GET /api/career-resources?type=': '/api/career-resources?type=article',
+}
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return {name: (sql, params) for name, sql, params in migrations.query_catalog()}
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    statements = []
+
+    class Cursor:
+        def execute(self, sql, params=()):
+            if sql.startswith('SELECT NOW()'):
+                raise Error(msg='no stamps here')  # conditional_get carries on without an ETag
+            statements.append((sql, tuple(params or ())))
+
+        def fetchall(self):
+            return []
+
+        def fetchone(self):
+            return None
+
+    class Connection:
+        def cursor(self, **kwargs):
+            return Cursor()
+
+    monkeypatch.setattr(app, 'get_db_connection', lambda: Connection())
+    app.reference_cache.clear()
+    return statements
+
+
+def test_catalog_params_match_placeholders(catalog):
+    for name, (sql, params) in catalog.items():
+        assert sql.count('%s') == len(params), name
+
+
+def test_catalog_covers_every_sync_entity(catalog):
+    for name in app.SYNC_ENTITIES:
+        assert f"GET /api/sync?entities={name}" in catalog
+
+
+@pytest.mark.parametrize('name', sorted(REQUESTS))
+def test_catalog_entry_is_what_the_handler_runs(catalog, executed, name):
+    separator = '&' if '?' in REQUESTS[name] else '?'
+    app.app.test_client().get(f"{REQUESTS[name]}{separator}count=none")
+    assert catalog[name] in executed
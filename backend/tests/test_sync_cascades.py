@@ -0,0 +1,96 @@
+import os
+import re
+
+import app
+
+SCHEMA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'create_counselorhub_database.py')
+
+CASCADE = re.compile(
+    r"FOREIGN KEY \(`(\w+)`\) REFERENCES `(\w+)` \(`(\w+)`\) ON DELETE CASCADE"
+)
+
+
+def cascading_foreign_keys():
+    """(table, column, parent, parent column) of every ON DELETE CASCADE in the schema"""
+    with open(SCHEMA) as f:
+        source = f.read()
+    keys = []
+    for block in source.split('CREATE TABLE `')[1:]:
+        table = block.split('`', 1)[0]
+        for column, parent, parent_column in CASCADE.findall(block):
+            keys.append((table, column, parent, parent_column))
+    return keys
+
+
+def synced_tables():
+    return {entity.query().from_clause.split()[0] for entity in app.SYNC_ENTITIES.values()}
+
+
+def expected_conditions():
+    """table -> the conditions on a user id that select the rows a user delete cascades to"""
+    keys = cascading_foreign_keys()
+    expected = {}
+    for table, column, parent, _ in keys:
+        if parent == 'users':
+            expected.setdefault(table, set()).add(f'{column} = %s')
+    # One level further down: rows of tables that cascade from a table that cascades from users
+    for table, column, parent, parent_column in keys:
+        for user_column in [c for t, c, p, _ in keys if t == parent and p == 'users']:
+            expected.setdefault(table, set()).add(
+                f'{column} IN (SELECT {parent_column} FROM {parent} WHERE {user_column} = %s)'
+            )
+    return expected
+
+
+def test_schema_has_cascades():
+    assert ('students', 'user_id', 'users', 'user_id') in cascading_foreign_keys()
+
+
+def test_user_delete_records_every_synced_cascade():
+    covered = {table: set(conditions) for _, table, _, conditions in app.USER_DELETE_CASCADES}
+    synced = synced_tables()
+    for table, conditions in expected_conditions().items():
+        if table not in synced:
+            continue
+        missing = conditions - covered.get(table, set())
+        assert not missing, f"hard_delete_user records no tombstones for {table} rows matching {missing}"
+
+
+def test_cascade_entities_match_sync_entities():
+    for entity, table, key, _ in app.USER_DELETE_CASCADES:
+        sync_entity = app.SYNC_ENTITIES[entity]
+        assert sync_entity.query().from_clause.split()[0] == table
+        assert sync_entity.keyset.keys[-1].expr.split('.')[-1] == key
+
+
+def test_hard_delete_user_records_tombstones_before_deleting(monkeypatch):
+    executed = []
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            executed.append((' '.join(sql.split()), params))
+
+        def fetchone(self):
+            return {'user_id': 'u1', 'name': 'Counselor', 'role': 'counselor'}
+
+    class Connection:
+        def cursor(self, **kwargs):
+            return Cursor()
+
+        def commit(self):
+            executed.append(('COMMIT', None))
+
+    monkeypatch.setattr(app, 'get_db_connection', lambda: Connection())
+    monkeypatch.setattr(app.reference_cache, 'invalidate', lambda *namespaces: None)
+    response = app.app.test_client().delete('/api/admin/users/u1/hard-delete')
+    assert response.status_code == 200
+
+    statements = [sql for sql, _ in executed]
+    delete_at = statements.index('DELETE FROM users WHERE user_id = %s')
+    tombstones = [
+        (sql, params) for sql, params in executed[:delete_at] if sql.startswith('INSERT INTO `sync_tombstones`')
+    ]
+    assert {params[0] for _, params in tombstones} == {'students', 'counselingSessions', 'assessments', 'behaviorRecords'}
+    for sql, params in tombstones:
+        assert params[1:] == ['u1'] * (sql.count('%s') - 1)
+    assert statements[-1] == 'COMMIT'
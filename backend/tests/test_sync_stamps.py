@@ -0,0 +1,112 @@
+import re
+
+import pytest
+
+import app
+
+ROW = {
+    'user_id': 'u1', 'username': 'ann', 'email': 'ann@example.com', 'name': 'Ann', 'role': 'student',
+    'photo': None, 'class_id': 'C1', 'grade_level': '10', 'student_count': 1, 'academic_year': '2026',
+    'teacher_name': 'Budi', 'student_id': 'S1', 'user_table_id': 'u1', 'academic_status': 'active',
+    'program': None, 'mental_health_score': None, 'last_counseling': None, 'tingkat': '10', 'kelas': '10 A',
+    'avatar': None,
+}
+
+
+@pytest.fixture
+def executed(monkeypatch):
+    statements = []
+
+    class Cursor:
+        def execute(self, sql, params=None):
+            statements.append((' '.join(sql.split()), params))
+
+        def fetchone(self):
+            return dict(ROW)
+
+    class Connection:
+        def cursor(self, **kwargs):
+            return Cursor()
+
+        def commit(self):
+            statements.append(('COMMIT', None))
+
+    monkeypatch.setattr(app, 'get_db_connection', lambda: Connection())
+    monkeypatch.setattr(app.reference_cache, 'invalidate', lambda *namespaces: None)
+    return statements
+
+
+def touches(statements):
+    """Conditions of the students touches issued before the commit"""
+    commit = [sql for sql, _ in statements].index('COMMIT')
+    return [
+        (sql.split(' WHERE ', 1)[1], params) for sql, params in statements[:commit]
+        if sql.startswith('UPDATE students SET updated_at = CURRENT_TIMESTAMP WHERE')
+    ]
+
+
+def touched_tables(statements):
+    """Tables whose updated_at is moved before the commit, with the conditions used"""
+    commit = [sql for sql, _ in statements].index('COMMIT')
+    touched = {}
+    for sql, params in statements[:commit]:
+        if ' SET updated_at = CURRENT_TIMESTAMP WHERE ' in sql:
+            table = sql.split()[1]
+            touched[table] = (sql.split(' WHERE ', 1)[1], params)
+    return touched
+
+
+def test_sync_stamps_are_indexed_columns():
+    for entity in app.SYNC_ENTITIES.values():
+        assert re.fullmatch(r'(\w+\.)?updated_at', entity.keyset.keys[0].expr), entity.name
+
+
+def test_user_name_change_touches_their_student(executed):
+    response = app.app.test_client().put('/api/users/u1', json={'name': 'Ann B'})
+    assert response.status_code == 200
+    assert touches(executed) == [('user_id = %s', ('u1',))]
+
+
+def test_user_name_change_touches_the_items_showing_it(executed):
+    response = app.app.test_client().put('/api/users/u1', json={'name': 'Ann B'})
+    assert response.status_code == 200
+    touched = touched_tables(executed)
+    # Counselor, reporter and assessor names, and the student's name on their own sessions and records
+    assert 'counselor_id = %s' in touched['counseling_sessions'][0]
+    assert 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)' in touched['counseling_sessions'][0]
+    assert 'reporter_id = %s' in touched['behavior_records'][0]
+    assert 'student_id IN (SELECT student_id FROM students WHERE user_id = %s)' in touched['behavior_records'][0]
+    assert touched['mental_health_assessments'] == ('assessor_id = %s', ('u1',))
+    assert all(set(params) == {'u1'} for _, params in touched.values())
+
+
+def test_student_name_change_touches_the_items_showing_it(executed):
+    response = app.app.test_client().put('/api/students/S1', json={'name': 'Ann B'})
+    assert response.status_code == 200
+    touched = touched_tables(executed)
+    assert {'counseling_sessions', 'behavior_records', 'mental_health_assessments'} <= set(touched)
+    assert touched['counseling_sessions'][1] == ('u1', 'u1')
+
+
+def test_user_photo_change_leaves_other_items_alone(executed):
+    response = app.app.test_client().put('/api/users/u1', json={'photo': None})
+    assert response.status_code == 200
+    assert set(touched_tables(executed)) == {'students'}
+
+
+def test_user_role_change_leaves_students_alone(executed):
+    response = app.app.test_client().put('/api/users/u1', json={'role': 'student'})
+    assert response.status_code == 200
+    assert touches(executed) == []
+
+
+def test_class_rename_touches_its_students(executed):
+    response = app.app.test_client().put('/api/classes/C1', json={'name': '10 B'})
+    assert response.status_code == 200
+    assert touches(executed) == [('class_id = %s', ('C1',))]
+
+
+def test_class_teacher_change_leaves_students_alone(executed):
+    response = app.app.test_client().put('/api/classes/C1', json={'teacherName': 'Sari'})
+    assert response.status_code == 200
+    assert touches(executed) == []